@@ -1,6 +1,6 @@
 from django.contrib import admin
 from .models import Production, ProdUser, Invitation
-from .forms import ProdUserAdminForm
+from .membership import add_member
 
 
 class ProdUserAdmin(admin.ModelAdmin):
@@ -9,10 +9,7 @@ class ProdUserAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'production', 'user', 'is_owner', 'is_editor')
     list_filter = ('production',)
     
-    # バリデーションのためのカスタムフォーム
-    form = ProdUserAdminForm
-    
-    # fields は Form の Meta でも定義しているが、表示順を維持するため
+    # 表示順を維持するため
     fields = ('production', 'user', 'is_owner', 'is_editor')
 
     def add_view(self,request,extra_content=None):
@@ -26,6 +23,25 @@ class ProdUserAdmin(admin.ModelAdmin):
         '''
         self.readonly_fields = ('production','user')
         return super(ProdUserAdmin, self).change_view(request, object_id)
+    
+    def save_model(self, request, obj, form, change):
+        '''保存する
+        
+        追加では、同じ production, user のレコードがあれば何もしない。
+        重複はフォームの検証 (一意制約による) で先に弾かれているが、
+        同時に追加された場合も DB の一意制約で重複しない
+        '''
+        if change:
+            return super().save_model(request, obj, form, change)
+        
+        prod_user = add_member(obj.production, obj.user,
+            is_owner=obj.is_owner, is_editor=obj.is_editor)
+        # 変更履歴と遷移先のために、追加された (または既存の) レコードの id を取る
+        if prod_user is not None:
+            obj.pk = prod_user.pk
+        else:
+            obj.pk = ProdUser.objects.values_list('pk', flat=True)\
+                .get(production=obj.production, user=obj.user)
 
 
 admin.site.register(Production)
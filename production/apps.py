@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class ProductionConfig(AppConfig):
     name = 'production'
+    
+    def ready(self):
+        '''メンバー情報のキャッシュを無効化するシグナルと、
+        キャッシュの設定の検査を登録する
+        '''
+        from . import signals, checks
@@ -0,0 +1,164 @@
+'''ベンチマークのシナリオ
+
+各アプリの bench モジュールで @scenario を付けた関数を登録しておくと、
+manage.py bench で実行できる。シナリオ内で作ったレコードは
+実行後にロールバックされる。
+'''
+import time
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from .models import Production, ProdUser
+
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    '''ベンチマークのシナリオを登録するデコレータ
+    
+    シナリオは size, repeat を受け取り、
+    (ラベル, 1 回あたりのクエリ数, 1 回あたりのミリ秒) のリストを返す。
+    タプルの後ろに {単位: 値} の dict を足すと、それも表示される
+    '''
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def measure(label, func, repeat=1):
+    '''func を repeat 回実行し、1 回あたりのクエリ数と時間を返す
+    '''
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = time.perf_counter() - start
+    return (label, len(ctx.captured_queries) / repeat,
+        elapsed * 1000 / repeat)
+
+
+def create_production(members=1, prefix='bench'):
+    '''ベンチマーク用の公演とメンバーを作る
+    
+    Returns
+    -------
+    production : Production
+    prod_users : list of ProdUser
+        先頭は owner
+    '''
+    user_model = get_user_model()
+    users = user_model.objects.bulk_create([
+        user_model(username=f'{prefix}{i}', first_name=f'{i}')
+        for i in range(members)])
+    # SQLite 以外では bulk_create で pk がセットされないことがあるので取り直す
+    users = list(user_model.objects.filter(
+        username__startswith=prefix).order_by('id'))
+    
+    production = Production.objects.create(name=prefix)
+    ProdUser.objects.bulk_create([
+        ProdUser(production=production, user=user, is_owner=(i == 0))
+        for i, user in enumerate(users)])
+    prod_users = list(ProdUser.objects.filter(
+        production=production).order_by('id'))
+    return production, prod_users
+
+
+def get_page(view_class, user, path='/', **kwargs):
+    '''ミドルウェアを通さずに view を呼び、レンダリングまで行う
+    '''
+    request = RequestFactory().get(path)
+    request.user = user
+    response = view_class.as_view()(request, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+@scenario('permission_memo')
+def bench_permission_memo(size=100, repeat=20):
+    '''1 リクエスト内でアクセス権を 3 回検査する時のコスト
+    
+    legacy は filter() -> len() -> [0] を毎回行う以前の実装
+    '''
+    from django.views import View
+    from .view_func import accessing_prod_user, test_edit_permission,\
+        test_owner_permission
+    
+    production, prod_users = create_production(members=size)
+    owner = prod_users[0].user
+    
+    def legacy():
+        for _ in range(3):
+            prod_users = ProdUser.objects.filter(
+                production__pk=production.id, user=owner)
+            if len(prod_users) > 0:
+                prod_users[0].production
+    
+    def memo():
+        view = View()
+        view.request = RequestFactory().get('/')
+        view.request.user = owner
+        view.kwargs = {'prod_id': production.id}
+        accessing_prod_user(view).production
+        test_edit_permission(view)
+        test_owner_permission(view)
+    
+    return [
+        measure('legacy filter/len/index x3', legacy, repeat),
+        measure('request memo x3', memo, repeat),
+    ]
+
+
+@scenario('usr_list')
+def bench_usr_list(size=100, repeat=20):
+    '''メンバー一覧ページ
+    '''
+    from .views import UsrList
+    
+    production, prod_users = create_production(members=size)
+    owner = prod_users[0].user
+    return [measure(f'usr_list ({size} members)',
+        lambda: get_page(UsrList, owner, prod_id=production.id), repeat)]
+
+
+@scenario('invt_autocomplete')
+def bench_invt_autocomplete(size=10000, repeat=20):
+    '''招待する人の ID の補完
+    
+    size 人のユーザを作り、キャッシュが無い時と有る時の応答時間を比べる。
+    大きな規模では --size で指定する (例: --size 1000000)
+    '''
+    from django.core.cache import cache
+    from .views import InvtAutocomplete
+    
+    production, prod_users = create_production(members=1, prefix='owner')
+    owner = prod_users[0].user
+    
+    user_model = get_user_model()
+    batch_size = 10000
+    for start in range(0, size, batch_size):
+        user_model.objects.bulk_create([
+            user_model(username=f'user{i:07d}')
+            for i in range(start, min(start + batch_size, size))])
+    
+    prefixes = [f'USER{i:03d}' for i in range(repeat)]
+    
+    def search(use_cache):
+        def func():
+            for prefix in prefixes:
+                if not use_cache:
+                    cache.clear()
+                get_page(InvtAutocomplete, owner,
+                    f'/?q={prefix}', prod_id=production.id)
+        return func
+    
+    cold = measure(f'autocomplete cold ({size} users, x{repeat})',
+        search(False))
+    # 一通り検索してキャッシュに載せてから測る
+    search(True)()
+    warm = measure(f'autocomplete warm ({size} users, x{repeat})',
+        search(True))
+    return [cold, warm]
@@ -0,0 +1,36 @@
+'''キャッシュの設定の検査
+
+メンバー情報・ページの版数・作り直しのロックは、全ワーカーで
+共有するキャッシュに置くのが望ましい。プロセスごとのキャッシュでは、
+取り消した権限が他のワーカーに残らないよう毎回 DB で確かめるので、
+その分クエリが増える。
+'''
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+# ワーカー間で共有されないキャッシュバックエンド
+LOCAL_BACKENDS = (LocMemCache, FileBasedCache)
+
+
+def is_shared_cache(alias):
+    '''キャッシュが全ワーカーで共有されるか
+    '''
+    return not isinstance(caches[alias], LOCAL_BACKENDS)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    '''本番環境でプロセスごとのキャッシュを使っていれば警告する
+    '''
+    if settings.DEBUG or is_shared_cache('default'):
+        return []
+    return [checks.Warning(
+        'default キャッシュがワーカー間で共有されません',
+        hint='環境変数 CACHE_BACKEND, CACHE_LOCATION で'
+            '共有するキャッシュを指定してください',
+        id='production.W001',
+    )]
@@ -0,0 +1,112 @@
+'''削除待ちの公演の削除
+
+ProdDelete は公演に削除の印を付けるだけで、関連レコードの削除は
+manage.py delete_productions が行う。Django の CASCADE は関連レコードを
+全てメモリに読み込むので、タスクの多い公演ではリクエスト中に終わらない。
+ここでは関連レコードを batch_size 件ずつ、直接 DELETE する。
+'''
+from django.db import transaction
+from .models import Production
+
+
+def pending_productions():
+    '''削除待ちの公演 (受付順)
+    '''
+    return Production.objects.filter(deletion_requested_at__isnull=False)\
+        .order_by('deletion_requested_at', 'id')
+
+
+def child_models():
+    '''Production を CASCADE で参照しているモデルと、その外部キー名
+    
+    他の子モデルから参照されているモデルが後になるように並べる
+    (RehearsalBigram -> Rehearsal -> ProdUser の順)
+    '''
+    remaining = [(relation.related_model, relation.field.name)
+        for relation in Production._meta.related_objects
+        if relation.one_to_many]
+    
+    def referenced(model):
+        return any(field.related_model is model
+            for other, _ in remaining if other is not model
+            for field in other._meta.fields if field.is_relation)
+    
+    # 残りのどれからも参照されていないものから順に取り出す
+    ordered = []
+    while remaining:
+        child = next((child for child in remaining
+            if not referenced(child[0])), remaining[0])
+        ordered.append(child)
+        remaining.remove(child)
+    return ordered
+
+
+def can_raw_delete(model, models):
+    '''model のレコードをシグナルや CASCADE なしに DELETE してよいか
+    
+    model を参照しているのが、同じ公演の子モデルだけならよい
+    (それらは先に削除されている)
+    '''
+    return all(relation.related_model in models
+        for relation in model._meta.related_objects)
+
+
+def raw_delete(queryset):
+    '''queryset のレコードを、読み込まずシグナルも送らずに 1 回の DELETE で削除する
+    
+    非公開の QuerySet._raw_delete() を使う (Django 3.2。requirements.txt で
+    バージョンを固定しているので、上げる時はここを確かめること)。
+    delete() は Collector が行を全て読み込み、1 行ずつシグナルを送るので、
+    大量の行を消すバッチ処理には使えない。
+    参照している行の CASCADE や SET_NULL も行われないので、
+    参照しているレコードは先に削除しておくこと
+    
+    Returns
+    -------
+    count : int
+        削除した件数
+    '''
+    return queryset._raw_delete(queryset.db)
+
+
+def delete_production(production, batch_size=1000, progress=None):
+    '''公演の関連レコードを batch_size 件ずつ削除し、最後に公演を削除する
+    
+    1 回の DELETE ごとにトランザクションを分けるので、途中で止まっても
+    次に実行した時に続きから削除される
+    
+    Parameters
+    ----------
+    progress : callable
+        1 回削除するごとに (モデル, 削除した件数) で呼ばれる
+    
+    Returns
+    -------
+    count : int
+        削除した関連レコードの件数
+    '''
+    children = child_models()
+    models = {model for model, _ in children}
+    
+    count = 0
+    for model, field_name in children:
+        rows = model._base_manager.filter(**{field_name: production.id})
+        raw = can_raw_delete(model, models)
+        while True:
+            with transaction.atomic():
+                ids = list(rows.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                batch = model._base_manager.filter(id__in=ids)
+                if raw:
+                    deleted = raw_delete(batch)
+                else:
+                    # 他から参照されているモデルは CASCADE 等を Django に任せる
+                    # (batch_size 件ずつなので、読み込むのも batch_size 件)
+                    deleted, _ = batch.delete()
+            count += deleted
+            if progress:
+                progress(model, deleted)
+    
+    production.delete()
+    return count
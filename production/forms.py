@@ -1,37 +1,107 @@
+from datetime import datetime, timezone
 from django import forms
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from .models import ProdUser, Invitation
+from . import page_cache
 #import accounts
 
 
-class ProdUserAdminForm(forms.ModelForm):
-    '''管理サイトで公演ユーザを編集する時のフォーム
+class InvitationBulkForm(forms.Form):
+    '''複数のユーザをまとめて招待するフォーム
     '''
-    class Meta:
-        model = ProdUser
-        fields = ('production', 'user', 'is_owner', 'is_editor')
-
-    def clean_user(self):
-        '''ユーザのバリデーション
-        
-        user を検証しているという事は、追加フォームである
+    # 1 回に招待できる人数
+    MAX_USERNAMES = 100
+    
+    # 招待の結果
+    INVITED = '招待しました'
+    NOT_FOUND = 'ユーザが見つかりません'
+    ALREADY_MEMBER = 'すでにメンバーです'
+    ALREADY_INVITED = 'すでに招待中です'
+    
+    usernames = forms.CharField(label='INVITED ID',
+        widget=forms.Textarea(attrs={'rows': 10,
+            'placeholder': '1 行に 1 人 (カンマや空白で区切っても可)'}))
+    
+    def clean_usernames(self):
+        '''入力された ID を、重複を除いて入力順のリストにする
         '''
-        # 追加しようとしている user
-        user = self.cleaned_data['user']
+        words = self.cleaned_data['usernames'].replace(',', ' ').split()
+        usernames = list(dict.fromkeys(words))
+        if len(usernames) > self.MAX_USERNAMES:
+            raise forms.ValidationError(
+                f'一度に招待できるのは {self.MAX_USERNAMES} 人までです。')
+        return usernames
+    
+    def save(self, production, inviter, exp_dt):
+        '''招待を保存する
         
-        # prod_id が入力されていなければ、そっちで検証されるのでスルー
-        if 'production' not in self.cleaned_data:
-            return user
+        ユーザの検索と重複の検査はそれぞれ 1 回のクエリで行い、
+        招待できるユーザの招待を 1 回の INSERT でまとめて保存する。
+        期限切れの招待は削除して、招待し直す
+        
+        Returns
+        -------
+        report : list of (str, str)
+            入力された ID ごとの (ID, 結果)
+        '''
+        usernames = self.cleaned_data['usernames']
+        user_model = get_user_model()
+        now = datetime.now(timezone.utc)
         
-        # 同じ production, user のレコードがあるか検索
-        production = self.cleaned_data['production']
-        dupe = ProdUser.objects.filter(production=production, user=user)
+        with transaction.atomic():
+            # 入力された ID のユーザ
+            users = {user.username: user for user in
+                user_model.objects.filter(username__in=usernames)}
+            
+            # そのうち、メンバーのユーザと招待中のユーザ
+            member_ids = set(ProdUser.objects.filter(production=production,
+                user__in=users.values()).values_list('user_id', flat=True))
+            invitations = dict(Invitation.objects.filter(
+                production=production, invitee__in=users.values())
+                .values_list('invitee_id', 'exp_dt'))
+            invitee_ids = {invitee_id for invitee_id, invitation_exp_dt
+                in invitations.items() if invitation_exp_dt > now}
+            
+            # 期限切れの招待は、一意制約に掛からないよう削除する
+            expired_ids = set(invitations) - invitee_ids
+            if expired_ids:
+                Invitation.objects.filter(production=production,
+                    invitee__in=expired_ids).delete()
+            
+            results = {}
+            new_invitations = {}
+            for username in usernames:
+                user = users.get(username)
+                if not user:
+                    results[username] = self.NOT_FOUND
+                elif user.id in member_ids:
+                    results[username] = self.ALREADY_MEMBER
+                elif user.id in invitee_ids:
+                    results[username] = self.ALREADY_INVITED
+                else:
+                    results[username] = self.INVITED
+                    new_invitations[username] = Invitation(
+                        production=production, inviter=inviter, invitee=user,
+                        exp_dt=exp_dt)
+            
+            if new_invitations:
+                try:
+                    with transaction.atomic():
+                        Invitation.objects.bulk_create(
+                            new_invitations.values())
+                except IntegrityError:
+                    # 検査の後に同時に招待された人がいれば、
+                    # 1 件ずつ保存して、実際に招待できたかを確かめる
+                    for username, invitation in new_invitations.items():
+                        try:
+                            with transaction.atomic():
+                                invitation.save()
+                        except IntegrityError:
+                            results[username] = self.ALREADY_INVITED
+                page_cache.bump(production.id)
         
-        # 追加なので、同じ production, user のレコードが見つかったら重複
-        if len(dupe) > 0:
-            raise forms.ValidationError('{} はすでに {} のユーザです。'
-                .format(user, production))
-        return user
+        return [(username, results[username]) for username in usernames]
 
 
 # Production 新規作成時の処理をオーバーライドするサンプルコード
@@ -0,0 +1,75 @@
+'''EXPLAIN で検査する頻出クエリ
+
+各アプリの hot_queries モジュールで @hot_query を付けた関数を登録しておくと、
+manage.py explain_hot_queries で実行計画を検査できる。
+関数はサンプルの ProdUser を受け取り、QuerySet を返す。
+'''
+from datetime import datetime, timezone
+from django.contrib.auth import get_user_model
+from .models import ProdUser, Invitation
+
+
+HOT_QUERIES = {}
+
+
+def hot_query(name):
+    '''頻出クエリを登録するデコレータ
+    '''
+    def register(func):
+        HOT_QUERIES[name] = func
+        return func
+    return register
+
+
+@hot_query('membership')
+def membership(prod_user):
+    '''ユーザの参加している公演 (メンバー情報のキャッシュ)
+    '''
+    return ProdUser.objects.filter(user_id=prod_user.user_id)
+
+
+@hot_query('accessing_prod_user')
+def accessing_prod_user(prod_user):
+    '''アクセス中の ProdUser
+    '''
+    return ProdUser.objects.filter(production_id=prod_user.production_id,
+        user_id=prod_user.user_id)
+
+
+@hot_query('usr_list')
+def usr_list(prod_user):
+    '''公演のメンバー一覧
+    '''
+    return ProdUser.objects.filter(production_id=prod_user.production_id)
+
+
+@hot_query('invitations_for_invitee')
+def invitations_for_invitee(prod_user):
+    '''ユーザへの有効な招待 (課題一覧)
+    '''
+    now = datetime.now(timezone.utc)
+    return Invitation.objects.filter(invitee_id=prod_user.user_id,
+        exp_dt__gt=now)
+
+
+@hot_query('invitations_for_production')
+def invitations_for_production(prod_user):
+    '''公演の招待 (メンバー一覧)
+    '''
+    return Invitation.objects.filter(production_id=prod_user.production_id)
+
+
+@hot_query('invitee_autocomplete')
+def invitee_autocomplete(prod_user):
+    '''ID の前方一致 (招待する人の補完)
+    '''
+    return get_user_model().objects.filter(username__istartswith='a')
+
+
+@hot_query('expired_invitations')
+def expired_invitations(prod_user):
+    '''期限切れの招待 (purge_expired_invitations)
+    '''
+    now = datetime.now(timezone.utc)
+    return Invitation.objects.filter(exp_dt__lte=now).order_by('exp_dt')\
+        .values('id')
@@ -0,0 +1,44 @@
+'''期限切れの招待の削除
+
+manage.py purge_expired_invitations から使う。
+'''
+from datetime import datetime, timezone
+from django.db import transaction
+from .deletion import raw_delete
+from .models import Invitation
+from . import page_cache
+
+
+def purge_expired_invitations(batch_size=1000, now=None):
+    '''期限切れの招待を batch_size 件ずつ削除する
+    
+    期限の古い順に exp_dt のインデックスで探す。1 回の DELETE を小さくし、
+    長いロックや大きなトランザクションにならないようにする
+    
+    Parameters
+    ----------
+    now : datetime
+        この日時までに期限が切れた招待を削除する (省略すると現在)
+    
+    Returns
+    -------
+    count : int
+        削除した件数
+    '''
+    if now is None:
+        now = datetime.now(timezone.utc)
+    expired = Invitation.objects.filter(exp_dt__lte=now).order_by('exp_dt')
+    
+    count = 0
+    while True:
+        with transaction.atomic():
+            rows = list(expired.values_list('id',
+                'production_id')[:batch_size])
+            if not rows:
+                return count
+            # 1 件ずつシグナルを送らないよう直接 DELETE し、
+            # 公演の版数はまとめて上げる
+            batch = Invitation.objects.filter(id__in=[id for id, _ in rows])
+            deleted = raw_delete(batch)
+            page_cache.bump(*{prod_id for _, prod_id in rows})
+        count += deleted
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.module_loading import autodiscover_modules
+from production.bench import SCENARIOS
+
+
+class Rollback(Exception):
+    '''ベンチマークで作ったレコードを捨てるための例外
+    '''
+
+
+class Command(BaseCommand):
+    help = 'ベンチマークのシナリオを実行し、クエリ数と時間を表示する'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+            help='実行するシナリオ (省略すると全て)')
+        parser.add_argument('--size', type=int,
+            help='シナリオで作るレコード数')
+        parser.add_argument('--repeat', type=int,
+            help='計測の繰り返し回数')
+        parser.add_argument('--list', action='store_true',
+            help='シナリオの一覧を表示する')
+    
+    def handle(self, *args, **options):
+        # 各アプリの bench モジュールからシナリオを集める
+        autodiscover_modules('bench')
+        
+        if options['list']:
+            for name in sorted(SCENARIOS):
+                self.stdout.write(name)
+            return
+        
+        names = options['scenarios'] or sorted(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError('不明なシナリオ: ' + ', '.join(unknown))
+        
+        # 指定されたパラメタだけをシナリオに渡す
+        kwargs = {key: options[key] for key in ('size', 'repeat')
+            if options[key] is not None}
+        
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            try:
+                with transaction.atomic():
+                    results = SCENARIOS[name](**kwargs)
+                    raise Rollback
+            except Rollback:
+                pass
+            for label, queries, msec, *extra in results:
+                line = f'  {label:<40} {queries:8.1f} queries {msec:10.2f} ms'
+                # シナリオ独自の計測値 (メモリなど) があれば続けて表示する
+                for metrics in extra:
+                    line += ''.join(f' {value} {unit}'
+                        for unit, value in metrics.items())
+                self.stdout.write(line)
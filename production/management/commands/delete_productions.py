@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from production.deletion import pending_productions, delete_production
+
+
+class Command(BaseCommand):
+    help = '削除待ちの公演を、関連レコードごと少しずつ削除する'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='1 回に削除する行数')
+        parser.add_argument('--interval', type=int, default=0,
+            help='指定すると、この秒数ごとに削除を繰り返す (worker として動かす)')
+    
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        while True:
+            for production in pending_productions():
+                count = delete_production(production,
+                    batch_size=options['batch_size'],
+                    progress=self.progress)
+                self.stdout.write(self.style.SUCCESS(
+                    f'{production} を削除しました (関連レコード {count} 件)'))
+            
+            if options['interval'] <= 0:
+                return
+            time.sleep(options['interval'])
+    
+    def progress(self, model, count):
+        '''1 回削除するごとに表示する
+        '''
+        if self.verbosity >= 2:
+            self.stdout.write(f'  {model._meta.label}: {count} 件')
@@ -0,0 +1,101 @@
+import json
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.module_loading import autodiscover_modules
+from production.hot_queries import HOT_QUERIES
+from production.models import ProdUser
+
+
+class Command(BaseCommand):
+    help = '頻出クエリを EXPLAIN し、大きなテーブルのシーケンシャルスキャンを検出する'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*',
+            help='検査するクエリ (省略すると全て)')
+        parser.add_argument('--min-rows', type=int, default=10000,
+            help='この行数以上のテーブルを「大きい」とみなす')
+        parser.add_argument('--verbose-plan', action='store_true',
+            help='実行計画を表示する')
+    
+    def handle(self, *args, **options):
+        # 各アプリの hot_queries モジュールからクエリを集める
+        autodiscover_modules('hot_queries')
+        
+        names = options['queries'] or sorted(HOT_QUERIES)
+        unknown = [name for name in names if name not in HOT_QUERIES]
+        if unknown:
+            raise CommandError('不明なクエリ: ' + ', '.join(unknown))
+        
+        # パラメタに使うサンプルの ProdUser (なければ存在しない ID)
+        sample = ProdUser.objects.order_by('id').first()\
+            or ProdUser(id=0, production_id=0, user_id=0)
+        
+        failures = []
+        for name in names:
+            queryset = HOT_QUERIES[name](sample)
+            plan, scanned = self.explain(queryset)
+            large = [table for table in scanned
+                if self.table_rows(table) >= options['min_rows']]
+            
+            if large:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f'{name}: seq scan on ' + ', '.join(large)))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: ok'))
+            if options['verbose_plan']:
+                self.stdout.write(plan)
+        
+        if failures:
+            raise CommandError(
+                'シーケンシャルスキャンがあります: ' + ', '.join(failures))
+    
+    def explain(self, queryset):
+        '''実行計画と、シーケンシャルスキャンされるテーブルを返す
+        '''
+        if connection.vendor == 'postgresql':
+            plan = queryset.explain(format='json')
+            return plan, sorted(set(self.pg_seq_scans(json.loads(plan))))
+        
+        plan = queryset.explain()
+        return plan, sorted(set(self.sqlite_seq_scans(plan)))
+    
+    def sqlite_seq_scans(self, plan):
+        '''SQLite の実行計画から、インデックスを使わない
+        "SCAN <table>" のテーブルを探す
+        
+        行ごとにテーブル名と残りに分けてから USING を見る
+        (否定先読みだとテーブル名を途中で切ってしまうため)
+        '''
+        for line in plan.splitlines():
+            match = re.search(r'\bSCAN (?:TABLE )?(\w+)(.*)$', line)
+            if match and 'USING' not in match.group(2):
+                yield match.group(1)
+    
+    def pg_seq_scans(self, node):
+        '''PostgreSQL の JSON 形式の実行計画から Seq Scan のテーブルを探す
+        '''
+        if isinstance(node, list):
+            for child in node:
+                yield from self.pg_seq_scans(child)
+        elif isinstance(node, dict):
+            if node.get('Node Type') == 'Seq Scan':
+                yield node['Relation Name']
+            for key in ('Plan', 'Plans'):
+                if key in node:
+                    yield from self.pg_seq_scans(node[key])
+    
+    def table_rows(self, table):
+        '''テーブルの (おおよその) 行数
+        '''
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [table])
+                row = cursor.fetchone()
+                return row[0] if row else 0
+            table = connection.ops.quote_name(table)
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            return cursor.fetchone()[0]
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from production.invitations import purge_expired_invitations
+
+
+class Command(BaseCommand):
+    help = '期限切れの招待を削除する'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='1 回に削除する行数')
+        parser.add_argument('--interval', type=int, default=0,
+            help='指定すると、この秒数ごとに削除を繰り返す (worker として動かす)')
+    
+    def handle(self, *args, **options):
+        while True:
+            count = purge_expired_invitations(
+                batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'期限切れの招待を {count} 件削除しました'))
+            
+            if options['interval'] <= 0:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,176 @@
+'''ユーザごとの公演メンバー情報のキャッシュ
+
+ユーザが参加している公演の
+{production_id: (prod_user_id, is_owner, is_editor, 公演名)}
+を Django のキャッシュに保存する。ProdUser, Production の保存・削除時に
+シグナルで無効化される (signals.py)。
+アクセス権の検査に使うので、キャッシュが全ワーカーで共有されない
+(LocMemCache など) 時は、他のワーカーでの変更がシグナルで破棄されない。
+その時はユーザの ProdUser の件数と更新日時の最大値を一緒に保存し、
+毎回 DB の値と比べて確かめる (公演の変更も ProdUser の更新日時を進める)。
+
+値は JSON に変換できる形 (キーは文字列, 値はリスト) で保存するので、
+pickle を使わないキャッシュバックエンドでも使える。
+
+QuerySet.update() や bulk_create() はシグナルを送らないので、
+それらで ProdUser を変更した時は invalidate() を呼ぶこと
+(update() では updated_at も更新すること)。
+メンバーの追加には add_member() を使う。
+'''
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from .checks import is_shared_cache
+from .models import Production, ProdUser
+from . import page_cache
+
+
+# 使うキャッシュの alias と保存期間 (秒)
+CACHE_ALIAS = getattr(settings, 'MEMBERSHIP_CACHE_ALIAS', 'default')
+CACHE_TIMEOUT = getattr(settings, 'MEMBERSHIP_CACHE_TIMEOUT', 60 * 60)
+
+
+def cache_key(user_id):
+    '''ユーザのメンバー情報のキャッシュキー
+    
+    値に公演名を加えた時に v2 にした (古い形の値を読まないため)
+    '''
+    return f'membership:v2:{user_id}'
+
+
+def local_cache_key(user_id):
+    '''プロセスごとのキャッシュに、検証子と一緒に保存する時のキー
+    '''
+    return f'membership:local:v1:{user_id}'
+
+
+def memberships(user):
+    '''ユーザが参加している公演のメンバー情報を返す
+    
+    Returns
+    -------
+    memberships : dict
+        {production_id: (prod_user_id, is_owner, is_editor)}
+    '''
+    return {prod_id: entry[:3]
+        for prod_id, entry in member_entries(user).items()}
+
+
+def member_entries(user):
+    '''メンバー情報に公演名を加えて返す
+    
+    Returns
+    -------
+    entries : dict
+        {production_id: (prod_user_id, is_owner, is_editor, 公演名)}
+    '''
+    cache = caches[CACHE_ALIAS]
+    
+    # プロセスごとのキャッシュでは、他のワーカーで取り消した権限が
+    # 残らないよう、検証子が DB と同じ時だけ使う
+    if not is_shared_cache(CACHE_ALIAS):
+        key = local_cache_key(user.id)
+        # 検証子を先に読む (行を読んだ後に変わっても、次に読み直す)
+        stamp = member_stamp(user)
+        stored = cache.get(key)
+        if stored is None or stored['stamp'] != stamp:
+            stored = {'stamp': stamp, 'entries': {str(row[0]): list(row[1:])
+                for row in member_rows(user)}}
+            cache.set(key, stored, CACHE_TIMEOUT)
+        return {int(prod_id): tuple(value)
+            for prod_id, value in stored['entries'].items()}
+    
+    key = cache_key(user.id)
+    stored = cache.get(key)
+    
+    # キャッシュになければ、ユーザの ProdUser をまとめて取得して保存する
+    if stored is None:
+        stored = {str(row[0]): list(row[1:]) for row in member_rows(user)}
+        cache.set(key, stored, CACHE_TIMEOUT)
+    
+    return {int(prod_id): tuple(value) for prod_id, value in stored.items()}
+
+
+def member_rows(user):
+    '''ユーザの ProdUser を
+    (production_id, id, is_owner, is_editor, 公演名) で取得する
+    
+    削除待ちの公演は、メンバーでないものとして扱う
+    '''
+    return ProdUser.objects.filter(user=user,
+        production__deletion_requested_at__isnull=True).values_list(
+        'production_id', 'id', 'is_owner', 'is_editor', 'production__name')
+
+
+def member_stamp(user):
+    '''ユーザの ProdUser の [件数, 更新日時の最大値] (プロセスごとの
+    キャッシュの検証子)
+    
+    追加・削除・変更と公演の変更 (signals.py) で変わる。
+    JSON で保存できるよう、日時は文字列にする
+    '''
+    stamp = ProdUser.objects.filter(user=user)\
+        .aggregate(count=Count('id'), updated=Max('updated_at'))
+    updated = stamp['updated']
+    return [stamp['count'], updated.isoformat() if updated else None]
+
+
+def cached_prod_user(user, prod_id):
+    '''キャッシュしたメンバー情報から ProdUser を組み立てる
+    
+    production には ID と名前だけを読み込んだ Production をセットする
+    (ビューやテンプレートで使うのはこの 2 つなので、クエリを発行しない。
+    他のフィールドは参照した時に取得される)
+    
+    Returns
+    -------
+    prod_user : ProdUser
+        メンバーでなければ None
+    '''
+    prod_id = int(prod_id)
+    entry = member_entries(user).get(prod_id)
+    if not entry:
+        return None
+    pk, is_owner, is_editor, name = entry
+    production = Production.from_db(ProdUser.objects.db, ['id', 'name'],
+        [prod_id, name])
+    return ProdUser(id=pk, production=production, user=user,
+        is_owner=is_owner, is_editor=is_editor)
+
+
+def invalidate(*user_ids):
+    '''ユーザのメンバー情報のキャッシュを破棄する
+    
+    トランザクション中なら、コミット後にもう一度破棄する
+    (コミット前に他のリクエストが古い情報をキャッシュする場合があるため)
+    '''
+    keys = [cache_key(user_id) for user_id in set(user_ids)]
+    if not keys:
+        return
+    cache = caches[CACHE_ALIAS]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def add_member(production, user, is_owner=False, is_editor=False):
+    '''公演にメンバーを追加する
+    
+    すでにメンバーなら何もしない。重複は (production, user) の一意制約で
+    DB が判定するので、先に存在を確かめずに INSERT する。
+    追加した時だけ、保存のシグナルでメンバー情報を破棄し版数を上げる
+    (signals.py)
+    
+    Returns
+    -------
+    prod_user : ProdUser
+        追加した ProdUser。すでにメンバーなら None
+    '''
+    try:
+        # 一意制約に反しても外側のトランザクションを続けられるよう、
+        # セーブポイントの中で INSERT する
+        with transaction.atomic():
+            return ProdUser.objects.create(production=production, user=user,
+                is_owner=is_owner, is_editor=is_editor)
+    except IntegrityError:
+        return None
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.7 on 2026-10-17 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0010_auto_20210910_0711'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invitation',
+            index=models.Index(fields=['invitee', 'exp_dt'], name='invitation_invitee_exp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invitation',
+            index=models.Index(fields=['production', 'exp_dt'], name='invitation_production_exp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produser',
+            index=models.Index(fields=['production', 'user'], name='produser_production_user_idx'),
+        ),
+    ]
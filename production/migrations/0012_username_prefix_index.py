@@ -0,0 +1,45 @@
+# Generated by Django 3.2.7 on 2026-10-17 04:10
+
+from django.conf import settings
+from django.db import migrations
+
+
+# 招待する人の ID の補完で、大文字小文字を区別せずに前方一致検索するためのインデックス
+#
+# PostgreSQL の istartswith は UPPER("username"::text) LIKE UPPER(...) になるので、
+# 同じ式に text_pattern_ops (varchar_pattern_ops と同等) で張る。
+# SQLite の LIKE は大文字小文字を区別しないので、NOCASE で張る。
+INDEX_NAME = 'auth_user_username_prefix_idx'
+
+
+def create_index(apps, schema_editor):
+    '''DB ごとの前方一致検索用のインデックスを作る
+    '''
+    user_model = apps.get_model(settings.AUTH_USER_MODEL)
+    table = schema_editor.quote_name(user_model._meta.db_table)
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} '
+            f'ON {table} ((UPPER("username"::text)) text_pattern_ops)')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} '
+            f'ON {table} ("username" COLLATE NOCASE)')
+
+
+def drop_index(apps, schema_editor):
+    '''インデックスを削除する
+    '''
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('production', '0011_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
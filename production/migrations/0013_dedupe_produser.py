@@ -0,0 +1,64 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:08
+
+from django.db import migrations
+from django.db.models import Count
+
+
+# 1 回に処理する (production, user) の組の数
+BATCH_SIZE = 1000
+
+
+def dedupe_prod_users(apps, schema_editor):
+    '''同じ production, user の ProdUser を 1 つにまとめる
+
+    id の最も小さいレコードを残し、権限は重複したレコードの OR をとる。
+    重複したレコードを担当にしている Rehearsal は、残すレコードに付け替える
+
+    メンバー情報のキャッシュは破棄しない (アプリのコードに依存しないため)。
+    この時点のキャッシュキーの値は、今のコード (membership:v2) からは読まれない
+    '''
+    ProdUser = apps.get_model('production', 'ProdUser')
+    Rehearsal = apps.get_model('rehearsal', 'Rehearsal')
+    pairs = ProdUser.objects.values('production_id', 'user_id')\
+        .annotate(count=Count('id')).filter(count__gt=1)\
+        .order_by('production_id', 'user_id')\
+        .values_list('production_id', 'user_id')
+
+    while True:
+        batch = list(pairs[:BATCH_SIZE])
+        if not batch:
+            break
+
+        # 組ごとに id 順のレコード
+        rows = {}
+        for prod_user in ProdUser.objects.filter(
+                production_id__in={pair[0] for pair in batch},
+                user_id__in={pair[1] for pair in batch}).order_by('id'):
+            pair = (prod_user.production_id, prod_user.user_id)
+            rows.setdefault(pair, []).append(prod_user)
+
+        keeps = []
+        dupe_ids = []
+        for pair in batch:
+            keep, *dupes = rows[pair]
+            keep.is_owner = any(row.is_owner for row in rows[pair])
+            keep.is_editor = any(row.is_editor for row in rows[pair])
+            keeps.append(keep)
+            dupe_ids.extend(row.id for row in dupes)
+            Rehearsal.objects.filter(assignee_id__in=[row.id for row in dupes])\
+                .update(assignee_id=keep.id)
+
+        ProdUser.objects.bulk_update(keeps, ['is_owner', 'is_editor'])
+        ProdUser.objects.filter(id__in=dupe_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0012_username_prefix_index'),
+        ('rehearsal', '0027_rehearsal_assignee'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_prod_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0013_dedupe_produser'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='produser',
+            name='produser_production_user_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='produser',
+            constraint=models.UniqueConstraint(fields=('production', 'user'), name='produser_production_user_uniq'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0014_produser_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invitation',
+            index=models.Index(fields=['exp_dt'], name='invitation_exp_idx'),
+        ),
+    ]
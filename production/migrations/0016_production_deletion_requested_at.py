@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0015_invitation_exp_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='production',
+            name='deletion_requested_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='削除受付'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0016_production_deletion_requested_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='production',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='produser',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('production', '0017_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invitation',
+            name='invitee',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='invitee', to=settings.AUTH_USER_MODEL, verbose_name='招待される人'),
+        ),
+        migrations.AlterField(
+            model_name='invitation',
+            name='production',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='production.production', verbose_name='PROJECT'),
+        ),
+    ]
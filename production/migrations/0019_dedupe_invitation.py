@@ -0,0 +1,51 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:48
+
+from django.db import migrations
+from django.db.models import Count
+
+
+# 1 回に処理する (production, invitee) の組の数
+BATCH_SIZE = 1000
+
+
+def dedupe_invitations(apps, schema_editor):
+    '''同じ production, invitee の Invitation を 1 つにまとめる
+
+    期限の最も遅いレコード (同じなら id の大きいもの) を残す
+    '''
+    Invitation = apps.get_model('production', 'Invitation')
+    pairs = Invitation.objects.values('production_id', 'invitee_id')\
+        .annotate(count=Count('id')).filter(count__gt=1)\
+        .order_by('production_id', 'invitee_id')\
+        .values_list('production_id', 'invitee_id')
+
+    while True:
+        batch = list(pairs[:BATCH_SIZE])
+        if not batch:
+            break
+
+        # 組ごとに、残すレコードが最初に来る順のレコード
+        rows = {}
+        for invitation in Invitation.objects.filter(
+                production_id__in={pair[0] for pair in batch},
+                invitee_id__in={pair[1] for pair in batch})\
+                .order_by('-exp_dt', '-id'):
+            pair = (invitation.production_id, invitation.invitee_id)
+            rows.setdefault(pair, []).append(invitation.id)
+
+        dupe_ids = []
+        for pair in batch:
+            keep, *dupes = rows[pair]
+            dupe_ids.extend(dupes)
+        Invitation.objects.filter(id__in=dupe_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0018_invitation_fk_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_invitations, migrations.RunPython.noop),
+    ]
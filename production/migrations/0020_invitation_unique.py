@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0019_dedupe_invitation'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='invitation',
+            constraint=models.UniqueConstraint(fields=('production', 'invitee'), name='invitation_production_invitee_uniq'),
+        ),
+    ]
@@ -1,18 +1,31 @@
 from datetime import datetime, timezone
 from django.conf import settings
 from django.db import models
+from django.utils.functional import cached_property
 
 
 class Production(models.Model):
     '''課題
     '''
     name = models.CharField('PROJECT', max_length=50)
+    # 削除を受け付けた日時。セットされた公演はどのビューにも表示せず、
+    # delete_productions コマンドが関連レコードごと少しずつ削除する
+    deletion_requested_at = models.DateTimeField('削除受付', null=True,
+        blank=True)
+    # ページの Last-Modified に使う。メンバーや稽古を削除した時も更新する
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = verbose_name_plural = 'PROJECT'
     
     def __str__(self):
         return self.name
+    
+    @property
+    def pending_deletion(self):
+        '''削除待ちかどうか
+        '''
+        return self.deletion_requested_at is not None
 
 
 class ProdUser(models.Model):
@@ -24,11 +37,27 @@ class ProdUser(models.Model):
         verbose_name='STAFF', on_delete=models.CASCADE)
     is_owner = models.BooleanField('OWNER', default=False)
     is_editor = models.BooleanField('EDITER', default=False)
+    # ページの Last-Modified に使う
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = verbose_name_plural = 'STAFF'
+        constraints = [
+            # 同じ公演に同じユーザは 1 人だけ
+            # アクセス中のユーザの ProdUser を探すインデックスも兼ねる
+            models.UniqueConstraint(fields=['production', 'user'],
+                name='produser_production_user_uniq'),
+        ]
     
     def __str__(self):
+        return self.display_name
+    
+    @cached_property
+    def display_name(self):
+        '''フルネーム (なければユーザ名)
+        
+        一覧で何度も参照するので、1 回だけ計算する
+        '''
         first_name = self.user.first_name
         last_name = self.user.last_name
         
@@ -52,19 +81,36 @@ class ProdUser(models.Model):
 class Invitation(models.Model):
     '''課題への招待
     '''
+    # 公演ごとの招待は (production, exp_dt) のインデックスで探す
     production = models.ForeignKey(Production, verbose_name='PROJECT',
-        on_delete=models.CASCADE)
+        on_delete=models.CASCADE, db_index=False)
     inviter = models.ForeignKey(settings.AUTH_USER_MODEL,
         verbose_name='招待する人',
         related_name='inviter', on_delete=models.CASCADE)
+    # ユーザへの招待は (invitee, exp_dt) のインデックスで探す
     invitee = models.ForeignKey(settings.AUTH_USER_MODEL,
         verbose_name='招待される人',
-        related_name='invitee', on_delete=models.CASCADE)
+        related_name='invitee', on_delete=models.CASCADE, db_index=False)
     exp_dt = models.DateTimeField(verbose_name='期限')
     
     class Meta:
         verbose_name = verbose_name_plural = 'PROJECTへの招待'
         ordering = ['exp_dt']
+        indexes = [
+            # ユーザへの有効な招待を探すため
+            models.Index(fields=['invitee', 'exp_dt'],
+                name='invitation_invitee_exp_idx'),
+            # 公演の招待を期限順に並べるため
+            models.Index(fields=['production', 'exp_dt'],
+                name='invitation_production_exp_idx'),
+            # 期限切れの招待を削除するため
+            models.Index(fields=['exp_dt'], name='invitation_exp_idx'),
+        ]
+        constraints = [
+            # 同じ公演に同じユーザを招待するのは 1 回だけ
+            models.UniqueConstraint(fields=['production', 'invitee'],
+                name='invitation_production_invitee_uniq'),
+        ]
     
     def __str__(self):
         return f'{self.invitee} さんへの {self.production} への招待'
@@ -0,0 +1,193 @@
+'''編集権のないメンバーに返すページのキャッシュ
+
+編集権のないメンバーには、誰かが公演を編集するまで同じページが表示される。
+そこで公演ごとに「版数」を持ち、描画したページを
+(ビュー, 公演, 版数, 役割, URL) のキーでキャッシュする。
+
+版数は、稽古・メンバー・招待・公演の保存・削除時にシグナルで上がる
+(production/signals.py, rehearsal/signals.py)。古い版のページは
+参照されなくなり、期限が来れば消える。シグナルを送らない bulk_create()
+などで変更した時は bump() を呼ぶこと。
+
+版数は全ワーカーで同じでなければならない。キャッシュが共有されない
+(LocMemCache など) 時は、bump() で進める公演の更新日時を版数にする。
+'''
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from .checks import is_shared_cache
+from .models import Production
+from . import membership
+
+
+# 使うキャッシュの alias とページの保存期間 (秒)
+CACHE_ALIAS = getattr(settings, 'PAGE_CACHE_ALIAS', 'default')
+CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 10 * 60)
+
+
+def version_key(prod_id):
+    '''公演の版数のキャッシュキー
+    '''
+    return f'page_version:{prod_id}'
+
+
+def page_key(view_name, prod_id, version, role, path):
+    '''描画したページのキャッシュキー
+    '''
+    digest = hashlib.md5(path.encode()).hexdigest()
+    return f'page:{view_name}:{prod_id}:{version}:{role}:{digest}'
+
+
+def object_key(view_name, pk):
+    '''URL に prod_id を含まないページの、公演の ID のキャッシュキー
+    '''
+    return f'page_prod:{view_name}:{pk}'
+
+
+def get_version(prod_id):
+    '''公演の版数を返す
+    
+    版数は上げた時の時刻 (ナノ秒)。キャッシュから消えていても、
+    消える前の版数に戻って古いページを返すことはない
+    '''
+    if not is_shared_cache(CACHE_ALIAS):
+        return db_versions([prod_id]).get(prod_id)
+    
+    cache = caches[CACHE_ALIAS]
+    key = version_key(prod_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(prod_ids):
+    '''公演ごとの版数 {prod_id: 版数} を返す
+    
+    キャッシュは 1 回の get_many() で読む
+    '''
+    if not is_shared_cache(CACHE_ALIAS):
+        return db_versions(prod_ids)
+    
+    stored = caches[CACHE_ALIAS].get_many(
+        [version_key(prod_id) for prod_id in prod_ids])
+    return {prod_id: stored.get(version_key(prod_id)) or get_version(prod_id)
+        for prod_id in prod_ids}
+
+
+def db_versions(prod_ids):
+    '''公演の更新日時から {prod_id: 版数} を求める
+    
+    版数は更新日時 (マイクロ秒)。主キーで引く 1 回のクエリで済む
+    '''
+    rows = Production.objects.filter(id__in=prod_ids)\
+        .values_list('id', 'updated_at')
+    return {prod_id: round(updated_at.timestamp() * 1000000)
+        for prod_id, updated_at in rows}
+
+
+def _bump(prod_ids):
+    '''公演の版数を現在時刻にする
+    
+    incr() は使わない (数値を文字列で保存するバックエンドがあるため)
+    '''
+    version = time.time_ns()
+    caches[CACHE_ALIAS].set_many(
+        {version_key(prod_id): version for prod_id in prod_ids}, None)
+
+
+def bump(*prod_ids):
+    '''公演の版数を上げ、キャッシュしたページを使わせない
+    
+    公演の更新日時も進める。キャッシュが共有されない時の版数になり、
+    ページの Last-Modified にも子レコードの変更 (削除を含む) が反映される。
+    
+    キャッシュの版数は、トランザクション中ならコミット後にもう一度上げる
+    (コミット前に他のリクエストが古い内容でページを作る場合があるため)
+    '''
+    prod_ids = set(prod_ids)
+    if not prod_ids:
+        return
+    Production.objects.filter(id__in=prod_ids)\
+        .update(updated_at=timezone.now())
+    if is_shared_cache(CACHE_ALIAS):
+        _bump(prod_ids)
+        transaction.on_commit(lambda: _bump(prod_ids))
+
+
+class CachedPageMixin:
+    '''編集権のないメンバーには、描画したページをキャッシュして返す mixin
+    
+    キャッシュにあれば、ORM もテンプレートも使わずに返す。
+    アクセス権はキャッシュしたメンバー情報で検査し、メンバーでなければ
+    通常どおり View に処理させる (403 や 404 になる)。
+    
+    URL に prod_id を含まない View (詳細ページなど) では、
+    一度表示した時に公演の ID を覚え、次からキャッシュを使う。
+    
+    Attributes
+    ----------
+    page_cache_name : str
+        キャッシュキーに使うビューの名前
+    '''
+    page_cache_name = None
+    
+    def dispatch(self, request, *args, **kwargs):
+        '''キャッシュにあればそれを返し、なければ描画してキャッシュする
+        '''
+        key = self.page_cache_key()
+        cache = caches[CACHE_ALIAS]
+        if key is not None:
+            content = cache.get(key)
+            if content is not None:
+                return HttpResponse(content)
+        
+        response = super().dispatch(request, *args, **kwargs)
+        
+        # 公演の ID を覚えておく (ProdAccessMixin が production を持っている)
+        if 'prod_id' not in self.kwargs and hasattr(self, 'production'):
+            cache.set(object_key(self.page_cache_name, self.kwargs['pk']),
+                self.production.id, CACHE_TIMEOUT)
+        
+        if key is not None and response.status_code == 200\
+            and hasattr(response, 'add_post_render_callback'):
+            response.add_post_render_callback(
+                lambda response: cache.set(key, response.content,
+                    CACHE_TIMEOUT))
+        return response
+    
+    def page_prod_id(self):
+        '''ページの公演の ID (分からなければ None)
+        '''
+        if 'prod_id' in self.kwargs:
+            return int(self.kwargs['prod_id'])
+        return caches[CACHE_ALIAS].get(
+            object_key(self.page_cache_name, self.kwargs['pk']))
+    
+    def page_cache_key(self):
+        '''ページのキャッシュキー (キャッシュを使わない時は None)
+        '''
+        request = self.request
+        if request.method != 'GET' or not request.user.is_authenticated:
+            return None
+        prod_id = self.page_prod_id()
+        if prod_id is None:
+            return None
+        
+        # 編集権があれば編集ボタンなどが表示されるので、キャッシュしない
+        prod_user = membership.memberships(request.user).get(prod_id)
+        if not prod_user:
+            return None
+        _, is_owner, is_editor = prod_user
+        if is_owner or is_editor:
+            return None
+        
+        # 版数は描画する前に読む。描画中に版数が上がっても、
+        # 古い版のキーに保存されるだけなので、古いページは返らない
+        return page_key(self.page_cache_name, prod_id, get_version(prod_id),
+            'member', request.get_full_path())
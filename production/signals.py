@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Production, ProdUser, Invitation
+from . import membership, page_cache
+
+
+@receiver([post_save, post_delete], sender=ProdUser)
+def prod_user_changed(sender, instance, **kwargs):
+    '''ProdUser が変わったら、そのユーザのメンバー情報を破棄する
+    
+    メンバー一覧が変わるので、公演の版数と更新日時も進める
+    (削除もページの Last-Modified に反映される)
+    '''
+    membership.invalidate(instance.user_id)
+    page_cache.bump(instance.production_id)
+
+
+@receiver([post_save, post_delete], sender=Production)
+def production_changed(sender, instance, **kwargs):
+    '''Production が変わったら、メンバー全員のメンバー情報を破棄する
+    
+    プロセスごとのキャッシュの検証子が変わるよう、ProdUser の更新日時も進める。
+    削除時は CASCADE で消える ProdUser のシグナルでも破棄される
+    '''
+    prod_users = ProdUser.objects.filter(production_id=instance.id)
+    if kwargs['signal'] is post_save and not kwargs['created']:
+        prod_users.update(updated_at=timezone.now())
+    membership.invalidate(*prod_users.values_list('user_id', flat=True))
+    page_cache.bump(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Invitation)
+def invitation_changed(sender, instance, **kwargs):
+    '''招待が変わったら、公演の版数を上げる
+    '''
+    page_cache.bump(instance.production_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    '''ユーザが変わったら (名前はページに表示される)、
+    ProdUser の更新日時を進め、参加している公演の版数を上げる
+    
+    ログイン時の last_login の更新では上げない
+    '''
+    if created or update_fields is not None\
+        and set(update_fields) <= {'last_login'}:
+        return
+    prod_users = ProdUser.objects.filter(user_id=instance.id)
+    prod_users.update(updated_at=timezone.now())
+    page_cache.bump(*prod_users.values_list('production_id', flat=True))
@@ -0,0 +1,170 @@
+'''古い値を返しながら 1 つのワーカーだけが作り直すキャッシュ
+(stale-while-revalidate)
+
+期限の切れた集計を、同時に来たリクエストが全員で作り直すと、
+同じ重いクエリが一斉に走る (thundering herd)。ここでは
+
+- 新しい値があればそれを返す
+- 古い値 (期限切れ, または版が違う) しかなければ、キャッシュに
+  ロックを add() できた 1 つのワーカーだけが作り直し、他は古い値を返す
+- 値が全く無ければ、ロックを取れなかったワーカーは作り直されるのを待つ
+
+ロックはキャッシュバックエンドに置くので、プロセスをまたいでも
+キーごとに 1 つしか作り直さない (singleflight)。
+'''
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+
+
+# 使うキャッシュの alias
+CACHE_ALIAS = getattr(settings, 'STALE_CACHE_ALIAS', 'default')
+
+
+def lock_key(key):
+    '''作り直しのロックのキャッシュキー
+    '''
+    return f'{key}:lock'
+
+
+class StaleCache:
+    '''古い値を返しながら作り直すキャッシュ
+    
+    Attributes
+    ----------
+    timeout : int
+        値が新しいとみなす秒数
+    stale_timeout : int
+        期限が切れた後も、古い値として返してよい秒数
+    lock_timeout : int
+        作り直しのロックの秒数 (作り直すワーカーが落ちても解放される)
+    wait : float
+        値が全く無い時に、他のワーカーが作り直すのを待つ秒数
+    poll_interval : float
+        待つ間にキャッシュを見に行く間隔 (秒)
+    '''
+    def __init__(self, timeout=60, stale_timeout=10 * 60, lock_timeout=30,
+        wait=5, poll_interval=0.05, alias=CACHE_ALIAS):
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.alias = alias
+    
+    @property
+    def cache(self):
+        '''使うキャッシュ
+        '''
+        return caches[self.alias]
+    
+    def get(self, key, compute, version=None):
+        '''1 つのキーの値を返す
+        
+        Parameters
+        ----------
+        compute : callable
+            引数なしで値を作る関数
+        version
+            値の版。保存した時と違えば、古い値として扱う
+        '''
+        return self.get_many([key], lambda keys: {key: compute()},
+            {key: version})[key]
+    
+    def get_many(self, keys, compute_many, versions=None):
+        '''複数のキーの値を {キー: 値} で返す
+        
+        キャッシュは 1 回の get_many() で読み、作り直すキーは
+        まとめて 1 回の compute_many() で作る
+        
+        Parameters
+        ----------
+        compute_many : callable
+            キーのリストを受け取り、{キー: 値} を返す関数
+        versions : dict
+            {キー: 版}。保存した時と違えば、古い値として扱う
+        '''
+        versions = versions or {}
+        now = time.time()
+        entries = self.cache.get_many(keys)
+        
+        values = {}
+        stale = {}
+        for key in keys:
+            entry = entries.get(key)
+            if entry is None:
+                continue
+            if entry['fresh_until'] > now\
+                and entry['version'] == versions.get(key):
+                values[key] = entry['value']
+            else:
+                stale[key] = entry['value']
+        
+        outdated = [key for key in keys if key not in values]
+        if not outdated:
+            return values
+        
+        # ロックを取れたキーだけを作り直す
+        token = uuid.uuid4().hex
+        locked = [key for key in outdated
+            if self.cache.add(lock_key(key), token, self.lock_timeout)]
+        if locked:
+            try:
+                values.update(self.refresh(locked, compute_many, versions))
+            finally:
+                self.release(locked, token)
+        
+        # 他のワーカーが作り直している間は、古い値を返す
+        waiting = []
+        for key in outdated:
+            if key in values:
+                continue
+            if key in stale:
+                values[key] = stale[key]
+            else:
+                waiting.append(key)
+        
+        if waiting:
+            values.update(self.wait_for(waiting, compute_many))
+        return values
+    
+    def refresh(self, keys, compute_many, versions):
+        '''値を作り直して保存する
+        '''
+        computed = compute_many(keys)
+        fresh_until = time.time() + self.timeout
+        self.cache.set_many({key: {'value': value, 'fresh_until': fresh_until,
+            'version': versions.get(key)}
+            for key, value in computed.items()},
+            self.timeout + self.stale_timeout)
+        return computed
+    
+    def release(self, keys, token):
+        '''自分が取ったロックを解放する
+        
+        期限が切れて他のワーカーが取り直したロックは消さない
+        (確かめてから消すまでの間に取られることはありうるが、
+        その時は 2 つのワーカーが作り直すだけで、値は正しい)
+        '''
+        held = self.cache.get_many([lock_key(key) for key in keys])
+        self.cache.delete_many([lock for lock, value in held.items()
+            if value == token])
+    
+    def wait_for(self, keys, compute_many):
+        '''他のワーカーが作り直すのを待つ
+        
+        wait 秒待っても保存されなければ、自分で作る
+        '''
+        values = {}
+        deadline = time.time() + self.wait
+        while keys and time.time() < deadline:
+            time.sleep(self.poll_interval)
+            entries = self.cache.get_many(keys)
+            for key, entry in entries.items():
+                values[key] = entry['value']
+            keys = [key for key in keys if key not in values]
+        
+        if keys:
+            values.update(compute_many(keys))
+        return values
@@ -0,0 +1,95 @@
+'''公演一覧に表示する、公演ごとのタスクの集計
+
+集計は公演ごとに (メンバー全員で共有して) キャッシュし、期限が切れたり
+公演が編集されたりした後は、1 つのワーカーが作り直す間、他のリクエストには
+古い集計を返す (stale_cache.py)。
+
+値は JSON に変換できる形 (日付は文字列) で保存する。
+'''
+from datetime import date
+from django.conf import settings
+from django.db.models import Count, Min, Q
+from django.utils.timezone import localdate
+from .models import Production
+from .stale_cache import StaleCache
+from . import page_cache
+
+
+# 集計を新しいとみなす秒数と、その後も古い値として返してよい秒数
+stale_cache = StaleCache(
+    timeout=getattr(settings, 'SUMMARY_CACHE_TIMEOUT', 60),
+    stale_timeout=getattr(settings, 'SUMMARY_CACHE_STALE_TIMEOUT', 10 * 60))
+
+# 集計の項目
+FIELDS = ('task_count', 'todo_count', 'started_count', 'done_count',
+    'overdue_count', 'next_deadline')
+
+
+def summary_key(prod_id):
+    '''公演の集計のキャッシュキー
+    '''
+    return f'prod_summary:{prod_id}'
+
+
+def compute_summaries(prod_ids, today):
+    '''公演のタスクを進捗ごとに数える (1 回のクエリ)
+    
+    Returns
+    -------
+    summaries : dict
+        {prod_id: {項目: 値}}
+    '''
+    task = 'rehearsal'
+    started = Q(**{f'{task}__prog': 'Started'})
+    done = Q(**{f'{task}__prog': 'DONE!!!'})
+    rows = Production.objects.filter(id__in=prod_ids).values('id').annotate(
+        task_count=Count(task),
+        todo_count=Count(task, filter=~(started | done)),
+        started_count=Count(task, filter=started),
+        done_count=Count(task, filter=done),
+        # 終わっていなくて締切が過ぎたタスクの数
+        overdue_count=Count(task,
+            filter=~done & Q(**{f'{task}__date__lt': today})),
+        # 終わっていないタスクの次の締切
+        next_deadline=Min(f'{task}__date',
+            filter=~done & Q(**{f'{task}__date__gte': today})),
+    ).values('id', *FIELDS)
+    
+    summaries = {}
+    for row in rows:
+        prod_id = row.pop('id')
+        if row['next_deadline']:
+            row['next_deadline'] = row['next_deadline'].isoformat()
+        summaries[prod_id] = row
+    return summaries
+
+
+def production_summaries(prod_ids):
+    '''公演ごとのタスクの集計を返す
+    
+    公演の版数 (page_cache.py) か日付が変われば、古い集計として作り直す
+    
+    Returns
+    -------
+    summaries : dict
+        {prod_id: {項目: 値}}。next_deadline は date
+    '''
+    today = localdate()
+    keys = {summary_key(prod_id): prod_id for prod_id in prod_ids}
+    versions = {summary_key(prod_id): f'{version}:{today}'
+        for prod_id, version in page_cache.get_versions(prod_ids).items()}
+    
+    def compute_many(outdated):
+        computed = compute_summaries([keys[key] for key in outdated], today)
+        return {key: computed.get(keys[key], {}) for key in outdated}
+    
+    stored = stale_cache.get_many(list(keys), compute_many, versions)
+    
+    summaries = {}
+    for key, prod_id in keys.items():
+        summary = dict(stored[key])
+        if summary.get('next_deadline'):
+            summary['next_deadline'] = date.fromisoformat(
+                summary['next_deadline'])
+        summaries[prod_id] = summary
+    return summaries
@@ -1,3 +1,957 @@
-from django.test import TestCase
+import io
+import json
+import threading
+import time
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.template import engines
+from django.template.response import TemplateResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.views.generic import View
+from .models import Production, ProdUser, Invitation
+from . import checks, membership, page_cache
+from .checks import check_shared_cache
+from .forms import InvitationBulkForm
+from .management.commands import explain_hot_queries
+from .membership import memberships, cached_prod_user, add_member
+from .stale_cache import StaleCache, lock_key
 
-# Create your tests here.
+
+# テストは 1 つのプロセスで動くので、ローカルメモリのキャッシュも
+# 全ワーカーで共有されるものとして扱う
+shared_cache = mock.patch.object(checks, 'LOCAL_BACKENDS', ())
+
+
+class ProdAccessMixinTest(TestCase):
+    '''ProdAccessMixin によるアクセス権の検査
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.owner = user_model.objects.create_user('owner', password='pw')
+        cls.editor = user_model.objects.create_user('editor', password='pw')
+        cls.member = user_model.objects.create_user('member', password='pw')
+        cls.outsider = user_model.objects.create_user('outsider', password='pw')
+        
+        cls.production = Production.objects.create(name='prod')
+        cls.owner_pu = ProdUser.objects.create(production=cls.production,
+            user=cls.owner, is_owner=True)
+        cls.editor_pu = ProdUser.objects.create(production=cls.production,
+            user=cls.editor, is_editor=True)
+        cls.member_pu = ProdUser.objects.create(production=cls.production,
+            user=cls.member)
+    
+    def test_owner_permission(self):
+        '''所有権が必要なページは owner のみ表示できる
+        '''
+        url = reverse('production:usr_update', kwargs={'pk': self.member_pu.id})
+        for user, status in ((self.owner, 200), (self.editor, 403),
+            (self.member, 403), (self.outsider, 403)):
+            self.client.force_login(user)
+            self.assertEqual(self.client.get(url).status_code, status)
+    
+    def test_cannot_delete_self(self):
+        '''owner は自分自身を削除できない
+        '''
+        self.client.force_login(self.owner)
+        url = reverse('production:usr_delete', kwargs={'pk': self.owner_pu.id})
+        self.assertEqual(self.client.get(url).status_code, 403)
+        url = reverse('production:usr_delete', kwargs={'pk': self.member_pu.id})
+        self.assertEqual(self.client.get(url).status_code, 200)
+    
+    def test_invitee_can_delete_invitation(self):
+        '''招待は owner と invitee が削除できる
+        '''
+        invt = Invitation.objects.create(production=self.production,
+            inviter=self.owner, invitee=self.outsider,
+            exp_dt='2099-01-01T00:00:00Z')
+        url = reverse('production:invt_delete',
+            kwargs={'pk': invt.id, 'from': 'prod_list'})
+        for user, status in ((self.owner, 200), (self.outsider, 200),
+            (self.member, 403)):
+            self.client.force_login(user)
+            self.assertEqual(self.client.get(url).status_code, status)
+    
+    def test_missing_object(self):
+        '''存在しないレコードは 404
+        '''
+        self.client.force_login(self.owner)
+        url = reverse('production:usr_update', kwargs={'pk': 9999})
+        self.assertEqual(self.client.get(url).status_code, 404)
+    
+    def test_single_access_query(self):
+        '''対象レコードとアクセス権の取得は 1 クエリで済む
+        '''
+        from .views import UsrUpdate
+        
+        self.client.force_login(self.owner)
+        request = self.client.get('/').wsgi_request
+        view = UsrUpdate()
+        view.setup(request, pk=self.member_pu.id)
+        with self.assertNumQueries(1):
+            obj = view.get_object()
+            self.assertEqual(obj.production, self.production)
+            self.assertEqual(obj.accessing_prod_user, self.owner_pu)
+            self.assertIs(view.get_object(), obj)
+    
+    @shared_cache
+    def test_prod_user_memo(self):
+        '''同じリクエスト内では ProdUser を 1 回しか検索しない
+        '''
+        from django.core.cache import cache
+        from django.views import View
+        from .view_func import accessing_prod_user, test_edit_permission
+        
+        cache.clear()
+        self.client.force_login(self.editor)
+        view = View()
+        view.setup(self.client.get('/').wsgi_request,
+            prod_id=self.production.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(accessing_prod_user(view), self.editor_pu)
+            self.assertTrue(test_edit_permission(view).is_editor)
+            # 公演名もメンバー情報と一緒に読んである
+            production = accessing_prod_user(view).production
+            self.assertEqual((production.id, str(production)),
+                (self.production.id, 'prod'))
+        
+        # メンバーでない公演も None としてメモする
+        view.kwargs = {'prod_id': 9999}
+        with self.assertNumQueries(0):
+            self.assertIsNone(accessing_prod_user(view))
+            self.assertIsNone(accessing_prod_user(view))
+
+
+class JSONCache(LocMemCache):
+    '''値を JSON で保存するキャッシュ (Redis などの代わり)
+    '''
+    def set(self, key, value, *args, **kwargs):
+        super().set(key, json.dumps(value), *args, **kwargs)
+    
+    def get(self, key, default=None, *args, **kwargs):
+        value = super().get(key, None, *args, **kwargs)
+        return default if value is None else json.loads(value)
+
+
+class MembershipCacheTest(TestCase):
+    '''ユーザごとのメンバー情報のキャッシュ
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.user = user_model.objects.create_user('user', password='pw')
+        cls.production = Production.objects.create(name='prod')
+        cls.prod_user = ProdUser.objects.create(production=cls.production,
+            user=cls.user, is_editor=True)
+    
+    def setUp(self):
+        caches['default'].clear()
+    
+    def check_invalidation(self):
+        '''キャッシュからの読み出しとシグナルによる破棄
+        '''
+        expected = {self.production.id: (self.prod_user.id, False, True)}
+        with self.assertNumQueries(1):
+            self.assertEqual(memberships(self.user), expected)
+            self.assertEqual(memberships(self.user), expected)
+        
+        # ProdUser の更新で破棄される
+        self.prod_user.is_owner = True
+        self.prod_user.save()
+        self.assertEqual(memberships(self.user)[self.production.id][1], True)
+        
+        # 公演名の変更で破棄される
+        self.production.name = 'renamed'
+        self.production.save()
+        self.assertEqual(cached_prod_user(self.user,
+            self.production.id).production.name, 'renamed')
+        
+        # 別の公演に参加したら破棄される
+        other = Production.objects.create(name='other')
+        ProdUser.objects.create(production=other, user=self.user)
+        self.assertIn(other.id, memberships(self.user))
+        
+        # 公演を削除したら破棄される
+        other.delete()
+        self.assertNotIn(other.id, memberships(self.user))
+        
+        # ProdUser を削除したら破棄される
+        self.prod_user.delete()
+        self.assertEqual(memberships(self.user), {})
+    
+    @shared_cache
+    def test_shared(self):
+        '''共有されるキャッシュ
+        '''
+        self.check_invalidation()
+    
+    @shared_cache
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'production.tests.JSONCache'}})
+    def test_json_backend(self):
+        '''値を JSON で保存するキャッシュ
+        '''
+        self.check_invalidation()
+    
+    def test_local_cache(self):
+        '''プロセスごとのキャッシュでは、毎回検証子を DB と比べる
+        
+        他のワーカーでの変更 (このプロセスのキャッシュは破棄されない) も
+        すぐに反映される
+        '''
+        expected = {self.production.id: (self.prod_user.id, False, True)}
+        # 検証子とメンバー情報, 2 回目は検証子だけ
+        with self.assertNumQueries(3):
+            self.assertEqual(memberships(self.user), expected)
+            self.assertEqual(memberships(self.user), expected)
+        
+        with mock.patch.object(membership, 'invalidate'):
+            self.prod_user.is_editor = False
+            self.prod_user.save()
+            self.assertEqual(memberships(self.user)[self.production.id][2],
+                False)
+            
+            self.production.name = 'renamed'
+            self.production.save()
+            self.assertEqual(cached_prod_user(self.user,
+                self.production.id).production.name, 'renamed')
+            
+            other = Production.objects.create(name='other')
+            ProdUser.objects.create(production=other, user=self.user)
+            self.assertIn(other.id, memberships(self.user))
+            
+            self.prod_user.delete()
+            self.assertEqual(list(memberships(self.user)), [other.id])
+
+
+class ProdListTest(TestCase):
+    '''課題一覧 (ダッシュボード)
+    '''
+    def setUp(self):
+        caches['default'].clear()
+    
+    def create_productions(self, user, count):
+        '''count 個の課題と、その稽古, 招待を作る
+        '''
+        from rehearsal.models import Rehearsal
+        
+        inviter = get_user_model().objects.create_user(f'inviter{count}')
+        Production.objects.bulk_create(
+            [Production(name=f'prod{count}-{i}') for i in range(count)])
+        productions = list(Production.objects.filter(
+            name__startswith=f'prod{count}-').order_by('id'))
+        ProdUser.objects.bulk_create([ProdUser(production=production,
+            user=user, is_owner=True) for production in productions])
+        Rehearsal.objects.bulk_create([Rehearsal(production=production,
+            date=f'2000-01-0{day}', prog=prog)
+            for production in productions
+            for day, prog in ((1, 'Started'), (2, 'DONE!!!'), (3, ' '))])
+        Invitation.objects.bulk_create([Invitation(production=production,
+            inviter=inviter, invitee=user, exp_dt='2099-01-01T00:00:00Z')
+            for production in productions])
+        return productions
+    
+    def test_stats(self):
+        '''課題ごとのタスクの集計
+        '''
+        user = get_user_model().objects.create_user('user')
+        production, = self.create_productions(user, 1)
+        
+        self.client.force_login(user)
+        item, = self.client.get('/').context['object_list']
+        self.assertEqual(item.production, production)
+        self.assertEqual(item.task_count, 3)
+        self.assertEqual(item.todo_count, 1)
+        self.assertEqual(item.started_count, 1)
+        self.assertEqual(item.done_count, 1)
+        self.assertEqual(item.overdue_count, 2)
+        self.assertIsNone(item.next_deadline)
+    
+    def test_stats_updated(self):
+        '''タスクを変えると、集計を作り直す
+        '''
+        from rehearsal.models import Rehearsal
+        
+        user = get_user_model().objects.create_user('user')
+        production, = self.create_productions(user, 1)
+        self.client.force_login(user)
+        self.client.get('/')
+        
+        Rehearsal.objects.create(production=production, date='2099-01-01')
+        item, = self.client.get('/').context['object_list']
+        self.assertEqual(item.task_count, 4)
+        self.assertEqual(str(item.next_deadline), '2099-01-01')
+    
+    def test_num_queries(self):
+        '''課題の数によらず、クエリの数は一定
+        
+        セッション, ユーザ, 招待, 課題, 公演の版数 (更新日時),
+        タスクの集計の 6 回。集計がキャッシュにあれば 5 回
+        '''
+        user_model = get_user_model()
+        for count in (1, 50, 500):
+            with self.subTest(count=count):
+                user = user_model.objects.create_user(f'user{count}')
+                self.create_productions(user, count)
+                self.client.force_login(user)
+                with self.assertNumQueries(6):
+                    response = self.client.get('/')
+                with self.assertNumQueries(5):
+                    response = self.client.get('/')
+                self.assertEqual(len(response.context['object_list']), count)
+                self.assertEqual(len(response.context['view'].invitations),
+                    count)
+
+
+
+class PageVersionTest(TestCase):
+    '''公演の版数
+    '''
+    def test_local_cache(self):
+        '''プロセスごとのキャッシュでは、公演の更新日時を版数にする
+        
+        キャッシュの内容によらず、どのワーカーでも同じ版数になる
+        '''
+        production = Production.objects.create(name='prod')
+        version = page_cache.get_version(production.id)
+        caches['default'].clear()
+        self.assertEqual(page_cache.get_versions([production.id]),
+            {production.id: version})
+        
+        page_cache.bump(production.id)
+        self.assertGreater(page_cache.get_version(production.id), version)
+
+
+class CachedPage(page_cache.CachedPageMixin, View):
+    '''CachedPageMixin だけを使うビュー (描画した回数を数える)
+    '''
+    page_cache_name = 'cached_page'
+    template = engines['django'].from_string('{{ count }}')
+    count = 0
+    
+    def get(self, request, *args, **kwargs):
+        CachedPage.count += 1
+        return TemplateResponse(request, self.template,
+            {'count': CachedPage.count})
+
+
+@shared_cache
+class CachedPageTest(TestCase):
+    '''描画したページのキャッシュ
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = get_user_model().objects.create_user('member')
+        cls.production = Production.objects.create(name='prod')
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+    
+    def setUp(self):
+        caches['default'].clear()
+        CachedPage.count = 0
+    
+    def get(self):
+        request = RequestFactory().get('/page/')
+        request.user = self.member
+        response = CachedPage.as_view()(request, prod_id=self.production.id)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    
+    def test_hit(self):
+        '''キャッシュにあれば、クエリも描画もせずに返す
+        
+        メンバー情報, 版数, ページを全てキャッシュから読む
+        '''
+        first = self.get()
+        with self.assertNumQueries(0):
+            second = self.get()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(CachedPage.count, 1)
+        
+        page_cache.bump(self.production.id)
+        self.assertEqual(self.get().content, b'2')
+
+
+class StaleCacheTest(TestCase):
+    '''古い値を返しながら 1 つのワーカーだけが作り直すキャッシュ
+    '''
+    def setUp(self):
+        caches['default'].clear()
+        self.calls = []
+        self.lock = threading.Lock()
+    
+    def compute(self, value):
+        '''呼ばれた回数を数え、少し時間のかかる集計の代わり
+        '''
+        def compute_many(keys):
+            with self.lock:
+                self.calls.append(keys)
+            time.sleep(0.2)
+            return {key: value for key in keys}
+        return compute_many
+    
+    def run_threads(self, stale_cache, count=10, **kwargs):
+        '''count 個のスレッドから同時に取得し、結果のリストを返す
+        '''
+        barrier = threading.Barrier(count)
+        results = [None] * count
+        
+        def worker(i):
+            barrier.wait()
+            results[i] = stale_cache.get_many(['key'], **kwargs)['key']
+        
+        threads = [threading.Thread(target=worker, args=(i,))
+            for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    def test_coalesce(self):
+        '''値が無ければ 1 つのスレッドだけが作り、他はそれを待つ
+        '''
+        stale_cache = StaleCache(timeout=60, poll_interval=0.01)
+        results = self.run_threads(stale_cache,
+            compute_many=self.compute('new'))
+        self.assertEqual(self.calls, [['key']])
+        self.assertEqual(results, ['new'] * 10)
+    
+    def test_stale_while_revalidate(self):
+        '''古い値があれば、1 つのスレッドが作り直す間、他は古い値を返す
+        '''
+        stale_cache = StaleCache(timeout=60)
+        stale_cache.get_many(['key'], self.compute('old'), {'key': 1})
+        self.calls.clear()
+        
+        # 版が変わったので、古い値になっている
+        results = self.run_threads(stale_cache,
+            compute_many=self.compute('new'), versions={'key': 2})
+        self.assertEqual(self.calls, [['key']])
+        self.assertEqual(sorted(results), ['new'] + ['old'] * 9)
+        self.assertEqual(stale_cache.get('key', lambda: 'unused', 2), 'new')
+        self.assertIsNone(caches['default'].get(lock_key('key')))
+
+
+class ExplainHotQueriesTest(TestCase):
+    '''頻出クエリの実行計画
+    '''
+    def test_no_seq_scan(self):
+        '''頻出クエリはどれもインデックスを使う
+        '''
+        call_command('explain_hot_queries', min_rows=0, stdout=io.StringIO())
+    
+    def test_covering_index_scan(self):
+        '''カバリングインデックスのスキャンはシーケンシャルスキャンではない
+        '''
+        command = explain_hot_queries.Command()
+        plan = '\n'.join([
+            'QUERY PLAN',
+            '|--SCAN production_produser USING COVERING INDEX produser_idx',
+            '|--SCAN TABLE production_invitation USING INDEX invitation_idx',
+            '`--SCAN rehearsal_rehearsal',
+        ])
+        self.assertEqual(list(command.sqlite_seq_scans(plan)),
+            ['rehearsal_rehearsal'])
+
+
+@shared_cache
+class UsrListTest(TestCase):
+    '''メンバー一覧
+    '''
+    def setUp(self):
+        caches['default'].clear()
+    
+    def test_num_queries(self):
+        '''メンバーや招待の数によらず、クエリの数は一定
+        
+        セッション, ユーザ, 検証子の集計, メンバー情報, 招待, メンバーの 6 回
+        '''
+        user_model = get_user_model()
+        for count in (1, 300):
+            with self.subTest(count=count):
+                production = Production.objects.create(name=f'prod{count}')
+                users = user_model.objects.bulk_create([user_model(
+                    username=f'user{count}-{i}', first_name=f'{i}')
+                    for i in range(count)])
+                users = user_model.objects.filter(
+                    username__startswith=f'user{count}-').order_by('id')
+                ProdUser.objects.bulk_create([ProdUser(production=production,
+                    user=user, is_owner=(i == 0))
+                    for i, user in enumerate(users)])
+                Invitation.objects.bulk_create([Invitation(
+                    production=production, inviter=users[0], invitee=user,
+                    exp_dt='2099-01-01T00:00:00Z') for user in users[:count]])
+                
+                self.client.force_login(users[0])
+                url = reverse('production:usr_list',
+                    kwargs={'prod_id': production.id})
+                with self.assertNumQueries(6):
+                    response = self.client.get(url)
+                self.assertContains(response, f'user{count}-{count - 1}',
+                    count=2)
+    
+    def test_page_cache(self):
+        '''編集権のないメンバーにはキャッシュを返し、メンバーが増えれば作り直す
+        '''
+        user_model = get_user_model()
+        production = Production.objects.create(name='prod')
+        member = user_model.objects.create_user('member')
+        ProdUser.objects.create(production=production, user=member)
+        
+        self.client.force_login(member)
+        url = reverse('production:usr_list', kwargs={'prod_id': production.id})
+        self.client.get(url)
+        # セッション, ユーザ, 検証子の集計だけ
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        
+        add_member(production, user_model.objects.create_user('newcomer'))
+        self.assertContains(self.client.get(url), 'newcomer')
+    
+    def test_conditional_get(self):
+        '''所有者には、招待が増えれば 200 を返す (Last-Modified は付けない)
+        '''
+        user_model = get_user_model()
+        production = Production.objects.create(name='prod')
+        owner = user_model.objects.create_user('owner')
+        ProdUser.objects.create(production=production, user=owner,
+            is_owner=True)
+        
+        self.client.force_login(owner)
+        url = reverse('production:usr_list', kwargs={'prod_id': production.id})
+        first = self.client.get(url)
+        self.assertNotIn('Last-Modified', first)
+        etag = first['ETag']
+        self.assertEqual(self.client.get(url,
+            HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        
+        Invitation.objects.create(production=production, inviter=owner,
+            invitee=user_model.objects.create_user('invitee'),
+            exp_dt='2099-01-01T00:00:00Z')
+        self.assertEqual(self.client.get(url,
+            HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class InvtBulkCreateTest(TestCase):
+    '''複数のユーザをまとめて招待する
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.owner = user_model.objects.create_user('owner')
+        cls.member = user_model.objects.create_user('member')
+        cls.invited = user_model.objects.create_user('invited')
+        for i in range(3):
+            user_model.objects.create_user(f'new{i}')
+        
+        cls.production = Production.objects.create(name='prod')
+        ProdUser.objects.create(production=cls.production, user=cls.owner,
+            is_owner=True)
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+        Invitation.objects.create(production=cls.production,
+            inviter=cls.owner, invitee=cls.invited,
+            exp_dt='2099-01-01T00:00:00Z')
+        cls.url = reverse('production:invt_bulk_create',
+            kwargs={'prod_id': cls.production.id})
+    
+    def test_report(self):
+        '''ID ごとの結果を返し、招待できるユーザだけを招待する
+        '''
+        self.client.force_login(self.owner)
+        response = self.client.post(self.url, {
+            'usernames': 'new0, new1\nmember invited nobody new1 new2'})
+        self.assertEqual(response.context['report'], [
+            ('new0', InvitationBulkForm.INVITED),
+            ('new1', InvitationBulkForm.INVITED),
+            ('member', InvitationBulkForm.ALREADY_MEMBER),
+            ('invited', InvitationBulkForm.ALREADY_INVITED),
+            ('nobody', InvitationBulkForm.NOT_FOUND),
+            ('new2', InvitationBulkForm.INVITED),
+        ])
+        self.assertEqual(sorted(Invitation.objects.filter(
+            production=self.production, inviter=self.owner)
+            .values_list('invitee__username', flat=True)),
+            ['invited', 'new0', 'new1', 'new2'])
+    
+    def test_num_queries(self):
+        '''人数によらず、検索・検査・保存のクエリの数は一定
+        '''
+        form = InvitationBulkForm({'usernames': 'new0 new1 new2 nobody'})
+        self.assertTrue(form.is_valid())
+        # ユーザ, メンバー, 招待中, INSERT, 公演の更新日時
+        # (と SAVEPOINT 2 回を 2 組)
+        with self.assertNumQueries(9):
+            form.save(self.production, self.owner, '2099-01-01T00:00:00Z')
+    
+    def test_unique(self):
+        '''同じ公演に同じユーザを 2 回招待できない
+        '''
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Invitation.objects.create(production=self.production,
+                inviter=self.owner, invitee=self.invited,
+                exp_dt='2099-01-01T00:00:00Z')
+    
+    def test_expired(self):
+        '''期限切れの招待は招待中とみなさず、招待し直す
+        '''
+        Invitation.objects.update(exp_dt='2000-01-01T00:00:00Z')
+        form = InvitationBulkForm({'usernames': 'invited'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.save(self.production, self.owner,
+            '2099-01-01T00:00:00Z'), [('invited', InvitationBulkForm.INVITED)])
+        self.assertEqual([str(exp_dt.year) for exp_dt
+            in Invitation.objects.values_list('exp_dt', flat=True)], ['2099'])
+        
+        # 1 人ずつ招待するビューでも
+        Invitation.objects.update(exp_dt='2000-01-01T00:00:00Z')
+        self.client.force_login(self.owner)
+        self.client.post(reverse('production:invt_create',
+            kwargs={'prod_id': self.production.id}), {'invitee_id': 'invited'})
+        invitation, = Invitation.objects.all()
+        self.assertFalse(invitation.expired())
+    
+    def test_bulk_race(self):
+        '''検査の後に招待された人は、招待中と報告する
+        '''
+        filter = Invitation.objects.filter
+        
+        def stale_filter(*args, **kwargs):
+            # 検査の時点では、まだ招待されていなかったことにする
+            return filter(*args, **kwargs).none()
+        
+        form = InvitationBulkForm({'usernames': 'new0 invited'})
+        self.assertTrue(form.is_valid())
+        with mock.patch.object(Invitation.objects, 'filter', stale_filter):
+            report = form.save(self.production, self.owner,
+                '2099-01-01T00:00:00Z')
+        self.assertEqual(report, [('new0', InvitationBulkForm.INVITED),
+            ('invited', InvitationBulkForm.ALREADY_INVITED)])
+        self.assertEqual(Invitation.objects.filter(
+            invitee__username__in=['new0', 'invited']).count(), 2)
+    
+    def test_create_race(self):
+        '''検査の後に招待されていても、重複せず招待できなかったことにする
+        '''
+        from django.db.models.query import QuerySet
+        
+        self.client.force_login(self.owner)
+        url = reverse('production:invt_create',
+            kwargs={'prod_id': self.production.id})
+        # 検査の時点では、まだ招待されていなかったことにする
+        with mock.patch.object(QuerySet, 'exists', return_value=False):
+            response = self.client.post(url, {'invitee_id': 'invited'})
+        self.assertEqual([str(message) for message
+            in get_messages(response.wsgi_request)], ['招待できませんでした。'])
+        self.assertEqual(Invitation.objects.filter(
+            production=self.production, invitee=self.invited).count(), 1)
+    
+    def test_owner_only(self):
+        '''所有権がなければ招待できない
+        '''
+        self.client.force_login(self.member)
+        response = self.client.post(self.url, {'usernames': 'new0'})
+        self.assertEqual(response.status_code, 403)
+
+
+@shared_cache
+class InvtAutocompleteTest(TestCase):
+    '''招待する人の ID の補完
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.owner = user_model.objects.create_user('owner')
+        cls.member = user_model.objects.create_user('Alice-member')
+        cls.invited = user_model.objects.create_user('alice-invited')
+        user_model.objects.create_user('ALICE', first_name='Alice',
+            last_name='Smith')
+        user_model.objects.create_user('alice2')
+        user_model.objects.create_user('bob')
+        
+        cls.production = Production.objects.create(name='prod')
+        ProdUser.objects.create(production=cls.production, user=cls.owner,
+            is_owner=True)
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+        Invitation.objects.create(production=cls.production,
+            inviter=cls.owner, invitee=cls.invited,
+            exp_dt='2099-01-01T00:00:00Z')
+        cls.url = reverse('production:invt_autocomplete',
+            kwargs={'prod_id': cls.production.id})
+    
+    def setUp(self):
+        caches['default'].clear()
+    
+    def test_candidates(self):
+        '''メンバーと招待中のユーザを除き、大文字小文字を区別せずに補完する
+        '''
+        self.client.force_login(self.owner)
+        response = self.client.get(self.url, {'q': 'ali'})
+        self.assertEqual(response.json(), {'results': [
+            {'username': 'ALICE', 'name': 'Smith Alice'},
+            {'username': 'alice2', 'name': ''},
+        ]})
+        
+        # 同じ入力はキャッシュから返す
+        with self.assertNumQueries(2):
+            self.client.get(self.url, {'q': 'ALI'})
+    
+    def test_empty(self):
+        '''入力が空なら検索しない
+        '''
+        self.client.force_login(self.owner)
+        response = self.client.get(self.url, {'q': ' '})
+        self.assertEqual(response.json(), {'results': []})
+    
+    def test_owner_only(self):
+        '''所有権がなければ補完できない
+        '''
+        self.client.force_login(self.member)
+        response = self.client.get(self.url, {'q': 'ali'})
+        self.assertEqual(response.status_code, 403)
+
+
+class ProdJoinTest(TestCase):
+    '''招待を使って公演に参加する
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.owner = user_model.objects.create_user('owner')
+        cls.invited = user_model.objects.create_user('invited')
+        cls.production = Production.objects.create(name='prod')
+        ProdUser.objects.create(production=cls.production, user=cls.owner,
+            is_owner=True)
+    
+    def setUp(self):
+        self.invitation = Invitation.objects.create(
+            production=self.production, inviter=self.owner,
+            invitee=self.invited, exp_dt='2099-01-01T00:00:00Z')
+        self.url = reverse('production:prod_join',
+            kwargs={'invt_id': self.invitation.id})
+    
+    def test_join(self):
+        '''参加すると招待は消え、同じ招待では 2 回参加できない
+        '''
+        self.client.force_login(self.invited)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'prod')
+        
+        # セッション, ユーザ, 招待 (公演を JOIN してロック),
+        # INSERT, DELETE, 公演の更新日時 (招待の削除とメンバーの追加で 2 回)
+        # と SAVEPOINT 2 組 (トランザクションと INSERT)
+        with self.assertNumQueries(11):
+            response = self.client.post(self.url)
+        self.assertRedirects(response, reverse('production:prod_list'),
+            fetch_redirect_response=False)
+        self.assertTrue(ProdUser.objects.filter(
+            production=self.production, user=self.invited).exists())
+        self.assertFalse(Invitation.objects.exists())
+        
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(ProdUser.objects.filter(
+            production=self.production, user=self.invited).count(), 1)
+    
+    def test_already_member(self):
+        '''すでにメンバーなら、招待を消すだけで重複しない
+        '''
+        ProdUser.objects.create(production=self.production, user=self.invited,
+            is_editor=True)
+        self.client.force_login(self.invited)
+        response = self.client.post(self.url)
+        self.assertEqual([str(message) for message
+            in get_messages(response.wsgi_request)],
+            ['prod には既に参加しています。'])
+        self.assertEqual(list(ProdUser.objects.filter(
+            production=self.production, user=self.invited)
+            .values_list('is_editor', flat=True)), [True])
+        self.assertFalse(Invitation.objects.exists())
+    
+    def test_add_member(self):
+        '''すでにメンバーなら None を返し、キャッシュも版数も変えない
+        '''
+        self.assertIsNotNone(add_member(self.production, self.invited))
+        with mock.patch.object(page_cache, 'bump') as bump:
+            self.assertIsNone(add_member(self.production, self.invited))
+        bump.assert_not_called()
+        self.assertEqual(ProdUser.objects.filter(
+            production=self.production, user=self.invited).count(), 1)
+    
+    def test_unique(self):
+        '''同じ公演に同じユーザを 2 回登録できない
+        '''
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProdUser.objects.create(production=self.production,
+                user=self.owner)
+    
+    def test_invitee_only(self):
+        '''招待された本人でなければ参加できない
+        '''
+        self.client.force_login(self.owner)
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Invitation.objects.exists())
+
+
+class PurgeExpiredInvitationsTest(TestCase):
+    '''期限切れの招待の削除
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.owner = user_model.objects.create_user('owner')
+        cls.production = Production.objects.create(name='prod')
+        ProdUser.objects.create(production=cls.production, user=cls.owner,
+            is_owner=True)
+        for i in range(5):
+            Invitation.objects.create(production=cls.production,
+                inviter=cls.owner,
+                invitee=user_model.objects.create_user(f'expired{i}'),
+                exp_dt='2000-01-01T00:00:00Z')
+        Invitation.objects.create(production=cls.production,
+            inviter=cls.owner,
+            invitee=user_model.objects.create_user('valid'),
+            exp_dt='2099-01-01T00:00:00Z')
+    
+    def test_purge(self):
+        '''期限切れの招待だけを、バッチに分けて削除する
+        '''
+        out = io.StringIO()
+        call_command('purge_expired_invitations', batch_size=2, stdout=out)
+        self.assertIn('5 件', out.getvalue())
+        self.assertEqual(list(Invitation.objects.values_list(
+            'invitee__username', flat=True)), ['valid'])
+    
+    def test_usr_list(self):
+        '''メンバー一覧には、削除されるまで期限切れの招待も表示する
+        '''
+        self.client.force_login(self.owner)
+        url = reverse('production:usr_list',
+            kwargs={'prod_id': self.production.id})
+        response = self.client.get(url)
+        self.assertEqual(sorted(invt.invitee.username for invt
+            in response.context['view'].invitations),
+            [f'expired{i}' for i in range(5)] + ['valid'])
+        self.assertContains(response, '(期限切れ)', count=5)
+        
+        # 期限切れの招待も削除できる
+        invitation = Invitation.objects.get(invitee__username='expired0')
+        self.client.post(reverse('production:invt_delete',
+            kwargs={'pk': invitation.id, 'from': 'usr_list'}))
+        self.assertFalse(Invitation.objects.filter(id=invitation.id).exists())
+        self.assertContains(self.client.get(url), '(期限切れ)', count=4)
+    
+    def test_conditional_get(self):
+        '''招待が期限切れになれば、所有者には 200 を返す
+        '''
+        self.client.force_login(self.owner)
+        url = reverse('production:usr_list',
+            kwargs={'prod_id': self.production.id})
+        etag = self.client.get(url)['ETag']
+        Invitation.objects.filter(invitee__username='valid')\
+            .update(exp_dt='2000-01-01T00:00:00Z')
+        self.assertEqual(self.client.get(url,
+            HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ProdDeleteTest(TestCase):
+    '''公演の削除は印を付けるだけで、関連レコードは後で少しずつ削除する
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        from rehearsal.models import Rehearsal
+        
+        user_model = get_user_model()
+        cls.owner = user_model.objects.create_user('owner')
+        cls.member = user_model.objects.create_user('member')
+        cls.production = Production.objects.create(name='doomed')
+        owner = ProdUser.objects.create(production=cls.production,
+            user=cls.owner, is_owner=True)
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+        Invitation.objects.create(production=cls.production,
+            inviter=cls.owner,
+            invitee=user_model.objects.create_user('invited'),
+            exp_dt='2099-01-01T00:00:00Z')
+        Rehearsal.objects.bulk_create([Rehearsal(production=cls.production,
+            date='2021-09-10', assignee=owner) for _ in range(5)])
+        
+        # 削除しない公演
+        cls.other = Production.objects.create(name='other')
+        ProdUser.objects.create(production=cls.other, user=cls.owner,
+            is_owner=True)
+        Rehearsal.objects.create(production=cls.other, date='2021-09-10')
+    
+    def setUp(self):
+        caches['default'].clear()
+    
+    def test_pending(self):
+        '''削除を受け付けた公演は、owner に進み具合が見えるだけになる
+        '''
+        self.client.force_login(self.owner)
+        response = self.client.post(reverse('production:prod_delete',
+            kwargs={'pk': self.production.id}))
+        self.assertRedirects(response, reverse('production:prod_list'),
+            fetch_redirect_response=False)
+        self.production.refresh_from_db()
+        self.assertTrue(self.production.pending_deletion)
+        
+        response = self.client.get(reverse('production:prod_list'))
+        self.assertContains(response, 'DELETING...　TASK 5 left')
+        for url, status in (
+            (reverse('production:prod_update',
+                kwargs={'pk': self.production.id}), 404),
+            (reverse('production:usr_list',
+                kwargs={'prod_id': self.production.id}), 403),
+            (reverse('rehearsal:rhsl_list',
+                kwargs={'prod_id': self.production.id}), 403),
+        ):
+            self.assertEqual(self.client.get(url).status_code, status)
+        
+        self.client.force_login(self.member)
+        response = self.client.get(reverse('production:prod_list'))
+        self.assertNotContains(response, 'doomed')
+    
+    def test_delete_productions(self):
+        '''関連レコードをバッチに分けて削除し、最後に公演を削除する
+        '''
+        from rehearsal.models import Rehearsal
+        
+        Production.objects.filter(id=self.production.id)\
+            .update(deletion_requested_at='2021-09-10T00:00:00Z')
+        out = io.StringIO()
+        call_command('delete_productions', batch_size=2, stdout=out)
+        self.assertIn('関連レコード 8 件', out.getvalue())
+        
+        self.assertFalse(Production.objects.filter(
+            id=self.production.id).exists())
+        self.assertEqual(Rehearsal.objects.count(), 1)
+        self.assertEqual(ProdUser.objects.count(), 1)
+        self.assertFalse(Invitation.objects.exists())
+
+
+class SharedCacheCheckTest(TestCase):
+    '''キャッシュの設定の検査
+    '''
+    def test_local_cache(self):
+        '''本番環境でプロセスごとのキャッシュを使うと警告する
+        '''
+        with override_settings(DEBUG=False):
+            self.assertEqual([warning.id for warning
+                in check_shared_cache(None)], ['production.W001'])
+        with override_settings(DEBUG=True):
+            self.assertEqual(check_shared_cache(None), [])
+    
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_shared_cache(self):
+        '''共有されるキャッシュなら警告しない
+        '''
+        with override_settings(DEBUG=False):
+            self.assertEqual(check_shared_cache(None), [])
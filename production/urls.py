@@ -28,6 +28,14 @@ urlpatterns = [
     # /prod/invt_create/1/ -> Invitation Create for Production #1
     path('invt_create/<int:prod_id>/', views.InvtCreate.as_view(), name='invt_create'),
 
+    # /prod/invt_bulk_create/1/ -> Bulk Invitation Create for Production #1
+    path('invt_bulk_create/<int:prod_id>/', views.InvtBulkCreate.as_view(),
+        name='invt_bulk_create'),
+
+    # /prod/invt_autocomplete/1/?q=ab -> Invitee candidates for Production #1
+    path('invt_autocomplete/<int:prod_id>/', views.InvtAutocomplete.as_view(),
+        name='invt_autocomplete'),
+
     # /prod/invt_delete/1/{usr_list|prod_list}/ -> Invitation #1 Delete
     path('invt_delete/<int:pk>/<str:from>/', views.InvtDelete.as_view(), name='invt_delete'),
 
@@ -1,10 +1,19 @@
+import hashlib
 from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.db.models import FilteredRelation, OuterRef, Q, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from .models import ProdUser
+from .membership import cached_prod_user
 
 
 def accessing_prod_user(view, prod_id=None):
     '''アクセス情報から対応する ProdUser を取得する
     
+    ユーザごとのメンバー情報のキャッシュから読み、
+    同じリクエスト内では同じ公演について 1 回しか検索しない
+    
     Parameters
     ----------
     view : View
@@ -14,11 +23,49 @@ def accessing_prod_user(view, prod_id=None):
     '''
     if not prod_id:
         prod_id=view.kwargs['prod_id']
-    prod_users = ProdUser.objects.filter(
-        production__pk=prod_id, user=view.request.user)
-    if len(prod_users) < 1:
-        return None
-    return prod_users[0]
+    prod_id = int(prod_id)
+    
+    # リクエストに付けたメモになければ、キャッシュから取得してメモする
+    memo = prod_user_memo(view.request)
+    if prod_id not in memo:
+        memo[prod_id] = cached_prod_user(view.request.user, prod_id)
+    return memo[prod_id]
+
+
+def prod_user_memo(request):
+    '''リクエストごとの {prod_id: ProdUser} のメモを返す
+    
+    メンバーでない公演は値が None になる
+    '''
+    if not hasattr(request, '_prod_user_memo'):
+        request._prod_user_memo = {}
+    return request._prod_user_memo
+
+
+def test_permission(prod_user, permission='member'):
+    '''ProdUser が要求された権限を持っているか検査する
+    
+    Parameters
+    ----------
+    prod_user : ProdUser
+        検査する ProdUser (メンバーでなければ None)
+    permission : str
+        'member', 'editor', 'owner' のいずれか
+    '''
+    # メンバーでなければアクセス拒否
+    if not prod_user:
+        raise PermissionDenied
+    
+    # 所有権または編集権を持っていなければアクセス拒否
+    if permission == 'editor'\
+        and not (prod_user.is_owner or prod_user.is_editor):
+        raise PermissionDenied
+    
+    # 所有権を持っていなければアクセス拒否
+    if permission == 'owner' and not prod_user.is_owner:
+        raise PermissionDenied
+    
+    return prod_user
 
 
 def test_edit_permission(view, prod_id=None):
@@ -31,14 +78,8 @@ def test_edit_permission(view, prod_id=None):
     '''
     # アクセス情報から公演ユーザを取得する
     prod_user = accessing_prod_user(view, prod_id=prod_id)
-    if not prod_user:
-        raise PermissionDenied
     
-    # 所有権または編集権を持っていなければアクセス拒否
-    if not (prod_user.is_owner or prod_user.is_editor):
-        raise PermissionDenied
-    
-    return prod_user
+    return test_permission(prod_user, 'editor')
 
 
 def test_owner_permission(view, prod_id=None):
@@ -51,11 +92,180 @@ def test_owner_permission(view, prod_id=None):
     '''
     # アクセス情報から公演ユーザを取得する
     prod_user = accessing_prod_user(view, prod_id=prod_id)
-    if not prod_user:
-        raise PermissionDenied
     
-    # 所有権または編集権を持っていなければアクセス拒否
-    if not (prod_user.is_owner):
-        raise PermissionDenied
+    return test_permission(prod_user, 'owner')
+
+
+class ProdAccessMixin:
+    '''対象レコード, その Production, アクセス中の ProdUser を
+    1 回のクエリで取得し、アクセス権を検査する mixin
     
-    return prod_user
+    SingleObjectMixin を持つ View (UpdateView など) と組み合わせる。
+    取得したレコードは view にキャッシュされ、get_object() と
+    テンプレートの両方から再利用される。
+    
+    Attributes
+    ----------
+    access_permission : str
+        要求する権限。'member', 'editor', 'owner' のいずれか
+    production_path : str
+        対象レコードから Production へのルックアップ。
+        対象が Production そのものなら空文字列
+    '''
+    access_permission = 'member'
+    production_path = 'production'
+    
+    def dispatch(self, request, *args, **kwargs):
+        '''リクエストを受けるハンドラ
+        
+        GET, POST のどちらでも、ハンドラの前にアクセス権を検査する
+        '''
+        # 未ログインなら LoginRequiredMixin に任せる
+        if not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+        
+        # 対象レコードとアクセス中の公演ユーザを取得する
+        obj = self.get_object()
+        
+        # production, prod_user を view の属性として持っておく
+        # テンプレートやフォームから参照するため
+        if self.production_path:
+            self.production = getattr(obj, self.production_path)
+        else:
+            self.production = obj
+        # 削除待ちの公演は無いものとして扱う
+        if self.production.pending_deletion:
+            raise Http404
+        # メンバーでなければ JOIN した ProdUser は無い
+        self.prod_user = getattr(obj, 'accessing_prod_user', None)
+        if self.prod_user:
+            self.prod_user.production = self.production
+        
+        # 同じリクエスト内で accessing_prod_user() を呼んでも
+        # クエリを発行しないよう、メモしておく
+        prod_user_memo(request)[self.production.id] = self.prod_user
+        
+        # アクセス権を検査する
+        self.test_access(obj, self.prod_user)
+        
+        return super().dispatch(request, *args, **kwargs)
+    
+    def test_access(self, obj, prod_user):
+        '''アクセス権を検査する
+        
+        権限が足りなければ PermissionDenied を投げる。
+        個別のルールが必要な View ではオーバーライドする
+        '''
+        test_permission(prod_user, self.access_permission)
+    
+    def get_object(self, queryset=None):
+        '''Production, ProdUser を JOIN して対象レコードを取得する
+        
+        2 回目以降はキャッシュしたレコードを返す
+        '''
+        if not hasattr(self, '_access_object'):
+            if queryset is None:
+                queryset = self.get_queryset()
+            queryset = self.join_prod_user(queryset)
+            self._access_object = super().get_object(queryset=queryset)
+        return self._access_object
+    
+    def join_prod_user(self, queryset):
+        '''queryset に Production とアクセス中の ProdUser を JOIN する
+        
+        ProdUser は accessing_prod_user 属性にセットされる
+        (メンバーでなければセットされない)
+        '''
+        if self.production_path:
+            queryset = queryset.select_related(self.production_path)
+            prod_user_path = f'{self.production_path}__produser'
+        else:
+            prod_user_path = 'produser'
+        
+        condition = Q(**{f'{prod_user_path}__user': self.request.user})
+        return queryset.annotate(accessing_prod_user=FilteredRelation(
+            prod_user_path, condition=condition,
+        )).select_related('accessing_prod_user')
+
+
+def production_stamps(queryset, **aggregates):
+    '''公演ごとに子レコードを集計するサブクエリ
+    
+    Production の QuerySet を annotate() して、
+    公演と子レコードの更新日時・件数を 1 回のクエリで求めるために使う
+    
+    Parameters
+    ----------
+    queryset : QuerySet
+        production で公演を参照する子モデルの QuerySet
+    aggregates : dict
+        {名前: 集計関数}
+    '''
+    rows = queryset.filter(production=OuterRef('pk'))\
+        .order_by().values('production')
+    return {name: Subquery(rows.annotate(value=aggregate).values('value'))
+        for name, aggregate in aggregates.items()}
+
+
+class ConditionalGetMixin:
+    '''GET に ETag, Last-Modified を付け、変わっていなければ 304 を返す mixin
+    
+    レコードを読む前に page_validator() で安い検証子を求め、
+    ブラウザの持っているものと同じなら、クエリも描画もせずに返す
+    '''
+    def dispatch(self, request, *args, **kwargs):
+        '''検証子が一致すれば 304 を返し、しなければ View に処理させる
+        '''
+        validator = None
+        if request.method in ('GET', 'HEAD')\
+            and request.user.is_authenticated:
+            validator = self.page_validator()
+        if validator is None:
+            return super().dispatch(request, *args, **kwargs)
+        
+        # 描画中に変わっても、次のリクエストで新しい検証子になるだけ
+        etag, last_modified = validator
+        response = get_conditional_response(request, etag=etag,
+            last_modified=last_modified)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            # ブラウザは毎回確かめ、変わっていなければ 304 で済ませる
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+    
+    def page_validator(self):
+        '''ページの検証子 (ETag, Last-Modified の UNIX 時間) を返す
+        
+        求められない時 (メンバーでないなど) は None を返し、
+        View の通常の処理に任せる
+        '''
+        return None
+    
+    def make_validator(self, prod_user, stamps, last_modified=True):
+        '''更新日時・件数などの値から検証子を作る
+        
+        権限によって表示が変わるので、メンバーの権限も ETag に含める
+        
+        Parameters
+        ----------
+        prod_user : ProdUser
+            アクセス中の ProdUser
+        stamps : tuple
+            ページの内容が変われば変わる値
+        last_modified : bool
+            更新日時の最大値を Last-Modified にするか
+            (更新日時の無いレコードも表示するページでは False)
+        '''
+        role = (prod_user.is_owner, prod_user.is_editor)
+        digest = hashlib.md5(repr((role,) + tuple(stamps)).encode())
+        
+        timestamp = None
+        if last_modified:
+            times = [stamp for stamp in stamps if hasattr(stamp, 'timestamp')]
+            if times:
+                timestamp = int(max(times).timestamp())
+        return f'"{digest.hexdigest()}"', timestamp
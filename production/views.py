@@ -1,14 +1,24 @@
 from datetime import datetime, timedelta, timezone
-from django.views.generic import ListView
+from urllib.parse import quote
+from django.views.generic import ListView, TemplateView, View
+from django.views.generic.edit import FormView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from django.http import Http404
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Q
 from .view_func import *
 from .models import Production, ProdUser, Invitation
+from .forms import InvitationBulkForm
+from .membership import add_member
+from .page_cache import CachedPageMixin
+from .summaries import production_summaries, FIELDS as SUMMARY_FIELDS
 
 
 class ProdList(LoginRequiredMixin, ListView):
@@ -23,17 +33,34 @@ class ProdList(LoginRequiredMixin, ListView):
         '''表示時のリクエストを受けるハンドラ
         '''
         # 座組への招待を表示するため、ビューの属性にする
+        # 公演名と招待した人を表示するので、一緒に取得する
         now = datetime.now(timezone.utc)
         self.invitations = Invitation.objects.filter(invitee=self.request.user,
-            exp_dt__gt=now)
+            exp_dt__gt=now, production__deletion_requested_at__isnull=True)\
+            .select_related('production', 'inviter')
         
         return super().get(request, *args, **kwargs)
     
     def get_queryset(self):
         '''リストに表示するレコードをフィルタする
+        
+        課題ごとのタスクの集計は、公演ごとにキャッシュしたものを使う
+        (期限が切れても、1 つのワーカーが作り直す間は古い集計を表示する)
         '''
         # 自分である ProdUser を取得する
-        prod_users = ProdUser.objects.filter(user=self.request.user)
+        # 削除待ちの公演は、削除の進み具合を見せるため owner にだけ表示する
+        prod_users = list(ProdUser.objects.filter(user=self.request.user)\
+            .filter(Q(production__deletion_requested_at__isnull=True)
+                | Q(is_owner=True))\
+            .select_related('production').order_by('production__id'))
+        
+        # 課題のタスクを進捗ごとに数えたものを、属性としてセットする
+        summaries = production_summaries(
+            [prod_user.production_id for prod_user in prod_users])
+        for prod_user in prod_users:
+            summary = summaries[prod_user.production_id]
+            for field in SUMMARY_FIELDS:
+                setattr(prod_user, field, summary.get(field))
         return prod_users
 
 
@@ -51,9 +78,7 @@ class ProdCreate(LoginRequiredMixin, CreateView):
         new_prod = form.save(commit=True)
         
         # 自分を owner として公演ユーザに追加する
-        prod_user = ProdUser(production=new_prod, user=self.request.user,
-            is_owner=True)
-        prod_user.save()
+        add_member(new_prod, self.request.user, is_owner=True)
         
         messages.success(self.request, str(new_prod) + " を作成しました。")
         return super().form_valid(form)
@@ -65,28 +90,16 @@ class ProdCreate(LoginRequiredMixin, CreateView):
         return super().form_invalid(form)
 
 
-class ProdUpdate(LoginRequiredMixin, UpdateView):
+class ProdUpdate(LoginRequiredMixin, ProdAccessMixin, UpdateView):
     '''Production の更新ビュー
     '''
     model = Production
     fields = ('name',)
     success_url = reverse_lazy('production:prod_list')
     
-    def get(self, request, *args, **kwargs):
-        '''表示時のリクエストを受けるハンドラ
-        '''
-        # 所有権を検査する
-        test_owner_permission(self, kwargs['pk'])
-        
-        return super().get(request, *args, **kwargs)
-    
-    def post(self, request, *args, **kwargs):
-        '''保存時のリクエストを受けるハンドラ
-        '''
-        # 所有権を検査する
-        test_owner_permission(self, kwargs['pk'])
-        
-        return super().post(request, *args, **kwargs)
+    # 所有権を検査する
+    access_permission = 'owner'
+    production_path = ''
     
     def form_valid(self, form):
         '''バリデーションを通った時
@@ -101,42 +114,68 @@ class ProdUpdate(LoginRequiredMixin, UpdateView):
         return super().form_invalid(form)
 
 
-class ProdDelete(LoginRequiredMixin, DeleteView):
+class ProdDelete(LoginRequiredMixin, ProdAccessMixin, DeleteView):
     '''Production の削除ビュー
     '''
     model = Production
     template_name_suffix = '_delete'
     success_url = reverse_lazy('production:prod_list')
     
-    def get(self, request, *args, **kwargs):
-        '''表示時のリクエストを受けるハンドラ
-        '''
-        # 所有権を検査する
-        test_owner_permission(self, kwargs['pk'])
-        
-        return super().get(request, *args, **kwargs)
-    
-    def post(self, request, *args, **kwargs):
-        '''保存時のリクエストを受けるハンドラ
-        '''
-        # 所有権を検査する
-        test_owner_permission(self, kwargs['pk'])
-        
-        return super().post(request, *args, **kwargs)
+    # 所有権を検査する
+    access_permission = 'owner'
+    production_path = ''
     
     def delete(self, request, *args, **kwargs):
-        '''削除した時のメッセージ
+        '''削除の印を付ける
+        
+        関連レコードは delete_productions コマンドが後で削除する。
+        保存時のシグナルでメンバー全員のメンバー情報が破棄され、
+        以後どのビューからもアクセスできなくなる
         '''
-        result = super().delete(request, *args, **kwargs)
+        self.object = self.get_object()
+        self.object.deletion_requested_at = datetime.now(timezone.utc)
+        self.object.save(update_fields=['deletion_requested_at'])
+        
         messages.success(
-            self.request, str(self.object) + " を削除しました。")
-        return result
+            self.request, str(self.object) + " の削除を受け付けました。")
+        return redirect(self.get_success_url())
 
 
-class UsrList(LoginRequiredMixin, ListView):
+class UsrList(ConditionalGetMixin, LoginRequiredMixin, CachedPageMixin,
+    ListView):
     '''ProdUser のリストビュー
+    
+    編集権のないメンバーには、キャッシュしたページを返す。
+    変わっていなければ 304 を返す
     '''
     model = ProdUser
+    page_cache_name = 'usr_list'
+    
+    def page_validator(self):
+        '''公演とメンバーの更新日時の最大値, 件数と、招待の件数から検証子を作る
+        
+        招待には更新日時が無いので、所有者 (招待を表示する) には
+        Last-Modified を付けない
+        期限切れの表示が変わるよう、期限切れの招待の件数も含める
+        '''
+        prod_user = accessing_prod_user(self, self.kwargs['prod_id'])
+        if not prod_user:
+            return None
+        now = datetime.now(timezone.utc)
+        stamps = Production.objects.filter(id=prod_user.production_id)\
+            .annotate(**production_stamps(ProdUser.objects.all(),
+                prod_user_updated=Max('updated_at'),
+                prod_user_count=Count('id')))\
+            .annotate(**production_stamps(Invitation.objects.all(),
+                invitation_last=Max('id'), invitation_count=Count('id'),
+                invitation_expired=Count('id', filter=Q(exp_dt__lte=now))))\
+            .values_list('updated_at', 'prod_user_updated', 'prod_user_count',
+                'invitation_last', 'invitation_count',
+                'invitation_expired').first()
+        if stamps is None:
+            return None
+        return self.make_validator(prod_user, stamps,
+            last_modified=not prod_user.is_owner)
     
     def get(self, request, *args, **kwargs):
         '''表示時のリクエストを受けるハンドラ
@@ -150,15 +189,24 @@ class UsrList(LoginRequiredMixin, ListView):
         self.prod_user = prod_user
         
         # 招待中のメンバーを表示するため、ビューの属性にする
-        self.invitations = Invitation.objects.filter(production=prod_user.production)
+        # 招待される人の ID と名前を表示するので、一緒に取得する
+        # 期限切れの招待も、削除できるよう purge_expired_invitations で
+        # 削除されるまでは表示する
+        self.invitations = Invitation.objects.filter(
+            production_id=prod_user.production_id).select_related('invitee')
         
         return super().get(request, *args, **kwargs)
     
     def get_queryset(self):
         '''リストに表示するレコードをフィルタする
+        
+        表示名を作るためのユーザの列だけを、一緒に取得する
         '''
         prod_id=self.kwargs['prod_id']
-        prod_users = ProdUser.objects.filter(production__pk=prod_id)
+        prod_users = ProdUser.objects.filter(production__pk=prod_id)\
+            .select_related('user').only('production_id', 'is_owner',
+                'is_editor', 'user__username', 'user__first_name',
+                'user__last_name').order_by('id')
         return prod_users
     
     def get_context_data(self, **kwargs):
@@ -172,32 +220,15 @@ class UsrList(LoginRequiredMixin, ListView):
         return context
 
 
-class UsrUpdate(LoginRequiredMixin, UpdateView):
+class UsrUpdate(LoginRequiredMixin, ProdAccessMixin, UpdateView):
     '''ProdUser の更新ビュー
     '''
     model = ProdUser
     fields = ('is_editor',)
     
-    def get(self, request, *args, **kwargs):
-        '''表示時のリクエストを受けるハンドラ
-        '''
-        # 所有権を検査してアクセス中の公演ユーザを取得する
-        prod_id = self.get_object().production.id
-        prod_user = test_owner_permission(self, prod_id)
-        
-        # テンプレートから参照できるよう、ビューの属性にしておく
-        self.prod_user = prod_user
-        
-        return super().get(request, *args, **kwargs)
-    
-    def post(self, request, *args, **kwargs):
-        '''保存時のリクエストを受けるハンドラ
-        '''
-        # 所有権を検査してアクセス中の公演ユーザを取得する
-        prod_id = self.get_object().production.id
-        prod_user = test_owner_permission(self, prod_id)
-        
-        return super().post(request, *args, **kwargs)
+    # 所有権を検査する
+    # アクセス中の公演ユーザはテンプレートから view.prod_user で参照する
+    access_permission = 'owner'
     
     def get_success_url(self):
         '''更新に成功した時の遷移先を動的に与える
@@ -219,37 +250,23 @@ class UsrUpdate(LoginRequiredMixin, UpdateView):
         return super().form_invalid(form)
 
 
-class UsrDelete(LoginRequiredMixin, DeleteView):
+class UsrDelete(LoginRequiredMixin, ProdAccessMixin, DeleteView):
     '''ProdUser の削除ビュー
     '''
     model = ProdUser
     template_name_suffix = '_delete'
     
-    def get(self, request, *args, **kwargs):
-        '''表示時のリクエストを受けるハンドラ
-        '''
-        # 所有権を検査してアクセス中の公演ユーザを取得する
-        prod_id = self.get_object().production.id
-        prod_user = test_owner_permission(self, prod_id)
-
-        # 自分自身を削除することはできない
-        if self.get_object() == prod_user:
-            raise PermissionDenied
-        
-        return super().get(request, *args, **kwargs)
+    # 所有権を検査する
+    access_permission = 'owner'
     
-    def post(self, request, *args, **kwargs):
-        '''保存時のリクエストを受けるハンドラ
+    def test_access(self, obj, prod_user):
+        '''アクセス権を検査する
         '''
-        # 所有権を検査してアクセス中の公演ユーザを取得する
-        prod_id = self.get_object().production.id
-        prod_user = test_owner_permission(self, prod_id)
-
+        super().test_access(obj, prod_user)
+        
         # 自分自身を削除することはできない
-        if self.get_object() == prod_user:
+        if obj == prod_user:
             raise PermissionDenied
-        
-        return super().post(request, *args, **kwargs)
     
     def get_success_url(self):
         '''削除に成功した時の遷移先を動的に与える
@@ -296,9 +313,9 @@ class InvtCreate(LoginRequiredMixin, CreateView):
         
         # それに一致するユーザを view の属性として持っておく
         user_model = get_user_model()
-        invitees = user_model.objects.filter(username=invitee_value)
-        if len(invitees) > 0:
-            self.invitee = invitees[0]
+        invitee = user_model.objects.filter(username=invitee_value).first()
+        if invitee:
+            self.invitee = invitee
         
         # prod_user, production を view の属性として持っておく
         # バリデーションと保存時に使うため
@@ -314,18 +331,18 @@ class InvtCreate(LoginRequiredMixin, CreateView):
         if not hasattr(self, 'invitee'):
             return self.form_invalid(form)
         
-        # 公演ユーザのユーザ ID リスト
-        prod_users = ProdUser.objects.filter(production=self.production)
-        prod_user_user_ids = [prod_user.user.id for prod_user in prod_users]
-        
-        # 招待中のユーザの ID リスト
-        invitations = Invitation.objects.filter(production=self.production)
-        current_invitee_ids = [invt.invitee.id for invt in invitations]
-        
         # 公演ユーザや招待中のユーザを招待することは出来ない。
-        if self.invitee.id in prod_user_user_ids\
-            or self.invitee.id in current_invitee_ids:
-            return self.form_invalid(form)
+        # (production, user) のインデックスで 1 行ずつ引く
+        # 期限切れの招待は、招待し直せるよう削除する
+        now = datetime.now(timezone.utc)
+        with transaction.atomic():
+            Invitation.objects.filter(production=self.production,
+                invitee=self.invitee, exp_dt__lte=now).delete()
+            if ProdUser.objects.filter(production=self.production,
+                    user=self.invitee).exists()\
+                or Invitation.objects.filter(production=self.production,
+                    invitee=self.invitee).exists():
+                return self.form_invalid(form)
         
         # 追加しようとするレコードの各フィールドをセット
         instance = form.save(commit=False)
@@ -334,10 +351,17 @@ class InvtCreate(LoginRequiredMixin, CreateView):
         instance.invitee = self.invitee
         # 期限は7日
         # デフォルトで UTC で保存されるが念の為 UTC を指定
-        instance.exp_dt = datetime.now(timezone.utc) + timedelta(days=7)
+        instance.exp_dt = now + timedelta(days=7)
+        
+        # 検査の後に同時に招待されていれば、一意制約で DB が拒否する
+        try:
+            with transaction.atomic():
+                response = super().form_valid(form)
+        except IntegrityError:
+            return self.form_invalid(form)
         
         messages.success(self.request, str(instance.invitee) + " さんを招待しました。")
-        return super().form_valid(form)
+        return response
     
     def get_success_url(self):
         '''追加に成功した時の遷移先を動的に与える
@@ -353,43 +377,120 @@ class InvtCreate(LoginRequiredMixin, CreateView):
         return super().form_invalid(form)
 
 
-class InvtDelete(LoginRequiredMixin, DeleteView):
-    '''Invitation の削除ビュー
+class InvtBulkCreate(LoginRequiredMixin, FormView):
+    '''複数のユーザをまとめて招待するビュー
+    
+    保存後は、ID ごとの結果を同じテンプレートで表示する
     '''
-    model = Invitation
-    template_name_suffix = '_delete'
+    form_class = InvitationBulkForm
+    template_name = 'production/invitation_bulk_form.html'
     
-    def get(self, request, *args, **kwargs):
-        '''表示時のリクエストを受けるハンドラ
+    def dispatch(self, request, *args, **kwargs):
+        '''リクエストを受けるハンドラ
         '''
-        # 公演の所有者または招待の invitee であることを検査する
-        invt = self.get_object()
-        prod_id = invt.production.id
-        prod_user = accessing_prod_user(self, prod_id)
+        # 未ログインなら LoginRequiredMixin に任せる
+        if not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
         
-        is_owner = prod_user and prod_user.is_owner
-        is_invitee = self.request.user == invt.invitee
-        
-        if not (is_owner or is_invitee):
-            raise PermissionDenied
+        # 所有権を検査してアクセス中の公演ユーザを取得する
+        # production はテンプレートで固定要素として表示する
+        self.prod_user = test_owner_permission(self)
+        self.production = self.prod_user.production
         
-        return super().get(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
     
-    def post(self, request, *args, **kwargs):
-        '''保存時のリクエストを受けるハンドラ
+    def form_valid(self, form):
+        '''バリデーションを通った時
         '''
-        # 公演の所有者または招待の invitee であることを検査する
-        invt = self.get_object()
-        prod_id = invt.production.id
-        prod_user = accessing_prod_user(self, prod_id)
+        # 期限は7日
+        exp_dt = datetime.now(timezone.utc) + timedelta(days=7)
+        report = form.save(self.production, self.request.user, exp_dt)
+        
+        invited = [username for username, result in report
+            if result == form.INVITED]
+        if invited:
+            messages.success(self.request, f'{len(invited)} 人を招待しました。')
+        if len(invited) < len(report):
+            messages.warning(self.request,
+                f'{len(report) - len(invited)} 人は招待できませんでした。')
         
+        # 結果を表示し、続けて招待できるよう空のフォームを出す
+        return self.render_to_response(self.get_context_data(
+            form=self.form_class(), report=report))
+    
+    def form_invalid(self, form):
+        '''招待に失敗した時
+        '''
+        messages.warning(self.request, "招待できませんでした。")
+        return super().form_invalid(form)
+
+
+class InvtAutocomplete(LoginRequiredMixin, View):
+    '''招待する人の ID を前方一致で補完する JSON を返すビュー
+    
+    GET パラメタ q で始まる ID (大文字小文字は区別しない) のユーザのうち、
+    メンバーでも招待中でもないユーザを返す。
+    同じ公演・同じ入力への結果は、しばらくキャッシュする
+    '''
+    # 返す候補の数
+    limit = 10
+    # 結果をキャッシュする秒数
+    cache_timeout = 30
+    
+    def get(self, request, *args, **kwargs):
+        '''表示時のリクエストを受けるハンドラ
+        '''
+        # 所有権を検査する
+        test_owner_permission(self)
+        
+        prefix = request.GET.get('q', '').strip()
+        if not prefix:
+            return JsonResponse({'results': []})
+        
+        key = 'invt_autocomplete:{}:{}'.format(
+            kwargs['prod_id'], quote(prefix.upper()))
+        results = cache.get(key)
+        if results is None:
+            results = self.search(kwargs['prod_id'], prefix)
+            cache.set(key, results, self.cache_timeout)
+        
+        return JsonResponse({'results': results})
+    
+    def search(self, prod_id, prefix):
+        '''ID が prefix で始まる、招待できるユーザを探す
+        
+        前方一致のインデックス (auth_user_username_prefix_idx) を使う。
+        大文字にするのは istartswith の条件だけで、並べ替えは username の列で行う
+        '''
+        members = ProdUser.objects.filter(production_id=prod_id)\
+            .values('user_id')
+        invitees = Invitation.objects.filter(production_id=prod_id)\
+            .values('invitee_id')
+        users = get_user_model().objects.filter(username__istartswith=prefix)\
+            .exclude(id__in=members).exclude(id__in=invitees)\
+            .order_by('username')\
+            .values('username', 'first_name', 'last_name')[:self.limit]
+        return [{
+            'username': user['username'],
+            'name': ' '.join(name for name in
+                (user['last_name'], user['first_name']) if name),
+        } for user in users]
+
+
+class InvtDelete(LoginRequiredMixin, ProdAccessMixin, DeleteView):
+    '''Invitation の削除ビュー
+    '''
+    model = Invitation
+    template_name_suffix = '_delete'
+    
+    def test_access(self, obj, prod_user):
+        '''公演の所有者または招待の invitee であることを検査する
+        '''
         is_owner = prod_user and prod_user.is_owner
-        is_invitee = self.request.user == invt.invitee
+        is_invitee = self.request.user.id == obj.invitee_id
         
         if not (is_owner or is_invitee):
             raise PermissionDenied
-        
-        return super().post(request, *args, **kwargs)
     
     def get_success_url(self):
         '''削除に成功した時の遷移先を動的に与える
@@ -410,11 +511,13 @@ class InvtDelete(LoginRequiredMixin, DeleteView):
         return result
 
 
-class ProdJoin(LoginRequiredMixin, CreateView):
+class ProdJoin(LoginRequiredMixin, TemplateView):
     '''公演に参加するビュー
+    
+    参加する公演とユーザは招待から決まるので、フォームは使わない。
+    POST では招待をロックし、ProdUser の追加と招待の削除を
+    1 つのトランザクションで行う
     '''
-    model = ProdUser
-    fields = ('production', 'user')
     template_name = 'production/production_join.html'
     success_url = reverse_lazy('production:prod_list')
     
@@ -422,60 +525,53 @@ class ProdJoin(LoginRequiredMixin, CreateView):
         '''表示時のリクエストを受けるハンドラ
         '''
         # 招待されているか検査し、参加できる公演を取得
-        self.production = self.production_to_join()
+        self.invitation = self.invitation_to_join()
+        self.production = self.invitation.production
         
         return super().get(request, *args, **kwargs)
     
     def post(self, request, *args, **kwargs):
-        '''保存時のリクエストを受けるハンドラ
-        '''
-        # 招待されているか検査し、参加できる公演を取得
-        self.production = self.production_to_join()
-        
-        return super().post(request, *args, **kwargs)
+        '''参加時のリクエストを受けるハンドラ
+        '''
+        with transaction.atomic():
+            # 招待をロックして取得する
+            # 同時に POST されても、後のリクエストは招待の削除を待ってから
+            # 招待が無いことになる
+            invt = self.invitation_to_join(lock=True)
+            self.production = invt.production
+            
+            # 既にメンバーなら追加しない
+            # (同時に追加されても、一意制約により重複しない)
+            joined = add_member(invt.production, request.user) is not None
+            
+            # 招待を削除
+            invt.delete()
+        
+        if joined:
+            messages.success(self.request,
+                str(invt.production) + " に参加しました。")
+        else:
+            messages.warning(self.request,
+                str(invt.production) + " には既に参加しています。")
+        return redirect(self.success_url)
     
-    def form_valid(self, form):
-        '''バリデーションを通った時
-        '''
-        # 招待を検査
-        invt_id = self.kwargs['invt_id'];
-        invts = Invitation.objects.filter(id=invt_id)
-        if len(invts) < 1:
-            return self.form_invalid(form)
-        invt = invts[0]
-        
-        # 保存するレコードを取得する
-        new_prod_user = form.save(commit=False)
-        
-        # 正しい公演がセットされているか
-        if new_prod_user.production != invt.production:
-            return self.form_invalid(form)
-        
-        # 正しいユーザがセットされているか
-        if new_prod_user.user != invt.invitee:
-            return self.form_invalid(form)
-        
-        # 招待を削除
-        invt.delete()
+    def invitation_to_join(self, lock=False):
+        '''招待されているか検査し、参加に使う招待を返す
         
-        messages.success(self.request, str(invt.production) + " に参加しました。")
-        return super().form_valid(form)
-    
-    def form_invalid(self, form):
-        '''参加に失敗した時
-        '''
-        messages.warning(self.request, "参加できませんでした。")
-        return super().form_invalid(form)
-    
-    def production_to_join(self):
-        '''招待されているか検査し、参加できる公演を返す
+        Parameters
+        ----------
+        lock : bool
+            True なら招待の行をロックする (トランザクション内で呼ぶ)
         '''
+        queryset = Invitation.objects.select_related('production')\
+            .filter(production__deletion_requested_at__isnull=True)
+        if lock:
+            queryset = queryset.select_for_update(of=('self',))
+        
         # 招待がなければ 404 エラーを投げる
-        invt_id = self.kwargs['invt_id'];
-        invts = Invitation.objects.filter(id=invt_id)
-        if len(invts) < 1:
+        invt = queryset.filter(id=self.kwargs['invt_id']).first()
+        if invt is None:
             raise Http404
-        invt = invts[0]
         
         # 招待が期限切れなら 404 エラーを投げる
         now = datetime.now(timezone.utc)
@@ -483,8 +579,7 @@ class ProdJoin(LoginRequiredMixin, CreateView):
             raise Http404
         
         # アクセス中のユーザが invitee でなければ PermissionDenied
-        user = self.request.user
-        if user != invt.invitee:
+        if self.request.user.id != invt.invitee_id:
             raise PermissionDenied
         
-        return invt.production
+        return invt
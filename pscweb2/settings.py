@@ -99,6 +99,29 @@ WSGI_APPLICATION = 'pscweb2.wsgi.application'
 DATABASES = { 'default': dj_database_url.config(conn_max_age=500) }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# 本番環境では、環境変数 CACHE_BACKEND, CACHE_LOCATION で全ワーカーが共有する
+# キャッシュを指定すること (例: django.core.cache.backends.db.DatabaseCache と
+# テーブル名。manage.py createcachetable でテーブルを作る)。
+# メンバー情報 (production/membership.py), ページの版数 (production/page_cache.py),
+# 集計の作り直しのロック (production/stale_cache.py) は、プロセスごとの
+# キャッシュでは他のワーカーと共有できない (メンバー情報と版数は、その時は
+# 毎回 DB で確かめる)。指定しなければ LocMemCache を使い、
+# 稽古一覧の行ごとにキャッシュするので (rehearsal/rows.py)、
+# 既定の 300 件より多く保存できるようにする
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+if CACHES['default']['BACKEND'].endswith('.LocMemCache'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': 10000}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -16,11 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from production.views import ProdList
+from rehearsal.views import RhslAgenda
 
 
 urlpatterns = [
     path('', include('user_app.urls')),
     path('', ProdList.as_view(), name='root'),
+    path('my_tasks/', RhslAgenda.as_view(), name='my_tasks'),
     #path('accounts/', include('django.contrib.auth.urls')),
     path('admin/', admin.site.urls),
     path('prod/', include('production.urls')),
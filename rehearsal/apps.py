@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class RehearsalConfig(AppConfig):
     name = 'rehearsal'
+    
+    def ready(self):
+        '''フィードのキャッシュの無効化と、検索のインデックスの更新の
+        シグナルを登録する
+        '''
+        from . import signals
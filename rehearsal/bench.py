@@ -0,0 +1,243 @@
+'''稽古のベンチマークのシナリオ
+'''
+import tracemalloc
+from datetime import date, timedelta
+from production.bench import scenario, measure, create_production, get_page
+from .models import Rehearsal
+
+
+def create_rehearsals(production, count, note='task'):
+    '''ベンチマーク用の稽古を作る
+    '''
+    start = date(2021, 9, 1)
+    rehearsals = [
+        Rehearsal(production=production, date=start + timedelta(days=i % 365),
+            note=f'{note} {i}', prog='Started')
+        for i in range(count)]
+    for rehearsal in rehearsals:
+        rehearsal.update_note_fields()
+    Rehearsal.objects.bulk_create(rehearsals, batch_size=1000)
+
+
+@scenario('rhsl_list')
+def bench_rhsl_list(size=100, repeat=20):
+    '''稽古一覧ページ
+    '''
+    from .views import RhslList
+    
+    production, prod_users = create_production(members=1)
+    create_rehearsals(production, size)
+    owner = prod_users[0].user
+    return [measure(f'rhsl_list ({size} tasks)',
+        lambda: get_page(RhslList, owner, prod_id=production.id), repeat)]
+
+
+@scenario('rhsl_detail')
+def bench_rhsl_detail(size=100, repeat=20):
+    '''稽古の詳細ページ
+    '''
+    from .views import RhslDetail
+    
+    production, prod_users = create_production(members=size)
+    create_rehearsals(production, 1)
+    rehearsal = Rehearsal.objects.filter(production=production).first()
+    owner = prod_users[0].user
+    return [measure('rhsl_detail',
+        lambda: get_page(RhslDetail, owner, pk=rehearsal.id), repeat)]
+
+
+@scenario('rhsl_list_note')
+def bench_rhsl_list_note(size=10000, repeat=3):
+    '''長いメモを持つ稽古の一覧を読む時のメモリと転送量
+    
+    note 全体を読む場合と、defer() で抜粋だけを読む場合を比べる
+    '''
+    production, prod_users = create_production(members=1)
+    create_rehearsals(production, size, note='長いメモ ' * 500)
+    rehearsals = Rehearsal.objects.filter(production=production)
+    
+    results = []
+    for label, queryset in (('full rows', rehearsals),
+        ("defer('note')", rehearsals.defer('note', 'note_html'))):
+        # 読み込まれる列の値のバイト数
+        fields = [field.attname for field in Rehearsal._meta.concrete_fields
+            if label == 'full rows'
+            or field.name not in ('note', 'note_html')]
+        transferred = sum(len(str(value).encode())
+            for row in queryset.values_list(*fields) for value in row)
+        
+        # レコードを読み込んだ時のメモリのピーク
+        tracemalloc.start()
+        list(queryset.all())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        
+        results.append(measure(f'{label} ({size} tasks)',
+            lambda: list(queryset.all()), repeat) + ({
+                'KiB transferred': transferred // 1024,
+                'KiB peak': peak // 1024},))
+    return results
+
+
+@scenario('note_html')
+def bench_note_html(size=100, repeat=20):
+    '''長いメモの詳細を表示する時、毎回 urlize する場合と保存した HTML を使う場合
+    '''
+    from django.template import Template, Context
+    
+    note = 'https://example.com/ を見ること\n' * size
+    rehearsal = Rehearsal(note=note)
+    rehearsal.update_note_fields()
+    filters = Template('{{ note | urlize | linebreaksbr }}')
+    stored = Template('{{ note_html|safe }}')
+    return [
+        measure(f'urlize | linebreaksbr ({size} lines)',
+            lambda: filters.render(Context({'note': note})), repeat),
+        measure(f'stored note_html ({size} lines)',
+            lambda: stored.render(Context({'note_html': rehearsal.note_html})),
+            repeat),
+    ]
+
+
+@scenario('rhsl_import')
+def bench_rhsl_import(size=10000, repeat=1):
+    '''CSV からの稽古の一括取り込みのスループット
+    
+    bulk_create で追加する場合と、PostgreSQL なら COPY で追加する場合を比べる
+    '''
+    import io
+    from django.db import connection
+    from .importer import read_rows, import_rehearsals
+    
+    production, prod_users = create_production(members=1)
+    username = prod_users[0].user.username
+    lines = ['date,note,assignee,prog']
+    start = date(2021, 9, 1)
+    for i in range(size):
+        lines.append(f'{start + timedelta(days=i % 365)},"task {i}\n詳細",'
+            f'{username if i % 2 else ""},Started')
+    data = '\n'.join(lines).encode()
+    
+    methods = [('bulk_create', False)]
+    if connection.vendor == 'postgresql':
+        methods.append(('COPY', True))
+    
+    results = []
+    for label, use_copy in methods:
+        outcome = {}
+        
+        def run():
+            outcome['result'] = import_rehearsals(production,
+                read_rows(io.BytesIO(data)), use_copy=use_copy)
+        
+        measured = measure(f'import {label} ({size} rows)', run, repeat)
+        results.append(measured + ({
+            'rows/s': int(outcome['result'].rows_per_second)},))
+    return results
+
+
+@scenario('rhsl_export')
+def bench_rhsl_export(size=10000, repeat=1):
+    '''稽古の書き出しの時間とメモリのピーク
+    
+    iterator() で少しずつ読むので、行数が増えてもピークは変わらない
+    '''
+    from .views import RhslExport
+    
+    production, prod_users = create_production(members=1)
+    create_rehearsals(production, size)
+    owner = prod_users[0].user
+    
+    results = []
+    for format in ('csv', 'jsonl'):
+        def export():
+            response = get_page(RhslExport, owner, f'/?format={format}',
+                prod_id=production.id)
+            for _ in response.streaming_content:
+                pass
+        
+        tracemalloc.start()
+        export()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        
+        results.append(measure(f'export {format} ({size} tasks)', export,
+            repeat) + ({'KiB peak': peak // 1024},))
+    return results
+
+
+@scenario('rhsl_search')
+def bench_rhsl_search(size=10000, repeat=20):
+    '''メモの全文検索と、インデックスを使わない icontains の比較
+    
+    1M 件で測るときは --size 1000000
+    '''
+    from . import search
+    
+    production, prod_users = create_production(members=1)
+    words = ['稽古場の予約', '衣装の採寸', '小道具の買い出し', '照明の仕込み',
+        '音響のきっかけ', '台本の修正', 'チラシの入稿', '劇場の下見']
+    start = date(2021, 9, 1)
+    for offset in range(0, size, 10000):
+        rehearsals = [Rehearsal(production=production,
+            date=start + timedelta(days=i % 365),
+            note=f'{words[i % len(words)]} {i}' + ('\n緊急' if i % 1000 == 0
+                else ''), prog='Started')
+            for i in range(offset, min(offset + 10000, size))]
+        for rehearsal in rehearsals:
+            rehearsal.update_note_fields()
+        Rehearsal.objects.bulk_create(rehearsals, batch_size=1000)
+    
+    backend = search.get_backend()
+    results = [measure(f'index {type(backend).__name__} ({size} tasks)',
+        lambda: backend.index_missing(production.id), 1)]
+    
+    prod_ids = [production.id]
+    # よく出る語と、1000 件に 1 件しか出ない語
+    for query in ('照明', '劇場 下見', '緊急'):
+        def scan():
+            rehearsals = Rehearsal.objects.filter(production_id__in=prod_ids)
+            for term in search.parse_query(query):
+                rehearsals = rehearsals.filter(note__icontains=term)
+            return list(rehearsals.order_by('date', 'id')[:50])
+        
+        results.append(measure(f'search "{query}" ({size} tasks)',
+            lambda: list(search.search(query, prod_ids)), repeat))
+        results.append(measure(f'icontains "{query}" ({size} tasks)', scan,
+            repeat))
+    return results
+
+
+@scenario('rhsl_rows')
+def bench_rhsl_rows(size=2000, repeat=5):
+    '''稽古一覧を 1 ページに size 行表示する時の描画時間
+    
+    行のキャッシュが無い時 (全ての行を描画する) と、
+    1 行だけ変えた後 (その行だけを描画する) を比べる
+    '''
+    from django.core.cache import caches
+    from .rows import CACHE_ALIAS
+    from .views import RhslList
+    
+    class LongRhslList(RhslList):
+        page_size = size
+    
+    production, prod_users = create_production(members=1)
+    create_rehearsals(production, size)
+    owner = prod_users[0].user
+    rehearsal = Rehearsal.objects.filter(production=production).first()
+    
+    def cold():
+        caches[CACHE_ALIAS].clear()
+        get_page(LongRhslList, owner, prod_id=production.id)
+    
+    def one_edited():
+        rehearsal.prog = 'DONE!!!' if rehearsal.prog == 'Started'\
+            else 'Started'
+        rehearsal.save(update_fields=['prog'])
+        get_page(LongRhslList, owner, prod_id=production.id)
+    
+    return [
+        measure(f'rhsl_list no row cache ({size} rows)', cold, repeat),
+        measure(f'rhsl_list 1 row edited ({size} rows)', one_edited, repeat),
+    ]
@@ -0,0 +1,61 @@
+'''稽古の書き出し
+
+importer.py で取り込める形 (列は id, date, note, assignee, prog) で、
+CSV または JSON Lines を 1 行ずつ生成する。
+'''
+import csv
+import json
+
+
+# 書き出す形式と Content-Type
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# 書き出す列と、読み出す時のルックアップ
+COLUMNS = ('id', 'date', 'note', 'assignee', 'prog')
+LOOKUPS = ('id', 'date', 'note', 'assignee__user__username', 'prog')
+
+
+class Echo:
+    '''書き込まれた文字列をそのまま返すファイルもどき
+    
+    csv.writer が 1 行ずつ文字列を返すようにするため
+    '''
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    '''CSV の行を生成する
+    
+    Excel で開いても文字化けしないよう、先頭に BOM を付ける
+    '''
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(['' if value is None else value
+            for value in row])
+
+
+def jsonl_lines(rows):
+    '''JSON Lines の行を生成する
+    '''
+    for row in rows:
+        data = dict(zip(COLUMNS, row))
+        data['date'] = data['date'].isoformat()
+        yield json.dumps(data, ensure_ascii=False) + '\n'
+
+
+def export_lines(rows, format='csv'):
+    '''形式に合わせて行を生成する
+    
+    Parameters
+    ----------
+    rows : iterable of tuple
+        LOOKUPS の順の値
+    '''
+    if format == 'jsonl':
+        return jsonl_lines(rows)
+    return csv_lines(rows)
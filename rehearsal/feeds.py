@@ -0,0 +1,166 @@
+'''締切の iCalendar フィード
+
+カレンダーアプリは数分ごとにフィードを取りに来るので、生成した ICS を
+キャッシュし、公演ごとの「最終更新時刻」が変わるまで使い回す。
+
+最終更新時刻は、稽古・公演の保存・削除時にシグナルで更新される
+(signals.py)。シグナルを送らない bulk_create() などで稽古を変更した時は
+invalidate() を呼ぶこと。
+'''
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from production.membership import memberships
+from .models import Rehearsal
+
+
+# 使うキャッシュの alias と保存期間 (秒)
+CACHE_ALIAS = getattr(settings, 'FEED_CACHE_ALIAS', 'default')
+CACHE_TIMEOUT = getattr(settings, 'FEED_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def stamp_key(prod_id):
+    '''公演の最終更新時刻のキャッシュキー
+    '''
+    return f'feed_stamp:{prod_id}'
+
+
+def feed_key(user_id, prod_id=None):
+    '''生成したフィードのキャッシュキー
+    '''
+    return f'feed:{user_id}:{prod_id or "all"}'
+
+
+def touch(*prod_ids):
+    '''公演の最終更新時刻を現在にし、その時刻を返す
+    '''
+    now = time.time()
+    caches[CACHE_ALIAS].set_many(
+        {stamp_key(prod_id): now for prod_id in set(prod_ids)}, CACHE_TIMEOUT)
+    return now
+
+
+def invalidate(*prod_ids):
+    '''公演のフィードを作り直させる
+    
+    トランザクション中なら、コミット後にもう一度更新する
+    (コミット前に他のリクエストが古い内容でフィードを作る場合があるため)
+    '''
+    if not prod_ids:
+        return
+    touch(*prod_ids)
+    transaction.on_commit(lambda: touch(*prod_ids))
+
+
+def stamps(prod_ids):
+    '''公演ごとの最終更新時刻 {prod_id: UNIX 時間}
+    
+    キャッシュから消えていた公演は、現在を最終更新時刻にする
+    (変わっていないかもしれないが、作り直せば必ず正しい)
+    '''
+    cache = caches[CACHE_ALIAS]
+    stored = cache.get_many([stamp_key(prod_id) for prod_id in prod_ids])
+    result = {prod_id: stored.get(stamp_key(prod_id)) for prod_id in prod_ids}
+    missing = [prod_id for prod_id, stamp in result.items() if stamp is None]
+    if missing:
+        now = touch(*missing)
+        result.update((prod_id, now) for prod_id in missing)
+    return result
+
+
+def get_feed(user, prod_id=None, host='localhost'):
+    '''ユーザの (prod_id を指定すればその公演の) フィードを返す
+    
+    公演の最終更新時刻が変わっていなければ、キャッシュしたものを返す
+    
+    Returns
+    -------
+    feed : dict
+        'body' (ICS の文字列), 'etag', 'last_modified' (UNIX 時間)。
+        メンバーでない公演を指定した時は None
+    '''
+    prod_ids = sorted(memberships(user))
+    if prod_id is not None:
+        if prod_id not in prod_ids:
+            return None
+        prod_ids = [prod_id]
+    
+    current = stamps(prod_ids)
+    cache = caches[CACHE_ALIAS]
+    key = feed_key(user.id, prod_id)
+    feed = cache.get(key)
+    # 対象の公演とその最終更新時刻が同じなら、作り直さない
+    if feed is None or feed['stamps'] != current:
+        body = render_feed(prod_ids, host)
+        feed = {
+            'stamps': current,
+            'body': body,
+            'etag': '"{}"'.format(hashlib.md5(body.encode()).hexdigest()),
+            'last_modified': max(current.values(), default=0),
+        }
+        cache.set(key, feed, CACHE_TIMEOUT)
+    return feed
+
+
+def render_feed(prod_ids, host):
+    '''公演の終わっていない稽古の締切を ICS にする
+    
+    締切の日の終日の予定とする
+    '''
+    rehearsals = Rehearsal.objects.filter(production__in=prod_ids)\
+        .exclude(prog='DONE!!!').select_related('production')\
+        .only('date', 'excerpt', 'prog', 'production__name')\
+        .order_by('date', 'id')
+    now = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//pscweb2//tasks//JA',
+        'CALSCALE:GREGORIAN',
+        'X-WR-CALNAME:TASK',
+    ]
+    for rehearsal in rehearsals.iterator():
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:rehearsal-{rehearsal.id}@{host}',
+            f'DTSTAMP:{now}',
+            'DTSTART;VALUE=DATE:' + rehearsal.date.strftime('%Y%m%d'),
+            'DTEND;VALUE=DATE:'
+                + (rehearsal.date + timedelta(days=1)).strftime('%Y%m%d'),
+            'SUMMARY:' + escape_text(
+                f'[{rehearsal.production.name}] {rehearsal.excerpt}'),
+            'DESCRIPTION:' + escape_text(rehearsal.prog.strip() or 'TODO'),
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return ''.join(fold_line(line) + '\r\n' for line in lines)
+
+
+def escape_text(value):
+    '''iCalendar の TEXT の値をエスケープする
+    '''
+    return value.replace('\\', '\\\\').replace(';', '\\;')\
+        .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold_line(line, limit=75):
+    '''iCalendar の行を 75 オクテットごとに折り返す
+    
+    マルチバイト文字の途中では折り返さない
+    '''
+    if len(line.encode()) <= limit:
+        return line
+    parts = []
+    current = ''
+    for char in line:
+        if len((current + char).encode()) > limit:
+            parts.append(current)
+            # 続きの行は空白 1 つで始める (その分も 75 オクテットに含む)
+            current = ' '
+        current += char
+    parts.append(current)
+    return '\r\n'.join(parts)
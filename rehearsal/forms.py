@@ -8,7 +8,7 @@ class RhslForm(forms.ModelForm):
     '''
     class Meta:
         model = Rehearsal
-        fields = ('date', 'note','member','prog')
+        fields = ('date', 'note', 'assignee', 'prog')
         widgets = {
             'date': AdminDateWidget(),
         }
@@ -19,12 +19,81 @@ class RhslForm(forms.ModelForm):
         
         super().__init__(*args, **kwargs)
         
-        # 稽古場は、同じ公演の稽古場のみ選択可能
-        #facilities = Facility.objects.filter(production=production)
-        # その施設を含む稽古場
-        #places = Place.objects.filter(facility__in=facilities)
-        #self.fields['place'].queryset = places
+        # 担当は、同じ公演のメンバーのみ選択可能
+        # 表示名にユーザ名を使うので、1 回のクエリで一緒に取得する
+        self.fields['assignee'].queryset = production_members(production)
+
+
+def production_members(production):
+    '''公演のメンバー (担当の選択肢)
+    '''
+    return ProdUser.objects.filter(production=production)\
+        .select_related('user').order_by('id')
+
+
+class RhslFilterForm(forms.Form):
+    '''稽古一覧の絞り込み・並べ替えフォーム (GET)
+    '''
+    SORTS = (
+        ('date', '締切が早い順'),
+        ('-date', '締切が遅い順'),
+    )
     
-   
+    assignee = forms.ModelChoiceField(label='STAFF', required=False,
+        queryset=ProdUser.objects.none())
+    prog = forms.ChoiceField(label='PROGRESS', required=False,
+        choices=[('', '---------')] + sorted(Rehearsal.CHOICES))
+    date_from = forms.DateField(label='FROM', required=False)
+    date_to = forms.DateField(label='TO', required=False)
+    sort = forms.ChoiceField(label='SORT', required=False, choices=SORTS)
+    
+    def __init__(self, *args, **kwargs):
+        # view で追加したパラメタを抜き取る
+        production = kwargs.pop('production')
+        
+        super().__init__(*args, **kwargs)
+        
+        # 担当は、同じ公演のメンバーのみ選択可能
+        self.fields['assignee'].queryset = production_members(production)
+    
+    def filter(self, queryset):
+        '''入力された条件で queryset を絞り込む
+        
+        不正な値が入力された条件は無視する
+        '''
+        self.is_valid()
+        data = self.cleaned_data
+        
+        if data.get('assignee'):
+            queryset = queryset.filter(assignee=data['assignee'])
+        if data.get('prog'):
+            queryset = queryset.filter(prog=data['prog'])
+        if data.get('date_from'):
+            queryset = queryset.filter(date__gte=data['date_from'])
+        if data.get('date_to'):
+            queryset = queryset.filter(date__lte=data['date_to'])
+        return queryset
+    
+    def ordering(self):
+        '''並べ替えの列のリスト
+        
+        同じ締切の中でも順序が変わらないよう、最後に id を加える
+        '''
+        sort = self.cleaned_data.get('sort') or 'date'
+        if sort.startswith('-'):
+            return [sort, '-id']
+        return [sort, 'id']
+
 
-  
\ No newline at end of file
+class RhslUploadForm(forms.Form):
+    '''稽古の一括取り込みのフォーム
+    '''
+    FORMATS = (
+        ('', '拡張子から判断'),
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    )
+    
+    file = forms.FileField(label='FILE')
+    format = forms.ChoiceField(label='FORMAT', required=False,
+        choices=FORMATS)
@@ -0,0 +1,60 @@
+'''稽古の頻出クエリ
+'''
+from django.db.models import Count, Max
+from production.hot_queries import hot_query
+from production.models import Production, ProdUser
+from production.view_func import production_stamps
+from .models import Rehearsal, RehearsalBigram
+
+
+@hot_query('rhsl_list')
+def rhsl_list(prod_user):
+    '''公演の稽古一覧
+    '''
+    return Rehearsal.objects.filter(
+        production_id=prod_user.production_id).order_by('date')
+
+
+@hot_query('rhsl_open')
+def rhsl_open(prod_user):
+    '''公演の終わっていない稽古
+    '''
+    return Rehearsal.objects.filter(production_id=prod_user.production_id)\
+        .exclude(prog='DONE!!!').order_by('date')
+
+
+@hot_query('assignee_tasks')
+def assignee_tasks(prod_user):
+    '''担当の稽古
+    '''
+    return Rehearsal.objects.filter(assignee_id=prod_user.id).order_by('date')
+
+
+@hot_query('my_tasks')
+def my_tasks(prod_user):
+    '''ユーザの全ての公演の終わっていない稽古
+    '''
+    productions = ProdUser.objects.filter(user_id=prod_user.user_id,
+        production__deletion_requested_at__isnull=True)\
+        .values('production_id')
+    return Rehearsal.objects.filter(production__in=productions)\
+        .exclude(prog='DONE!!!').order_by('date', 'id')[:51]
+
+
+@hot_query('rhsl_list_validator')
+def rhsl_list_validator(prod_user):
+    '''稽古一覧の検証子 (稽古の更新日時の最大値と件数)
+    '''
+    return Production.objects.filter(id=prod_user.production_id)\
+        .annotate(**production_stamps(Rehearsal.objects.all(),
+            rehearsal_updated=Max('updated_at'),
+            rehearsal_count=Count('id')))\
+        .values_list('updated_at', 'rehearsal_updated', 'rehearsal_count')
+
+
+@hot_query('bigrams_by_production')
+def bigrams_by_production(prod_user):
+    '''公演の bigram (公演の削除, インデックスの無い稽古の検索)
+    '''
+    return RehearsalBigram.objects.filter(
+        production_id=prod_user.production_id).values('rehearsal_id')
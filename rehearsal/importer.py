@@ -0,0 +1,296 @@
+'''稽古の一括取り込み
+
+CSV (1 行目は見出し) または JSON Lines のファイルを 1 行ずつ読み、
+RhslForm と同じ規則で検証して、batch_size 件ずつまとめて INSERT する。
+PostgreSQL では COPY を使う。
+
+列は date, note, assignee, prog。assignee は公演のメンバーのユーザ名で、
+prog が空なら ' ' (未着手) になる。
+'''
+import codecs
+import csv
+import io
+import json
+import time
+from django import forms
+from django.db import connection, transaction
+from .forms import RhslForm, production_members
+from .models import Rehearsal
+from production import page_cache
+from . import feeds, search
+
+
+# 取り込める形式
+FORMATS = ('csv', 'jsonl')
+
+# 報告する行ごとのエラーの最大数 (件数は全て数える)
+MAX_ERRORS = 100
+
+# UTF-8 として読めないファイルのエラー
+DECODE_ERROR = '文字コードを読めません。UTF-8 で保存してください。'
+
+
+def guess_format(filename):
+    '''ファイル名の拡張子から形式を推測する
+    '''
+    if filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_rows(file, format='csv'):
+    '''バイナリのファイルから 1 行ずつ dict を読む
+    
+    ファイル全体をメモリに読み込まない。
+    
+    Yields
+    ------
+    (line, row) : (int, dict or str)
+        行の始まりの行番号 (1 始まり) と、その行の値。
+        読めない行は row がエラーメッセージになる。
+        UTF-8 として読めなくなったら、そこで終わる
+    '''
+    text = codecs.getreader('utf-8-sig')(file)
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        # 見出しを読んでおく
+        try:
+            reader.fieldnames
+        except UnicodeDecodeError:
+            yield 1, DECODE_ERROR
+            return
+        except csv.Error as e:
+            yield 1, f'CSV として読めません ({e})。'
+            return
+        while True:
+            # 値に改行を含む行もあるので、読む前の行番号から数える
+            line = reader.line_num + 1
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                yield line, DECODE_ERROR
+                return
+            except csv.Error as e:
+                yield line, f'CSV として読めません ({e})。'
+                continue
+            yield line, row
+    else:
+        lines = enumerate(text, start=1)
+        line = 1
+        while True:
+            try:
+                line, data = next(lines)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                yield line, DECODE_ERROR
+                return
+            if data.strip():
+                yield line, json_row(data)
+
+
+def json_row(data):
+    '''JSON Lines の 1 行を、値が文字列 (または None) の dict にする
+    
+    数値や真偽値は文字列にする。読めなければエラーメッセージを返す
+    '''
+    try:
+        row = json.loads(data)
+    except ValueError:
+        row = None
+    if not isinstance(row, dict):
+        return '行を読めません。'
+    
+    for key, value in row.items():
+        if isinstance(value, (bool, int, float)):
+            row[key] = str(value)
+        elif value is not None and not isinstance(value, str):
+            return f'{key}: 値を読めません。'
+    return row
+
+
+class MemberChoiceField(forms.ModelChoiceField):
+    '''ユーザ名で公演のメンバーを選ぶフィールド
+    
+    行ごとに検索しないよう、ユーザ名からメンバーを引く dict を使う
+    '''
+    members = {}
+    
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.members[str(value)]
+        except KeyError:
+            raise forms.ValidationError(
+                f'{value} はこの公演のメンバーではありません。')
+
+
+class RhslImportForm(RhslForm):
+    '''取り込む 1 行分のフォーム
+    
+    RhslForm と同じ規則で検証する。担当はユーザ名で指定する
+    '''
+    assignee = MemberChoiceField(label='STAFF', required=False,
+        queryset=None)
+    
+    def __init__(self, *args, **kwargs):
+        # 取り込み全体で 1 回だけ作った {ユーザ名: ProdUser}
+        members = kwargs.pop('members')
+        
+        # 担当の選択肢の QuerySet は使わないので、RhslForm.__init__ は通さない
+        forms.ModelForm.__init__(self, *args, **kwargs)
+        
+        self.fields['assignee'].members = members
+    
+    def _get_validation_exclusions(self):
+        '''モデルの検証から除くフィールド
+        
+        担当はメンバーの dict で検証済みなので、ForeignKey の
+        存在確認のクエリを行ごとに発行しない
+        '''
+        exclude = super()._get_validation_exclusions()
+        exclude.append('assignee')
+        return exclude
+
+
+class ImportResult:
+    '''取り込みの結果
+    
+    Attributes
+    ----------
+    created : int
+        追加した稽古の数
+    error_count : int
+        検証に失敗した行の数
+    errors : list of (int, str)
+        行番号とエラーメッセージ (先頭の MAX_ERRORS 行分)
+    seconds : float
+        かかった秒数
+    '''
+    def __init__(self):
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+        self.seconds = 0.0
+    
+    @property
+    def rows_per_second(self):
+        '''1 秒あたりに追加した行数
+        '''
+        return self.created / self.seconds if self.seconds else 0.0
+    
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+
+def import_rehearsals(production, rows, batch_size=1000, use_copy=None):
+    '''稽古を検証して batch_size 件ずつ追加する
+    
+    全体を 1 つのトランザクションで行う。検証に失敗した行は追加せず、
+    結果に行番号とエラーを記録する
+    
+    Parameters
+    ----------
+    rows : iterable of (int, dict)
+        read_rows() の結果
+    use_copy : bool
+        COPY で追加するか。None なら PostgreSQL の時だけ使う
+    
+    Returns
+    -------
+    result : ImportResult
+    '''
+    if use_copy is None:
+        use_copy = connection.vendor == 'postgresql'
+    insert = copy_rehearsals if use_copy else bulk_create_rehearsals
+    
+    # 担当の検証のため、メンバーを 1 回だけ取得しておく
+    members = {prod_user.user.username: prod_user
+        for prod_user in production_members(production)}
+    
+    result = ImportResult()
+    start = time.perf_counter()
+    with transaction.atomic():
+        batch = []
+        for line, row in rows:
+            if isinstance(row, str):
+                result.add_error(line, row)
+                continue
+            
+            data = {key: row.get(key) for key in RhslForm.Meta.fields}
+            if not data['prog']:
+                data['prog'] = ' '
+            form = RhslImportForm(data, members=members)
+            if not form.is_valid():
+                result.add_error(line, ' '.join(
+                    f'{field}: {message}'
+                    for field, messages in form.errors.items()
+                    for message in messages))
+                continue
+            
+            rehearsal = form.save(commit=False)
+            rehearsal.production = production
+            # bulk_create と COPY は save() を呼ばないので、ここで作る
+            rehearsal.update_note_fields()
+            batch.append(rehearsal)
+            
+            if len(batch) >= batch_size:
+                result.created += insert(batch)
+                batch = []
+        if batch:
+            result.created += insert(batch)
+        
+        # bulk_create と COPY はシグナルを送らないので、ここで無効化する
+        if result.created:
+            feeds.invalidate(production.id)
+            page_cache.bump(production.id)
+            search.get_backend().index_missing(production.id,
+                batch_size=batch_size)
+    result.seconds = time.perf_counter() - start
+    
+    return result
+
+
+def bulk_create_rehearsals(rehearsals):
+    '''bulk_create で追加する
+    '''
+    Rehearsal.objects.bulk_create(rehearsals)
+    return len(rehearsals)
+
+
+def copy_rehearsals(rehearsals):
+    '''PostgreSQL の COPY で追加する
+    
+    テキスト形式のデータを作り、1 回の COPY FROM STDIN で送る
+    '''
+    fields = [field for field in Rehearsal._meta.concrete_fields
+        if not field.primary_key]
+    buffer = io.StringIO()
+    for rehearsal in rehearsals:
+        # pre_save() で updated_at (auto_now) に現在時刻を入れる
+        buffer.write('\t'.join(copy_text(field.get_db_prep_save(
+            field.pre_save(rehearsal, True), connection))
+            for field in fields))
+        buffer.write('\n')
+    buffer.seek(0)
+    
+    table = connection.ops.quote_name(Rehearsal._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column)
+        for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN', buffer)
+    return len(rehearsals)
+
+
+def copy_text(value):
+    '''COPY のテキスト形式の 1 つの値
+    '''
+    if value is None:
+        return r'\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t')\
+        .replace('\n', '\\n').replace('\r', '\\r')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from production.models import Production
+from rehearsal.importer import FORMATS, guess_format, read_rows,\
+    import_rehearsals
+
+
+class Command(BaseCommand):
+    help = 'CSV または JSON Lines のファイルから稽古をまとめて追加する'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('prod_id', type=int, help='追加先の公演の id')
+        parser.add_argument('path', help='取り込むファイル')
+        parser.add_argument('--format', choices=FORMATS,
+            help='ファイルの形式 (省略すると拡張子から判断)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='1 回の INSERT で追加する行数')
+        parser.add_argument('--no-copy', action='store_true',
+            help='PostgreSQL でも COPY を使わず bulk_create で追加する')
+    
+    def handle(self, *args, **options):
+        production = Production.objects.filter(id=options['prod_id'],
+            deletion_requested_at__isnull=True).first()
+        if production is None:
+            raise CommandError(f'公演 {options["prod_id"]} はありません')
+        
+        format = options['format'] or guess_format(options['path'])
+        with open(options['path'], 'rb') as file:
+            result = import_rehearsals(production, read_rows(file, format),
+                batch_size=options['batch_size'],
+                use_copy=False if options['no_copy'] else None)
+        
+        for line, message in result.errors:
+            self.stderr.write(f'{line}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.created} 件追加しました (エラー {result.error_count} 行, '
+            f'{result.rows_per_second:.0f} 行/秒)'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from rehearsal.models import Rehearsal
+from rehearsal.notes import rebuild_note_html, NOTE_HTML_VERSION
+
+
+class Command(BaseCommand):
+    help = '稽古のメモの HTML を、現在の規則で作り直す'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='1 回に更新する行数')
+        parser.add_argument('--all', action='store_true',
+            help='現在の規則で作られた HTML も作り直す')
+    
+    def handle(self, *args, **options):
+        count = rebuild_note_html(Rehearsal,
+            batch_size=options['batch_size'], rebuild_all=options['all'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{count} 件の HTML を作り直しました (version {NOTE_HTML_VERSION})'))
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.7 on 2026-10-17 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0021_alter_rehearsal_prog'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rehearsal',
+            index=models.Index(fields=['production', 'date'], name='rehearsal_production_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rehearsal',
+            index=models.Index(condition=models.Q(('prog', 'DONE!!!'), _negated=True), fields=['production', 'date'], name='rehearsal_open_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-17 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0022_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rehearsal',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=50, verbose_name='TASK'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:20
+
+from django.db import migrations
+
+
+# 1 回に更新する行数
+BATCH_SIZE = 1000
+
+# 抜粋の最大文字数 (0023 の excerpt の max_length)
+EXCERPT_LENGTH = 50
+
+
+def make_excerpt(note):
+    '''メモの 1 行目を、一覧に表示する長さに切り詰める
+
+    この時点の rehearsal.notes.make_excerpt の写し。
+    後でアプリの関数が変わっても、このマイグレーションの結果は変えない
+    '''
+    lines = note.strip().splitlines()
+    first_line = lines[0].strip() if lines else ''
+    if len(first_line) > EXCERPT_LENGTH or len(lines) > 1:
+        return first_line[:EXCERPT_LENGTH - 1] + '…'
+    return first_line
+
+
+def backfill_excerpt(apps, schema_editor):
+    '''既存の稽古の抜粋を、id 順に BATCH_SIZE 件ずつ作る
+    '''
+    Rehearsal = apps.get_model('rehearsal', 'Rehearsal')
+    last_id = 0
+    while True:
+        batch = list(Rehearsal.objects.filter(id__gt=last_id)
+            .only('id', 'note').order_by('id')[:BATCH_SIZE])
+        if not batch:
+            break
+        for rehearsal in batch:
+            rehearsal.excerpt = make_excerpt(rehearsal.note)
+        Rehearsal.objects.bulk_update(batch, ['excerpt'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0023_rehearsal_excerpt'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_excerpt, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0024_backfill_rehearsal_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rehearsal',
+            name='note_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='rehearsal',
+            name='note_html_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
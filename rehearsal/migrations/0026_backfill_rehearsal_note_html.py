@@ -0,0 +1,52 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:40
+
+from django.db import migrations
+from django.utils.html import urlize
+from django.utils.text import normalize_newlines
+
+
+# 1 回に更新する行数
+BATCH_SIZE = 1000
+
+# この時点の HTML の規則のバージョン (rehearsal.notes.NOTE_HTML_VERSION)
+NOTE_HTML_VERSION = 1
+
+
+def render_note_html(note):
+    '''メモを表示用の HTML にする
+
+    この時点の rehearsal.notes.render_note_html の写し。
+    規則が変わった時は、バージョンを上げて rebuild_note_html で作り直す
+    '''
+    html = urlize(note, nofollow=True, autoescape=True)
+    return normalize_newlines(html).replace('\n', '<br>')
+
+
+def backfill_note_html(apps, schema_editor):
+    '''既存の稽古のメモを、id 順に BATCH_SIZE 件ずつ HTML にする
+    '''
+    Rehearsal = apps.get_model('rehearsal', 'Rehearsal')
+    rehearsals = Rehearsal.objects.only('id', 'note')\
+        .exclude(note_html_version=NOTE_HTML_VERSION).order_by('id')
+    last_id = 0
+    while True:
+        batch = list(rehearsals.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        for rehearsal in batch:
+            rehearsal.note_html = render_note_html(rehearsal.note)
+            rehearsal.note_html_version = NOTE_HTML_VERSION
+        Rehearsal.objects.bulk_update(batch,
+            ['note_html', 'note_html_version'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0025_rehearsal_note_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_note_html, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.7 on 2026-10-17 03:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0011_indexes'),
+        ('rehearsal', '0026_backfill_rehearsal_note_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rehearsal',
+            name='assignee',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='assigned_rehearsals', to='production.produser', verbose_name='STAFF'),
+        ),
+        migrations.AddIndex(
+            model_name='rehearsal',
+            index=models.Index(fields=['assignee', 'date'], name='rehearsal_assignee_date_idx'),
+        ),
+    ]
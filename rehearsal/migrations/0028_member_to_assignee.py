@@ -0,0 +1,95 @@
+# Generated by Django 3.2.7 on 2026-10-17 03:02
+
+from django.db import migrations, models
+
+
+# 1 回に更新する行数
+BATCH_SIZE = 1000
+
+
+def member_names(ProdUser, production_id):
+    '''公演のメンバーの表示名から ProdUser の id を引く辞書のリスト
+
+    ユーザ名, ProdUser.__str__ と同じ形式のフルネーム, 姓, 名の順に、
+    {表示名: ProdUser の id の集合} を返す
+    '''
+    names = [{}, {}, {}, {}]
+    rows = ProdUser.objects.filter(production_id=production_id).order_by('id')\
+        .values_list('id', 'user__username', 'user__last_name',
+            'user__first_name')
+    for pk, username, last_name, first_name in rows:
+        full_name = ', '.join(name for name in (last_name, first_name) if name)
+        for by_name, name in zip(names,
+            (username, full_name, last_name, first_name)):
+            if name:
+                by_name.setdefault(name, set()).add(pk)
+    return names
+
+
+def match_member(names, member):
+    '''担当の文字列に対応する ProdUser の id (なければ None)
+
+    member_names() の辞書を順に引き、最初に見つかった辞書で
+    1 人に決まらなければ (同姓の 2 人など) 対応づけない
+    '''
+    for by_name in names:
+        pks = by_name.get(member)
+        if pks:
+            return next(iter(pks)) if len(pks) == 1 else None
+    return None
+
+
+def member_to_assignee(apps, schema_editor):
+    '''担当の文字列を、同じ公演のメンバーに対応づける
+
+    対応するメンバーがいないか 1 人に決まらない文字列は、
+    失われないよう legacy_member に残す
+    '''
+    Rehearsal = apps.get_model('rehearsal', 'Rehearsal')
+    ProdUser = apps.get_model('production', 'ProdUser')
+    rehearsals = Rehearsal.objects.exclude(member='')\
+        .only('id', 'production_id', 'member')
+
+    names_by_production = {}
+    last_id = 0
+    while True:
+        batch = list(rehearsals.filter(id__gt=last_id).order_by('id')
+            [:BATCH_SIZE])
+        if not batch:
+            break
+        for rehearsal in batch:
+            prod_id = rehearsal.production_id
+            if prod_id not in names_by_production:
+                names_by_production[prod_id] = member_names(ProdUser, prod_id)
+
+            member = rehearsal.member.strip()
+            rehearsal.assignee_id = match_member(
+                names_by_production[prod_id], member)
+            if rehearsal.assignee_id is None:
+                rehearsal.legacy_member = member
+        Rehearsal.objects.bulk_update(batch, ['assignee', 'legacy_member'])
+        last_id = batch[-1].id
+
+
+def legacy_to_member(apps, schema_editor):
+    '''戻す時は、対応づけられなかった文字列を担当の文字列に戻す
+    '''
+    Rehearsal = apps.get_model('rehearsal', 'Rehearsal')
+    Rehearsal.objects.exclude(legacy_member='')\
+        .update(member=models.F('legacy_member'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0027_rehearsal_assignee'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rehearsal',
+            name='legacy_member',
+            field=models.CharField(blank=True, editable=False, max_length=15, verbose_name='STAFF (旧)'),
+        ),
+        migrations.RunPython(member_to_assignee, legacy_to_member),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-17 03:03
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0028_member_to_assignee'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='rehearsal',
+            name='member',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0029_remove_rehearsal_member'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rehearsal',
+            index=models.Index(condition=models.Q(('prog', 'DONE!!!'), _negated=True), fields=['date', 'id'], name='rehearsal_open_deadline_idx'),
+        ),
+    ]
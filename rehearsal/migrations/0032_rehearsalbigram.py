@@ -0,0 +1,28 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0016_production_deletion_requested_at'),
+        ('rehearsal', '0031_calendartoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RehearsalBigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=2)),
+                ('production', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='production.production')),
+                ('rehearsal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rehearsal.rehearsal')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='rehearsalbigram',
+            index=models.Index(fields=['gram', 'production', 'rehearsal'], name='rehearsalbigram_gram_idx'),
+        ),
+    ]
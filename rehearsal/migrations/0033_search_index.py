@@ -0,0 +1,72 @@
+# Generated by Django 3.2.7 on 2026-10-17 05:20
+
+import unicodedata
+from django.db import migrations
+
+
+# メモの全文検索のインデックス (rehearsal/search.py)
+#
+# PostgreSQL では pg_trgm の GIN インデックスを、icontains が使う
+# UPPER("note") の式に張る。それ以外では、既存の稽古の bigram を作る。
+INDEX_NAME = 'rehearsal_note_trgm_idx'
+
+# 1 回に処理する稽古の数
+BATCH_SIZE = 1000
+
+
+def bigrams(text):
+    '''text に含まれる bigram の集合 (rehearsal.search.bigrams の写し)
+
+    全角・半角と大文字・小文字を揃え、空白で区切った語ごとに
+    2 文字ずつの組と、語の末尾の 1 文字を作る
+    '''
+    grams = set()
+    for word in unicodedata.normalize('NFKC', text).lower().split():
+        grams.update(word[i:i + 2] for i in range(len(word)))
+    return grams
+
+
+def create_index(apps, schema_editor):
+    '''DB ごとの全文検索のインデックスを作る
+    '''
+    Rehearsal = apps.get_model('rehearsal', 'Rehearsal')
+    if schema_editor.connection.vendor == 'postgresql':
+        table = schema_editor.quote_name(Rehearsal._meta.db_table)
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} '
+            f'ON {table} USING gin ((UPPER("note")) gin_trgm_ops)')
+        return
+
+    RehearsalBigram = apps.get_model('rehearsal', 'RehearsalBigram')
+    rehearsals = Rehearsal.objects.only('id', 'production_id', 'note')\
+        .order_by('id')
+    last_id = 0
+    while True:
+        batch = list(rehearsals.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        RehearsalBigram.objects.bulk_create([RehearsalBigram(gram=gram,
+            production_id=rehearsal.production_id, rehearsal_id=rehearsal.id)
+            for rehearsal in batch for gram in bigrams(rehearsal.note)],
+            batch_size=BATCH_SIZE)
+        last_id = batch[-1].id
+
+
+def drop_index(apps, schema_editor):
+    '''インデックスを削除する
+    '''
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+        return
+    apps.get_model('rehearsal', 'RehearsalBigram').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0032_rehearsalbigram'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
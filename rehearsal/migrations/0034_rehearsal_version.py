@@ -0,0 +1,23 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0033_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rehearsal',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='rehearsal',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
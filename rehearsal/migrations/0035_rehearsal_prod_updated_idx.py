@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0034_rehearsal_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rehearsal',
+            index=models.Index(fields=['production', 'updated_at'], name='rehearsal_prod_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0035_rehearsal_prod_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rehearsalbigram',
+            index=models.Index(fields=['production', 'rehearsal'], name='rehearsalbigram_prod_idx'),
+        ),
+    ]
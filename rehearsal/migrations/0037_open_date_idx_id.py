@@ -0,0 +1,25 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0036_rehearsalbigram_prod_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='rehearsal',
+            name='rehearsal_open_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='rehearsal',
+            name='rehearsal_open_deadline_idx',
+        ),
+        migrations.AddIndex(
+            model_name='rehearsal',
+            index=models.Index(condition=models.Q(('prog', 'DONE!!!'), _negated=True), fields=['production', 'date', 'id'], name='rehearsal_open_date_idx'),
+        ),
+    ]
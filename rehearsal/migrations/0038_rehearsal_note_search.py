@@ -0,0 +1,78 @@
+# Generated by Django 3.2.7 on 2026-10-17 02:58
+
+import unicodedata
+from django.db import migrations, models
+
+
+# 全文検索は、全角・半角と大文字・小文字を揃えた note_search で行う
+#
+# 既存の稽古の note_search を埋め、PostgreSQL では pg_trgm の GIN
+# インデックスを UPPER("note") から note_search に張り替える。
+OLD_INDEX_NAME = 'rehearsal_note_trgm_idx'
+INDEX_NAME = 'rehearsal_note_search_trgm_idx'
+
+# 1 回に処理する稽古の数
+BATCH_SIZE = 1000
+
+
+def normalize(text):
+    '''全角・半角と大文字・小文字を揃える (rehearsal.notes.normalize の写し)
+    '''
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def backfill_note_search(apps, schema_editor):
+    '''既存の稽古の note_search を作る
+    '''
+    Rehearsal = apps.get_model('rehearsal', 'Rehearsal')
+    rehearsals = Rehearsal.objects.only('id', 'note').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(rehearsals.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        for rehearsal in batch:
+            rehearsal.note_search = normalize(rehearsal.note)
+        Rehearsal.objects.bulk_update(batch, ['note_search'])
+        last_id = batch[-1].id
+
+
+def create_index(apps, schema_editor):
+    '''PostgreSQL では、GIN インデックスを note_search に張り替える
+    '''
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(
+        apps.get_model('rehearsal', 'Rehearsal')._meta.db_table)
+    schema_editor.execute(f'DROP INDEX IF EXISTS {OLD_INDEX_NAME}')
+    schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} '
+        f'ON {table} USING gin ("note_search" gin_trgm_ops)')
+
+
+def drop_index(apps, schema_editor):
+    '''GIN インデックスを UPPER("note") に戻す
+    '''
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(
+        apps.get_model('rehearsal', 'Rehearsal')._meta.db_table)
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+    schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {OLD_INDEX_NAME} '
+        f'ON {table} USING gin ((UPPER("note")) gin_trgm_ops)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0037_open_date_idx_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rehearsal',
+            name='note_search',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(backfill_note_search, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,8 +1,13 @@
+import secrets
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from production.models import Production, ProdUser
+from .notes import make_excerpt, EXCERPT_LENGTH, render_note_html,\
+    NOTE_HTML_VERSION, normalize
 
 
 
@@ -15,16 +20,107 @@ class Rehearsal(models.Model):
         on_delete=models.CASCADE)
     date = models.DateField('DEADLINE')
     note = models.TextField('TASK', blank=True)
-    member = models.CharField('STAFF', blank=True,max_length=15)
+    # 一覧で note 全体を読まずに済むよう、保存時に抜粋を作っておく
+    excerpt = models.CharField('TASK', blank=True, editable=False,
+        max_length=EXCERPT_LENGTH)
+    # 詳細で毎回 urlize しなくて済むよう、保存時に HTML にしておく
+    note_html = models.TextField(blank=True, editable=False)
+    note_html_version = models.PositiveSmallIntegerField(default=0,
+        editable=False)
+    # 全角・半角と大文字・小文字によらず検索できるよう、揃えたメモ
+    note_search = models.TextField(blank=True, editable=False)
+    # 担当ごとの稽古は (assignee, date) のインデックスで探す
+    assignee = models.ForeignKey(ProdUser, verbose_name='STAFF',
+        null=True, blank=True, on_delete=models.SET_NULL, db_index=False,
+        related_name='assigned_rehearsals')
+    # 担当が文字列だった頃の担当のうち、メンバーに対応づけられなかったもの
+    # (マイグレーション 0028)
+    legacy_member = models.CharField('STAFF (旧)', blank=True, editable=False,
+        max_length=15)
     
     CHOICES={
         (' ', ' '),
         ('Started', 'Started'),
         ('DONE!!!', 'DONE!!!'),
     }
-
+    
     prog = models.CharField(max_length=10, choices=CHOICES, default='0')
     
+    # 一覧の行の HTML をキャッシュするキーと、ページの Last-Modified に使う
+    # (保存するたびに変わる)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    
+    class Meta:
+        indexes = [
+            # 公演の稽古を締切順に並べるため
+            models.Index(fields=['production', 'date'],
+                name='rehearsal_production_date_idx'),
+            # 担当の稽古を締切順に並べるため
+            models.Index(fields=['assignee', 'date'],
+                name='rehearsal_assignee_date_idx'),
+            # 終わっていない稽古だけを締切順に並べるため
+            # 全ての公演の稽古 (My tasks) も、公演ごとにこの範囲を読む
+            models.Index(fields=['production', 'date', 'id'],
+                condition=~Q(prog='DONE!!!'),
+                name='rehearsal_open_date_idx'),
+            # 公演の稽古の最終更新日時を求めるため (ページの検証子)
+            models.Index(fields=['production', 'updated_at'],
+                name='rehearsal_prod_updated_idx'),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        '''読み込んだ時の note を覚えておく
+        '''
+        instance = super().from_db(db, field_names, values)
+        if 'note' in field_names:
+            instance._loaded_note = instance.note
+        return instance
+    
+    def save(self, *args, **kwargs):
+        '''保存時に note の抜粋と HTML, 検索用の値を更新し、版数を上げる
+        
+        note が読み込んだ時から変わっていなければ、作り直さない。
+        bulk_create() などではこれが呼ばれないので、
+        update_note_fields() を呼んでおくこと
+        '''
+        note_fields = ['excerpt', 'note_html', 'note_html_version',
+            'note_search']
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # 一部の列だけを保存する時も、版数と更新日時は一緒に保存する
+            update_fields = set(update_fields) | {'version', 'updated_at'}
+            # note だけを保存する時も抜粋と HTML を一緒に保存する
+            if self.update_note_fields():
+                update_fields |= set(note_fields)
+            kwargs['update_fields'] = update_fields
+        else:
+            self.update_note_fields()
+        if self.pk is not None:
+            self.version += 1
+        
+        super().save(*args, **kwargs)
+        self._loaded_note = self.note
+    
+    def update_note_fields(self):
+        '''note が変わっていたら、抜粋と HTML, 検索用の値を作り直す
+        
+        Returns
+        -------
+        updated : bool
+            作り直したかどうか
+        '''
+        unchanged = getattr(self, '_loaded_note', None) == self.note\
+            and self.note_html_version == NOTE_HTML_VERSION
+        if unchanged:
+            return False
+        self.excerpt = make_excerpt(self.note)
+        self.note_html = render_note_html(self.note)
+        self.note_html_version = NOTE_HTML_VERSION
+        self.note_search = normalize(self.note)
+        return True
+    
     
     
     #def __str__(self):
@@ -32,12 +128,44 @@ class Rehearsal(models.Model):
         #return '{},{}'.format(self.date.strftime('%m/%d'), self.place)
 
 
+class CalendarToken(models.Model):
+    '''カレンダーアプリが締切を購読する URL に使うトークン
+    
+    ログインできないカレンダーアプリの代わりに、URL のトークンでユーザを
+    識別する。作り直すと、前の URL は使えなくなる
+    '''
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+        verbose_name='STAFF', on_delete=models.CASCADE,
+        related_name='calendar_token')
+    token = models.CharField(max_length=43, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    @classmethod
+    def issue(cls, user):
+        '''ユーザのトークンを (作り直して) 発行する
+        '''
+        cls.objects.filter(user=user).delete()
+        return cls.objects.create(user=user, token=secrets.token_urlsafe(32))
 
 
-
-
-
-
-     
-
-
+class RehearsalBigram(models.Model):
+    '''稽古のメモの bigram 転置インデックス (search.py の BigramBackend)
+    
+    メモに含まれる 2 文字ずつの組 (末尾の 1 文字は 1 文字のまま) を、
+    稽古ごとに重複なく持つ。公演で絞り込めるよう、公演も持つ
+    '''
+    gram = models.CharField(max_length=2)
+    production = models.ForeignKey(Production, on_delete=models.CASCADE,
+        db_index=False)
+    rehearsal = models.ForeignKey(Rehearsal, on_delete=models.CASCADE)
+    
+    class Meta:
+        indexes = [
+            # gram を含む、ユーザの公演の稽古を探すため
+            models.Index(fields=['gram', 'production', 'rehearsal'],
+                name='rehearsalbigram_gram_idx'),
+            # 公演ごとの削除 (production/deletion.py) と、
+            # インデックスの無い稽古の検索 (index_missing) のため
+            models.Index(fields=['production', 'rehearsal'],
+                name='rehearsalbigram_prod_idx'),
+        ]
@@ -0,0 +1,75 @@
+'''稽古のメモ (note) から表示用の値を作る関数
+'''
+import unicodedata
+from django.utils.html import urlize
+from django.utils.text import normalize_newlines
+
+# 一覧に表示する抜粋の最大文字数
+EXCERPT_LENGTH = 50
+
+
+def make_excerpt(note):
+    '''メモの 1 行目を、一覧に表示する長さに切り詰める
+    '''
+    lines = note.strip().splitlines()
+    first_line = lines[0].strip() if lines else ''
+    if len(first_line) > EXCERPT_LENGTH or len(lines) > 1:
+        return first_line[:EXCERPT_LENGTH - 1] + '…'
+    return first_line
+
+
+def normalize(text):
+    '''全角・半角と大文字・小文字を揃える
+    
+    全文検索 (search.py) で、メモと検索語の両方に使う
+    '''
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+# メモを HTML にする規則のバージョン
+# render_note_html() を変えたら上げて、manage.py rebuild_note_html を実行する
+NOTE_HTML_VERSION = 1
+
+
+def render_note_html(note):
+    '''メモを表示用の HTML にする
+    
+    テンプレートの {{ note | urlize | linebreaksbr }} と同じ結果になる。
+    urlize がメモ全体をエスケープするので、そのまま表示してよい
+    '''
+    html = urlize(note, nofollow=True, autoescape=True)
+    return normalize_newlines(html).replace('\n', '<br>')
+
+
+def rebuild_note_html(model, batch_size=1000, rebuild_all=False):
+    '''保存されている HTML を、id 順に batch_size 件ずつ作り直す
+    
+    Parameters
+    ----------
+    model : Model
+        Rehearsal
+    rebuild_all : bool
+        False なら、古い規則で作られた HTML だけを作り直す
+    
+    Returns
+    -------
+    count : int
+        作り直した件数
+    '''
+    rehearsals = model.objects.only('id', 'note')
+    if not rebuild_all:
+        rehearsals = rehearsals.exclude(note_html_version=NOTE_HTML_VERSION)
+    
+    count = 0
+    last_id = 0
+    while True:
+        batch = list(rehearsals.filter(id__gt=last_id)
+            .order_by('id')[:batch_size])
+        if not batch:
+            return count
+        for rehearsal in batch:
+            rehearsal.note_html = render_note_html(rehearsal.note)
+            rehearsal.note_html_version = NOTE_HTML_VERSION
+        model.objects.bulk_update(batch, ['note_html', 'note_html_version'])
+        count += len(batch)
+        last_id = batch[-1].id
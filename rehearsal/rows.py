@@ -0,0 +1,66 @@
+'''稽古一覧の行の HTML のキャッシュ
+
+編集権のあるメンバーにはページ全体をキャッシュできない (page_cache.py) が、
+一覧の行のほとんどはリクエストごとに変わらない。そこで行ごとに描画した
+HTML を (稽古, 版数, 担当, 権限) のキーでキャッシュし、
+変わった行だけを描画し直す。
+
+稽古の版数は保存するたびに上がる (Rehearsal.save())。担当のユーザ名が
+変わった時はシグナルで版数を上げる (signals.py)。
+'''
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+
+# 使うキャッシュの alias と保存期間 (秒)
+CACHE_ALIAS = getattr(settings, 'ROW_CACHE_ALIAS', 'default')
+CACHE_TIMEOUT = getattr(settings, 'ROW_CACHE_TIMEOUT', 60 * 60)
+
+# 1 行分のテンプレート
+TEMPLATE_NAME = 'rehearsal/rehearsal_row.html'
+
+
+def row_key(rehearsal, editable):
+    '''行の HTML のキャッシュキー
+    
+    {% cache %} タグと同じ形式のキーにする
+    '''
+    return make_template_fragment_key('rhsl_row', [rehearsal.id,
+        rehearsal.version, rehearsal.updated_at.timestamp(),
+        rehearsal.assignee_id, editable])
+
+
+def render_rows(rehearsals, editable):
+    '''稽古一覧の行の HTML のリストを返す
+    
+    キャッシュは 1 回の get_many() で読み、無かった行だけを描画して
+    1 回の set_many() で保存する
+    
+    Parameters
+    ----------
+    rehearsals : list of Rehearsal
+    editable : bool
+        アクセス中のメンバーが編集権を持っているか
+    '''
+    cache = caches[CACHE_ALIAS]
+    keys = [row_key(rehearsal, editable) for rehearsal in rehearsals]
+    cached = cache.get_many(keys)
+    
+    template = None
+    rendered = {}
+    rows = []
+    for key, rehearsal in zip(keys, rehearsals):
+        html = cached.get(key)
+        if html is None:
+            if template is None:
+                template = get_template(TEMPLATE_NAME)
+            html = rendered[key] = template.render(
+                {'item': rehearsal, 'editable': editable})
+        rows.append(mark_safe(html))
+    
+    if rendered:
+        cache.set_many(rendered, CACHE_TIMEOUT)
+    return rows
@@ -0,0 +1,198 @@
+'''稽古のメモの全文検索
+
+日本語は単語に区切れないので、文字の n-gram で検索する。
+DB ごとにバックエンドを切り替える。
+
+- PostgreSQL: TrigramBackend。pg_trgm の GIN インデックス
+  (マイグレーション 0038 で note_search に作る) が、
+  LIKE '%...%' をそのまま速くする
+- それ以外: BigramBackend。RehearsalBigram の転置インデックスで
+  候補を絞ってから確かめる。稽古の保存時に差分だけ更新する
+
+メモと検索語は全角・半角と大文字・小文字を揃えてから比べる。
+メモを揃えたものは、保存時に Rehearsal.note_search に入れておく。
+
+settings.SEARCH_BACKEND にクラスのパスを書けば、それを使う。
+どちらのバックエンドでも、語が出てくる回数の多い順に並べる。
+'''
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Max, Q, Value, When
+from django.db.models.functions import Length, Replace
+from django.utils.module_loading import import_string
+from .models import Rehearsal, RehearsalBigram
+from .notes import normalize
+
+
+# 検索語の最大数 (bigram の数)
+MAX_GRAMS = 32
+
+
+def parse_query(query):
+    '''検索文字列を、空白で区切った語のリストにする (重複は除く)
+    '''
+    return list(dict.fromkeys(normalize(query).split()))
+
+
+def bigrams(text):
+    '''text に含まれる bigram の集合
+    
+    空白で区切った語ごとに 2 文字ずつの組を作る。
+    1 文字の語でも前方一致で探せるよう、語の末尾の 1 文字も加える
+    '''
+    grams = set()
+    for word in normalize(text).split():
+        grams.update(word[i:i + 2] for i in range(len(word)))
+    return grams
+
+
+def query_grams(term):
+    '''語を探すのに使う bigram
+    
+    2 文字以上なら 2 文字ずつの組、1 文字ならその文字 (前方一致で探す)
+    '''
+    if len(term) == 1:
+        return {term}
+    return {term[i:i + 2] for i in range(len(term) - 1)}
+
+
+class SearchBackend:
+    '''検索のバックエンドの Base class
+    '''
+    def candidates(self, queryset, terms, prod_ids):
+        '''queryset を、語を全て含みうる稽古に絞り込む
+        
+        絞り込みすぎなければよく、最後に note_search で確かめる
+        '''
+        return queryset
+    
+    def index(self, rehearsal):
+        '''稽古の保存時に、インデックスを更新する
+        '''
+    
+    def index_missing(self, production_id, batch_size=1000):
+        '''インデックスの無い稽古のインデックスを作る
+        
+        シグナルを送らない bulk_create() や COPY で追加した後に呼ぶ
+        '''
+        return 0
+
+
+class TrigramBackend(SearchBackend):
+    '''PostgreSQL の pg_trgm を使うバックエンド
+    
+    note_search LIKE '%語%' に GIN インデックスが使われるので、
+    候補の絞り込みもインデックスの更新も要らない。
+    (pg_trgm は 3 文字未満の語ではインデックスで絞り込めない)
+    '''
+
+
+class BigramBackend(SearchBackend):
+    '''RehearsalBigram の転置インデックスを使うバックエンド
+    '''
+    def candidates(self, queryset, terms, prod_ids):
+        '''語の bigram を全て含む稽古に絞り込む
+        '''
+        grams = set()
+        for term in terms:
+            grams |= query_grams(term)
+        grams = sorted(grams)[:MAX_GRAMS]
+        conditions = [Q(gram__startswith=gram) if len(gram) == 1
+            else Q(gram=gram) for gram in grams]
+        
+        # 稽古ごとに、bigram をそれぞれ含むか (1/0) を集計する
+        matched = {f'm{i}': Max(Case(When(condition, then=Value(1)),
+            default=Value(0), output_field=IntegerField()))
+            for i, condition in enumerate(conditions)}
+        rehearsal_ids = RehearsalBigram.objects\
+            .filter(reduce(or_, conditions), production_id__in=prod_ids)\
+            .values('rehearsal_id').annotate(**matched)\
+            .filter(**{name: 1 for name in matched})\
+            .values('rehearsal_id')
+        return queryset.filter(id__in=rehearsal_ids)
+    
+    def index(self, rehearsal):
+        '''稽古の bigram を、差分だけ追加・削除する
+        '''
+        grams = bigrams(rehearsal.note)
+        rows = RehearsalBigram.objects.filter(rehearsal_id=rehearsal.id)
+        existing = set(rows.values_list('gram', flat=True))
+        
+        removed = existing - grams
+        if removed:
+            rows.filter(gram__in=removed).delete()
+        RehearsalBigram.objects.bulk_create([RehearsalBigram(gram=gram,
+            production_id=rehearsal.production_id, rehearsal_id=rehearsal.id)
+            for gram in grams - existing])
+    
+    def index_missing(self, production_id, batch_size=1000):
+        '''インデックスの無い稽古のインデックスを batch_size 件ずつ作る
+        '''
+        rehearsals = Rehearsal.objects.filter(production_id=production_id)\
+            .exclude(id__in=RehearsalBigram.objects.filter(
+                production_id=production_id).values('rehearsal_id'))\
+            .only('id', 'production_id', 'note').order_by('id')
+        
+        count = 0
+        last_id = 0
+        while True:
+            batch = list(rehearsals.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return count
+            RehearsalBigram.objects.bulk_create([RehearsalBigram(gram=gram,
+                production_id=rehearsal.production_id,
+                rehearsal_id=rehearsal.id)
+                for rehearsal in batch for gram in bigrams(rehearsal.note)])
+            count += len(batch)
+            last_id = batch[-1].id
+
+
+def get_backend():
+    '''設定または DB に合ったバックエンド
+    '''
+    path = getattr(settings, 'SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'postgresql':
+        return TrigramBackend()
+    return BigramBackend()
+
+
+def search(query, prod_ids, limit=50):
+    '''公演の稽古からメモに語を全て含むものを探し、順位の高い順に返す
+    
+    順位は、語がメモに出てくる回数の合計。同じなら締切の早い順
+    
+    Parameters
+    ----------
+    query : str
+        空白で区切った検索語
+    prod_ids : list of int
+        検索する公演 (ユーザがメンバーである公演)
+    
+    Returns
+    -------
+    rehearsals : QuerySet
+        rank 属性に順位を持つ稽古
+    '''
+    terms = parse_query(query)
+    if not terms or not prod_ids:
+        return Rehearsal.objects.none()
+    
+    rehearsals = Rehearsal.objects.filter(production_id__in=prod_ids)
+    rehearsals = get_backend().candidates(rehearsals, terms, prod_ids)
+    
+    # 語は揃えてあるので、揃えたメモと大文字・小文字を区別して比べる
+    rank = Value(0)
+    for term in terms:
+        rehearsals = rehearsals.filter(note_search__contains=term)
+        # (len(メモ) - len(メモから語を除いたもの)) / len(語) = 出てくる回数
+        removed = Replace('note_search', Value(term), Value(''))
+        rank = rank + (Length('note_search') - Length(removed)) / len(term)
+    
+    return rehearsals.annotate(rank=rank)\
+        .defer('note', 'note_html', 'note_search')\
+        .select_related('production', 'assignee__user')\
+        .order_by('-rank', 'date', 'id')[:limit]
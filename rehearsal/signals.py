@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from production.models import Production
+from production import page_cache
+from .models import Rehearsal
+from . import feeds, search
+
+
+@receiver([post_save, post_delete], sender=Rehearsal)
+def rehearsal_changed(sender, instance, **kwargs):
+    '''稽古が変わったら、その公演のフィードとページを作り直させる
+    
+    公演の更新日時も進むので、削除もページの Last-Modified に反映される
+    '''
+    feeds.invalidate(instance.production_id)
+    page_cache.bump(instance.production_id)
+
+
+@receiver(post_save, sender=Rehearsal)
+def rehearsal_saved(sender, instance, update_fields=None, **kwargs):
+    '''稽古のメモが変わったかもしれなければ、検索のインデックスを更新する
+    '''
+    if update_fields is None or 'note' in update_fields:
+        search.get_backend().index(instance)
+
+
+@receiver([post_save, post_delete], sender=Production)
+def production_changed(sender, instance, **kwargs):
+    '''公演が変わったら (名前はフィードに含まれる)、フィードを作り直させる
+    '''
+    feeds.invalidate(instance.id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    '''ユーザが変わったら (名前は一覧の担当に表示される)、
+    担当している稽古の版数と更新日時を進め、一覧の行を描画し直させる
+    
+    ログイン時の last_login の更新では上げない
+    '''
+    if created or update_fields is not None\
+        and set(update_fields) <= {'last_login'}:
+        return
+    Rehearsal.objects.filter(assignee__user_id=instance.id)\
+        .update(version=F('version') + 1, updated_at=timezone.now())
@@ -1,3 +1,815 @@
+import csv
+import importlib
+import io
+import json
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
 from django.test import TestCase
+from django.urls import reverse
+from production import checks
+from production.models import Production, ProdUser
+from .models import Rehearsal, CalendarToken, RehearsalBigram
+from .forms import RhslForm
+from .views import RhslList
 
-# Create your tests here.
+
+# テストは 1 つのプロセスで動くので、ローカルメモリのキャッシュも
+# 全ワーカーで共有されるものとして扱う
+shared_cache = mock.patch.object(checks, 'LOCAL_BACKENDS', ())
+
+
+class RhslAccessTest(TestCase):
+    '''稽古のビューのアクセス権
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.editor = user_model.objects.create_user('editor', password='pw')
+        cls.member = user_model.objects.create_user('member', password='pw')
+        cls.outsider = user_model.objects.create_user('outsider', password='pw')
+        
+        cls.production = Production.objects.create(name='prod')
+        ProdUser.objects.create(production=cls.production, user=cls.editor,
+            is_editor=True)
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+        cls.rehearsal = Rehearsal.objects.create(production=cls.production,
+            date='2021-09-10', note='task', prog='Started')
+    
+    def test_detail(self):
+        '''詳細はメンバーなら表示できる
+        '''
+        url = reverse('rehearsal:rhsl_detail', kwargs={'pk': self.rehearsal.id})
+        for user, status in ((self.editor, 200), (self.member, 200),
+            (self.outsider, 403)):
+            self.client.force_login(user)
+            self.assertEqual(self.client.get(url).status_code, status)
+    
+    def test_update(self):
+        '''更新は編集権が必要
+        '''
+        url = reverse('rehearsal:rhsl_update', kwargs={'pk': self.rehearsal.id})
+        for user, status in ((self.editor, 200), (self.member, 403),
+            (self.outsider, 403)):
+            self.client.force_login(user)
+            self.assertEqual(self.client.get(url).status_code, status)
+        
+        self.client.force_login(self.editor)
+        response = self.client.post(url, {'date': '2021-09-11', 'note': 'new',
+            'assignee': '', 'prog': 'DONE!!!'})
+        self.assertEqual(response.status_code, 302)
+        self.rehearsal.refresh_from_db()
+        self.assertEqual(self.rehearsal.note, 'new')
+    
+    def test_delete(self):
+        '''削除は編集権が必要
+        '''
+        url = reverse('rehearsal:rhsl_delete', kwargs={'pk': self.rehearsal.id})
+        self.client.force_login(self.member)
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.client.force_login(self.editor)
+        self.assertEqual(self.client.post(url).status_code, 302)
+        self.assertFalse(Rehearsal.objects.exists())
+
+
+class RhslListTest(TestCase):
+    '''稽古一覧の絞り込みとページ分割
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('user')
+        cls.production = Production.objects.create(name='prod')
+        cls.prod_user = ProdUser.objects.create(production=cls.production,
+            user=cls.user)
+        
+        # 同じ締切の稽古が複数あっても順序が決まるようにする
+        Rehearsal.objects.bulk_create([Rehearsal(production=cls.production,
+            date=f'2021-09-{i % 5 + 1:02}',
+            assignee=cls.prod_user if i % 2 else None,
+            prog='DONE!!!' if i % 3 == 0 else 'Started')
+            for i in range(12)])
+    
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_login(self.user)
+        self.url = reverse('rehearsal:rhsl_list',
+            kwargs={'prod_id': self.production.id})
+    
+    def pages(self, **params):
+        '''全てのページを辿って、表示されたレコードを返す
+        '''
+        rehearsals = []
+        with mock.patch.object(RhslList, 'page_size', 5):
+            while True:
+                response = self.client.get(self.url, params)
+                rehearsals += response.context['object_list']
+                cursor = response.context['view'].next_cursor
+                if not cursor:
+                    return rehearsals
+                params['after'] = cursor
+    
+    def test_keyset_pages(self):
+        '''ページを辿ると、全ての稽古が締切, id の順に 1 回ずつ表示される
+        '''
+        expected = list(Rehearsal.objects.order_by('date', 'id'))
+        self.assertEqual(self.pages(), expected)
+        self.assertEqual(self.pages(sort='-date'), expected[::-1])
+    
+    def test_filter(self):
+        '''担当, 進捗, 締切の範囲で絞り込める
+        '''
+        expected = list(Rehearsal.objects.filter(assignee=self.prod_user,
+            prog='Started', date__gte='2021-09-02', date__lte='2021-09-04')
+            .order_by('date', 'id'))
+        self.assertTrue(expected)
+        self.assertEqual(self.pages(assignee=self.prod_user.id, prog='Started',
+            date_from='2021-09-02', date_to='2021-09-04'), expected)
+    
+    def test_note_deferred(self):
+        '''一覧では note 全体を読まない
+        '''
+        response = self.client.get(self.url)
+        for rehearsal in response.context['object_list']:
+            self.assertIn('note', rehearsal.get_deferred_fields())
+    
+    def test_invalid_cursor(self):
+        '''不正なカーソルは無視して先頭から表示する
+        '''
+        response = self.client.get(self.url, {'after': 'x,y'})
+        self.assertEqual(response.status_code, 200)
+
+
+class NoteFieldsTest(TestCase):
+    '''メモの抜粋と HTML
+    '''
+    def test_save(self):
+        '''保存時に抜粋が更新される
+        '''
+        production = Production.objects.create(name='prod')
+        rehearsal = Rehearsal.objects.create(production=production,
+            date='2021-09-10', note='short')
+        self.assertEqual(rehearsal.excerpt, 'short')
+        
+        rehearsal.note = 'first line\nsecond line'
+        rehearsal.save(update_fields=['note'])
+        rehearsal.refresh_from_db()
+        self.assertEqual(rehearsal.excerpt, 'first line…')
+        
+        rehearsal.note = 'あ' * 100
+        rehearsal.save()
+        self.assertEqual(rehearsal.excerpt, 'あ' * 49 + '…')
+    
+    def test_note_html(self):
+        '''保存時にメモの HTML が作られ、note が変わった時だけ作り直される
+        '''
+        from django.template import Template, Context
+        
+        note = '<b>詳細</b>は https://example.com/ を参照\n2行目'
+        production = Production.objects.create(name='prod')
+        rehearsal = Rehearsal.objects.create(production=production,
+            date='2021-09-10', note=note)
+        expected = Template('{{ note | urlize | linebreaksbr }}').render(
+            Context({'note': note}))
+        self.assertEqual(rehearsal.note_html, expected)
+        
+        rehearsal = Rehearsal.objects.get(id=rehearsal.id)
+        with mock.patch('rehearsal.models.render_note_html',
+            return_value='') as render:
+            rehearsal.prog = 'Started'
+            rehearsal.save()
+            render.assert_not_called()
+            rehearsal.note = 'changed'
+            rehearsal.save()
+            render.assert_called_once_with('changed')
+    
+    def test_rebuild_command(self):
+        '''古い規則で作られた HTML を作り直す
+        '''
+        from django.core.management import call_command
+        
+        production = Production.objects.create(name='prod')
+        rehearsal = Rehearsal.objects.create(production=production,
+            date='2021-09-10', note='https://example.com/')
+        Rehearsal.objects.update(note_html='', note_html_version=0)
+        call_command('rebuild_note_html', batch_size=1, stdout=io.StringIO())
+        rehearsal.refresh_from_db()
+        self.assertIn('<a href="https://example.com/"', rehearsal.note_html)
+
+
+class RhslFormTest(TestCase):
+    '''稽古の追加・更新フォーム
+    '''
+    def test_assignee_choices(self):
+        '''担当は同じ公演のメンバーから 1 回のクエリで選ぶ
+        '''
+        user_model = get_user_model()
+        production, other = Production.objects.bulk_create(
+            [Production(name='prod'), Production(name='other')])
+        production, other = Production.objects.order_by('id')
+        members = [ProdUser.objects.create(production=production,
+            user=user_model.objects.create_user(f'user{i}')) for i in range(3)]
+        ProdUser.objects.create(production=other,
+            user=user_model.objects.create_user('outsider'))
+        
+        form = RhslForm(production=production)
+        with self.assertNumQueries(1):
+            choices = [label for value, label in form.fields['assignee'].choices]
+        self.assertEqual(choices, ['---------'] + [str(pu) for pu in members])
+
+
+class MemberToAssigneeTest(TestCase):
+    '''担当の文字列をメンバーに対応づけるマイグレーション (0028)
+    '''
+    def test_match_member(self):
+        '''1 人に決まる表示名だけを対応づける
+        '''
+        migration = importlib.import_module(
+            'rehearsal.migrations.0028_member_to_assignee')
+        user_model = get_user_model()
+        production = Production.objects.create(name='prod')
+        tanaka, yamada = [ProdUser.objects.create(production=production,
+            user=user_model.objects.create_user(username,
+                last_name=last_name, first_name=first_name))
+            for username, last_name, first_name in (
+                ('tanaka', '田中', '花子'), ('yamada', '田中', '太郎'))]
+        names = migration.member_names(ProdUser, production.id)
+        
+        self.assertEqual(migration.match_member(names, 'yamada'), yamada.id)
+        self.assertEqual(migration.match_member(names, '田中, 花子'),
+            tanaka.id)
+        self.assertEqual(migration.match_member(names, '太郎'), yamada.id)
+        # 同姓の 2 人は決まらない
+        self.assertIsNone(migration.match_member(names, '田中'))
+        self.assertIsNone(migration.match_member(names, '鈴木'))
+
+
+class RhslAgendaTest(TestCase):
+    '''全ての公演の終わっていない稽古 (My tasks)
+    '''
+    def create_productions(self, user, count):
+        '''count 個の公演と、その稽古を作る
+        '''
+        Production.objects.bulk_create(
+            [Production(name=f'prod{count}-{i}') for i in range(count)])
+        productions = Production.objects.filter(
+            name__startswith=f'prod{count}-')
+        ProdUser.objects.bulk_create([ProdUser(production=production,
+            user=user) for production in productions])
+        prod_users = ProdUser.objects.filter(user=user)
+        Rehearsal.objects.bulk_create([Rehearsal(production=pu.production,
+            date=f'2021-09-{day:02}', prog=prog, assignee=assignee)
+            for pu in prod_users.select_related('production')
+            for day, prog, assignee in ((3, 'Started', pu), (1, ' ', None),
+                (2, 'DONE!!!', pu))])
+    
+    def test_open_tasks(self):
+        '''自分の公演の終わっていない稽古だけが締切順に表示される
+        '''
+        user_model = get_user_model()
+        user = user_model.objects.create_user('user')
+        self.create_productions(user, 3)
+        self.create_productions(user_model.objects.create_user('other'), 2)
+        
+        self.client.force_login(user)
+        response = self.client.get(reverse('my_tasks'))
+        expected = list(Rehearsal.objects.filter(
+            production__produser__user=user).exclude(prog='DONE!!!')
+            .order_by('date', 'id'))
+        self.assertEqual(len(expected), 6)
+        self.assertEqual(response.context['object_list'], expected)
+        
+        # 自分が担当の稽古だけ
+        response = self.client.get(reverse('my_tasks'), {'assigned': '1'})
+        self.assertEqual(response.context['object_list'],
+            [rehearsal for rehearsal in expected if rehearsal.assignee])
+    
+    def test_num_queries(self):
+        '''公演の数によらず、クエリの数は一定
+        
+        セッション, ユーザ, 稽古の 3 回
+        '''
+        user_model = get_user_model()
+        for count in (1, 30):
+            with self.subTest(count=count):
+                user = user_model.objects.create_user(f'user{count}')
+                self.create_productions(user, count)
+                self.client.force_login(user)
+                with self.assertNumQueries(3):
+                    self.client.get(reverse('my_tasks'))
+    
+    def test_plan(self):
+        '''公演ごとに、終わっていない稽古のインデックスを締切順に読む
+        '''
+        from django.db import connection
+        from .hot_queries import my_tasks
+        
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite の実行計画を見る')
+        user = get_user_model().objects.create_user('user')
+        self.create_productions(user, 2)
+        plan = my_tasks(ProdUser.objects.filter(user=user).first()).explain()
+        self.assertIn('USING INDEX rehearsal_open_date_idx', plan)
+
+
+class RhslImportTest(TestCase):
+    '''稽古の一括取り込み
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.editor = user_model.objects.create_user('editor')
+        cls.member = user_model.objects.create_user('member')
+        user_model.objects.create_user('outsider')
+        cls.production = Production.objects.create(name='prod')
+        cls.editor_prod_user = ProdUser.objects.create(
+            production=cls.production, user=cls.editor, is_editor=True)
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+        cls.url = reverse('rehearsal:rhsl_import',
+            kwargs={'prod_id': cls.production.id})
+    
+    def upload(self, name, content, encoding='utf-8'):
+        '''ファイルをアップロードする
+        '''
+        file = io.BytesIO(content.encode(encoding))
+        file.name = name
+        return self.client.post(self.url, {'file': file})
+    
+    def test_csv(self):
+        '''正しい行だけを追加し、行ごとのエラーを返す
+        '''
+        self.client.force_login(self.editor)
+        response = self.upload('tasks.csv',
+            'date,note,assignee,prog\n'
+            '2021-09-10,"first\nsecond",editor,Started\n'
+            '2021-09-11,no staff,,\n'
+            'someday,bad date,,Started\n'
+            '2021-09-12,outsider,outsider,Started\n'
+            '2021-09-13,bad prog,,Later\n')
+        result = response.context['result']
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, _ in result.errors], [5, 6, 7])
+        
+        rehearsals = Rehearsal.objects.order_by('date')
+        self.assertEqual([(r.note, r.excerpt, r.assignee, r.prog)
+            for r in rehearsals], [
+            ('first\nsecond', 'first…', self.editor_prod_user, 'Started'),
+            ('no staff', 'no staff', None, ' '),
+        ])
+        self.assertEqual(rehearsals[0].note_html, 'first<br>second')
+    
+    def test_jsonl(self):
+        '''JSON Lines では、読めない行もエラーとして報告する
+        '''
+        self.client.force_login(self.editor)
+        response = self.upload('tasks.jsonl',
+            '{"date": "2021-09-10", "note": "a", "prog": "DONE!!!"}\n'
+            '\n'
+            'not json\n'
+            '{"date": "2021-09-11", "note": "b", "assignee": "member"}\n')
+        result = response.context['result']
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.errors, [(3, '行を読めません。')])
+    
+    def test_jsonl_values(self):
+        '''JSON Lines の数値は文字列として検証し、入れ子の値はエラーにする
+        '''
+        self.client.force_login(self.editor)
+        response = self.upload('tasks.jsonl',
+            '{"date": 20210910, "note": 1}\n'
+            '{"date": "2021-09-11", "note": ["a"]}\n')
+        result = response.context['result']
+        self.assertEqual(result.created, 0)
+        self.assertEqual([line for line, _ in result.errors], [1, 2])
+        self.assertIn('date', result.errors[0][1])
+        self.assertEqual(result.errors[1][1], 'note: 値を読めません。')
+    
+    def test_not_utf8(self):
+        '''UTF-8 で読めないところから先は取り込まず、エラーを返す
+        '''
+        self.client.force_login(self.editor)
+        response = self.upload('tasks.csv',
+            'date,note,assignee,prog\n' + '2021-09-10,ok,,\n' * 20 +
+            '2021-09-10,稽古場の予約,,\n', encoding='shift_jis')
+        result = response.context['result']
+        self.assertLessEqual(result.created, 20)
+        self.assertEqual([message for _, message in result.errors],
+            ['文字コードを読めません。UTF-8 で保存してください。'])
+        
+        response = self.upload('tasks.jsonl',
+            '{"date": "2021-09-10", "note": "稽古場"}\n', encoding='shift_jis')
+        self.assertEqual(response.context['result'].errors, [(1,
+            '文字コードを読めません。UTF-8 で保存してください。')])
+    
+    def test_csv_error(self):
+        '''CSV として読めない行はエラーにして、続きを読む
+        '''
+        self.client.force_login(self.editor)
+        response = self.upload('tasks.csv',
+            'date,note,assignee,prog\n'
+            f'2021-09-10,{"x" * (csv.field_size_limit() + 1)},,\n'
+            '2021-09-11,ok,,\n')
+        result = response.context['result']
+        self.assertEqual(result.created, 1)
+        self.assertEqual([line for line, _ in result.errors], [2])
+        self.assertTrue(result.errors[0][1].startswith('CSV として読めません'))
+    
+    def test_num_queries(self):
+        '''行数によらず、メンバーの取得と batch_size 件ごとの INSERT だけ
+        '''
+        from .importer import import_rehearsals, read_rows
+        
+        content = 'date,note,assignee,prog\n' + ''.join(
+            f'2021-09-10,task {i},editor,Started\n' for i in range(10))
+        # メンバー, INSERT x3 と SAVEPOINT 2 回, 公演の更新日時,
+        # 検索インデックスの作成 (SELECT と INSERT x3, 最後の SELECT)
+        with self.assertNumQueries(14):
+            result = import_rehearsals(self.production,
+                read_rows(io.BytesIO(content.encode())), batch_size=4)
+        self.assertEqual(result.created, 10)
+        self.assertFalse(Rehearsal.objects.filter(production=self.production,
+            rehearsalbigram=None).exists())
+    
+    def test_editor_only(self):
+        '''編集権がなければ取り込めない
+        '''
+        self.client.force_login(self.member)
+        response = self.upload('tasks.csv', 'date,note,assignee,prog\n')
+        self.assertEqual(response.status_code, 403)
+
+
+class RhslExportTest(TestCase):
+    '''稽古の書き出し
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.member = user_model.objects.create_user('member')
+        cls.outsider = user_model.objects.create_user('outsider')
+        cls.production = Production.objects.create(name='prod')
+        member = ProdUser.objects.create(production=cls.production,
+            user=cls.member)
+        Rehearsal.objects.create(production=cls.production,
+            date='2021-09-11', note='b,"quoted"\nsecond', prog='Started',
+            assignee=member)
+        Rehearsal.objects.create(production=cls.production,
+            date='2021-09-10', note='a', prog='DONE!!!')
+        cls.url = reverse('rehearsal:rhsl_export',
+            kwargs={'prod_id': cls.production.id})
+    
+    def setUp(self):
+        caches['default'].clear()
+    
+    def export(self, **params):
+        '''書き出した内容を文字列で返す
+        '''
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8-sig')
+    
+    def test_csv(self):
+        '''取り込みと同じ列の CSV を、一覧と同じ条件で書き出す
+        '''
+        self.client.force_login(self.member)
+        content = self.export()
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ['id', 'date', 'note', 'assignee', 'prog'])
+        self.assertEqual([row[1:] for row in rows[1:]], [
+            ['2021-09-10', 'a', '', 'DONE!!!'],
+            ['2021-09-11', 'b,"quoted"\nsecond', 'member', 'Started'],
+        ])
+        
+        content = self.export(prog='Started', sort='-date')
+        self.assertEqual(len(list(csv.reader(io.StringIO(content)))), 2)
+    
+    def test_jsonl(self):
+        '''JSON Lines で書き出す
+        '''
+        self.client.force_login(self.member)
+        content = self.export(format='jsonl', sort='-date')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row['date'], row['assignee']) for row in rows],
+            [('2021-09-11', 'member'), ('2021-09-10', None)])
+    
+    def test_member_only(self):
+        '''メンバーでなければ書き出せない
+        '''
+        self.client.force_login(self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+@shared_cache
+class RhslFeedTest(TestCase):
+    '''締切の iCalendar フィード
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.member = user_model.objects.create_user('member')
+        cls.production = Production.objects.create(name='prod')
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+        cls.other = Production.objects.create(name='other')
+        cls.rehearsal = Rehearsal.objects.create(production=cls.production,
+            date='2021-09-10', note='task; a, b', prog='Started')
+        Rehearsal.objects.create(production=cls.production,
+            date='2021-09-11', note='done', prog='DONE!!!')
+        Rehearsal.objects.create(production=cls.other,
+            date='2021-09-12', note='secret', prog='Started')
+    
+    def setUp(self):
+        caches['default'].clear()
+        self.token = CalendarToken.issue(self.member).token
+        self.url = reverse('rehearsal:feed', kwargs={'token': self.token})
+    
+    def test_feed(self):
+        '''メンバーの公演の終わっていない稽古の締切だけを含む
+        '''
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'],
+            'text/calendar; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('DTSTART;VALUE=DATE:20210910\r\n', body)
+        self.assertIn('SUMMARY:[prod] task\; a\\, b\r\n', body)
+        self.assertNotIn('done', body)
+        self.assertNotIn('secret', body)
+        
+        url = reverse('rehearsal:prod_feed',
+            kwargs={'token': self.token, 'prod_id': self.other.id})
+        self.assertEqual(self.client.get(url).status_code, 404)
+    
+    def test_conditional(self):
+        '''変わっていなければキャッシュから 304 を返し、稽古が変われば作り直す
+        '''
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        
+        # トークンの検索だけ
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        self.rehearsal.note = 'changed'
+        self.rehearsal.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SUMMARY:[prod] changed', response.content.decode())
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_revoke(self):
+        '''作り直すと前の URL は使えない
+        '''
+        self.client.force_login(self.member)
+        self.client.post(reverse('rehearsal:calendar'), {'action': 'issue'})
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        
+        self.client.post(reverse('rehearsal:calendar'), {'action': 'revoke'})
+        self.assertFalse(CalendarToken.objects.exists())
+
+
+class RhslSearchTest(TestCase):
+    '''メモの全文検索
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.member = user_model.objects.create_user('member')
+        cls.production = Production.objects.create(name='prod')
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+        other = Production.objects.create(name='other')
+        
+        cls.once = Rehearsal.objects.create(production=cls.production,
+            date='2021-09-10', note='稽古場の予約')
+        cls.twice = Rehearsal.objects.create(production=cls.production,
+            date='2021-09-11', note='稽古場の鍵\n稽古場の掃除')
+        Rehearsal.objects.create(production=cls.production,
+            date='2021-09-12', note='稽古の場所')
+        Rehearsal.objects.create(production=other, date='2021-09-10',
+            note='稽古場の予約')
+    
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_login(self.member)
+    
+    def get_results(self, query):
+        response = self.client.get(reverse('rehearsal:rhsl_search'),
+            {'q': query})
+        return list(response.context['object_list'])
+    
+    def test_rank(self):
+        '''自分の公演の稽古だけを、出てくる回数の多い順に返す
+        
+        bigram が全て含まれていても、続いていなければ含まない
+        '''
+        self.assertEqual(self.get_results('稽古場'), [self.twice, self.once])
+        self.assertEqual(self.get_results('稽古場 予約'), [self.once])
+        self.assertEqual(self.get_results('鍵'), [self.twice])
+        self.assertEqual(self.get_results('劇場'), [])
+    
+    def test_normalize(self):
+        '''全角・半角と大文字・小文字によらず探し、数える
+        '''
+        alphabet = Rehearsal.objects.create(production=self.production,
+            date='2021-09-13', note='ＡＢＣの台本\nabc の印刷')
+        kana = Rehearsal.objects.create(production=self.production,
+            date='2021-09-14', note='ｶﾞｲﾄﾞの確認')
+        self.assertEqual(self.get_results('abc'), [alphabet])
+        self.assertEqual(self.get_results('ＡＢＣ'), [alphabet])
+        self.assertEqual(self.get_results('ガイド'), [kana])
+        self.assertEqual(self.get_results('ｶﾞｲﾄﾞ'), [kana])
+        self.assertEqual(self.get_results('abc')[0].rank, 2)
+    
+    def test_incremental(self):
+        '''メモを変えると、インデックスも変わる
+        '''
+        self.once.note = '衣装の予約'
+        self.once.save()
+        self.assertEqual(self.get_results('稽古場'), [self.twice])
+        self.assertEqual(self.get_results('衣装'), [self.once])
+        self.assertEqual(sorted(RehearsalBigram.objects.filter(
+            rehearsal=self.once).values_list('gram', flat=True)),
+            sorted(['衣装', '装の', 'の予', '予約', '約']))
+
+
+@shared_cache
+class PageCacheTest(TestCase):
+    '''編集権のないメンバーへのページのキャッシュ
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.member = user_model.objects.create_user('member')
+        cls.editor = user_model.objects.create_user('editor')
+        cls.production = Production.objects.create(name='prod')
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+        ProdUser.objects.create(production=cls.production, user=cls.editor,
+            is_editor=True)
+        cls.rehearsal = Rehearsal.objects.create(production=cls.production,
+            date='2021-09-10', note='before')
+    
+    def setUp(self):
+        caches['default'].clear()
+    
+    def test_list(self):
+        '''2 回目はセッション, ユーザの取得と検証子の集計だけで返し、
+        稽古を変えれば描画し直す
+        '''
+        self.client.force_login(self.member)
+        url = reverse('rehearsal:rhsl_list',
+            kwargs={'prod_id': self.production.id})
+        first = self.client.get(url)
+        with self.assertNumQueries(3):
+            second = self.client.get(url)
+        self.assertIsNone(second.context)
+        self.assertEqual(second.content, first.content)
+        
+        self.rehearsal.note = 'after'
+        self.rehearsal.save()
+        self.assertContains(self.client.get(url), 'after')
+    
+    def test_detail(self):
+        '''URL に prod_id がなくても、2 回目の表示からキャッシュする
+        '''
+        self.client.force_login(self.member)
+        url = reverse('rehearsal:rhsl_detail', kwargs={'pk': self.rehearsal.id})
+        self.client.get(url)
+        self.client.get(url)
+        with self.assertNumQueries(3):
+            self.assertContains(self.client.get(url), 'before')
+    
+    def test_editor(self):
+        '''編集権があればキャッシュしない
+        '''
+        self.client.force_login(self.editor)
+        url = reverse('rehearsal:rhsl_list',
+            kwargs={'prod_id': self.production.id})
+        self.client.get(url)
+        self.assertIsNotNone(self.client.get(url).context)
+    
+    def test_outsider(self):
+        '''メンバーでなければ、キャッシュがあってもアクセスできない
+        '''
+        self.client.force_login(self.member)
+        url = reverse('rehearsal:rhsl_list',
+            kwargs={'prod_id': self.production.id})
+        self.client.get(url)
+        
+        self.client.force_login(get_user_model().objects.create_user('out'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class RowCacheTest(TestCase):
+    '''稽古一覧の行ごとのキャッシュ
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        cls.editor = get_user_model().objects.create_user('editor')
+        cls.production = Production.objects.create(name='prod')
+        cls.prod_user = ProdUser.objects.create(production=cls.production,
+            user=cls.editor, is_editor=True)
+        Rehearsal.objects.bulk_create([Rehearsal(production=cls.production,
+            date='2021-09-10', note=f'task {i}', excerpt=f'task {i}',
+            assignee=cls.prod_user if i == 0 else None) for i in range(5)])
+        cls.url = reverse('rehearsal:rhsl_list',
+            kwargs={'prod_id': cls.production.id})
+    
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_login(self.editor)
+    
+    def rendered_rows(self):
+        '''一覧を表示し、描画し直した行の数を返す
+        '''
+        response = self.client.get(self.url)
+        return [template.name for template in response.templates]\
+            .count('rehearsal/rehearsal_row.html')
+    
+    def test_changed_row_only(self):
+        '''変わった行だけを描画し直す
+        '''
+        self.assertEqual(self.rendered_rows(), 5)
+        self.assertEqual(self.rendered_rows(), 0)
+        
+        rehearsal = Rehearsal.objects.get(note='task 3')
+        rehearsal.prog = 'DONE!!!'
+        rehearsal.save(update_fields=['prog'])
+        self.assertEqual(self.rendered_rows(), 1)
+        self.assertContains(self.client.get(self.url), 'DONE!!!')
+    
+    def test_assignee_renamed(self):
+        '''担当のユーザ名が変わったら、その行を描画し直す
+        '''
+        self.rendered_rows()
+        self.editor.username = 'renamed'
+        self.editor.save()
+        self.assertEqual(self.rendered_rows(), 1)
+        self.assertContains(self.client.get(self.url), 'renamed')
+
+
+@shared_cache
+class ConditionalGetTest(TestCase):
+    '''ETag, Last-Modified による 304
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        cls.editor = user_model.objects.create_user('editor')
+        cls.member = user_model.objects.create_user('member')
+        cls.production = Production.objects.create(name='prod')
+        cls.prod_user = ProdUser.objects.create(production=cls.production,
+            user=cls.editor, is_editor=True)
+        ProdUser.objects.create(production=cls.production, user=cls.member)
+        cls.rehearsals = [Rehearsal.objects.create(production=cls.production,
+            date='2021-09-10', note=f'task {i}', assignee=cls.prod_user)
+            for i in range(3)]
+        cls.list_url = reverse('rehearsal:rhsl_list',
+            kwargs={'prod_id': cls.production.id})
+    
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_login(self.editor)
+    
+    def revalidate(self, url, response):
+        '''前の応答の ETag を付けて取り直す
+        '''
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    
+    def test_list(self):
+        '''変わっていなければ集計 1 回で 304、稽古を削除すれば 200
+        '''
+        first = self.client.get(self.list_url)
+        self.assertIn('Last-Modified', first)
+        # セッション, ユーザ, 検証子の集計
+        with self.assertNumQueries(3):
+            self.assertEqual(
+                self.revalidate(self.list_url, first).status_code, 304)
+        
+        self.rehearsals[0].delete()
+        self.assertEqual(
+            self.revalidate(self.list_url, first).status_code, 200)
+    
+    def test_role(self):
+        '''権限が違えば ETag も違う
+        '''
+        first = self.client.get(self.list_url)
+        self.client.force_login(self.member)
+        self.assertEqual(
+            self.revalidate(self.list_url, first).status_code, 200)
+    
+    def test_detail(self):
+        '''担当の名前が変われば 200
+        '''
+        url = reverse('rehearsal:rhsl_detail',
+            kwargs={'pk': self.rehearsals[1].id})
+        first = self.client.get(url)
+        self.assertEqual(self.revalidate(url, first).status_code, 304)
+        
+        self.editor.first_name = 'renamed'
+        self.editor.save()
+        self.assertContains(self.revalidate(url, first), 'renamed')
+    
+    def test_outsider(self):
+        '''メンバーでなければ、ETag が同じでも 403
+        '''
+        first = self.client.get(self.list_url)
+        self.client.force_login(get_user_model().objects.create_user('out'))
+        self.assertEqual(
+            self.revalidate(self.list_url, first).status_code, 403)
@@ -18,6 +18,14 @@ urlpatterns = [
     # /rhsl/rhsl_create/1/ -> Rehearsal Create for Production #1
     path('rhsl_create/<int:prod_id>/', views.RhslCreate.as_view(),
         name='rhsl_create'),
+    # /rhsl/rhsl_import/1/ -> Rehearsal Import for Production #1
+    path('rhsl_import/<int:prod_id>/', views.RhslImport.as_view(),
+        name='rhsl_import'),
+    # /rhsl/rhsl_export/1/?format=csv -> Rehearsal Export for Production #1
+    path('rhsl_export/<int:prod_id>/', views.RhslExport.as_view(),
+        name='rhsl_export'),
+    # /rhsl/rhsl_search/?q=word -> Rehearsal Search
+    path('rhsl_search/', views.RhslSearch.as_view(), name='rhsl_search'),
     # /rhsl/rhsl_update/1/ -> Rehearsal #1 Update
     path('rhsl_update/<int:pk>/', views.RhslUpdate.as_view(),
         name='rhsl_update'),
@@ -28,6 +36,17 @@ urlpatterns = [
     path('rhsl_delete/<int:pk>/', views.RhslDelete.as_view(),
         name='rhsl_delete'),
     
+    # ----------------------------------------------------------------
+    # 締切のカレンダー
+    
+    # /rhsl/calendar/ -> Calendar feed settings
+    path('calendar/', views.CalendarSettings.as_view(), name='calendar'),
+    # /rhsl/feed/<token>.ics -> Deadlines of all Productions
+    path('feed/<str:token>.ics', views.RhslFeed.as_view(), name='feed'),
+    # /rhsl/feed/<token>/1.ics -> Deadlines of Production #1
+    path('feed/<str:token>/<int:prod_id>.ics', views.RhslFeed.as_view(),
+        name='prod_feed'),
+    
     # /rhsl/rhsl_absence/1/ -> Asence list for Rehearsal #1
     #path('rhsl_absence/<int:pk>/', views.RhslAbsence.as_view(),
         #name='rhsl_absence'),
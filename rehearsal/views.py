@@ -1,14 +1,25 @@
 from operator import attrgetter
-from django.views.generic import ListView, TemplateView, DetailView
+from django.db.models import Count, Max, Q
+from django.views.generic import ListView, TemplateView, DetailView, View
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from django.http import Http404
+from django.views.generic.edit import FormView
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.exceptions import PermissionDenied
-from production.models import Production
-from rehearsal.models import Rehearsal
-from rehearsal.forms import RhslForm
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.timezone import localdate
+from production.models import Production, ProdUser
+from rehearsal.models import Rehearsal, CalendarToken
+from rehearsal.forms import RhslForm, RhslFilterForm, RhslUploadForm
+from rehearsal.importer import guess_format, read_rows, import_rehearsals
+from rehearsal import exporter, feeds, search
+from rehearsal.rows import render_rows
+from production.membership import memberships
+from production.page_cache import CachedPageMixin
 from production.view_func import *
 
 
@@ -40,6 +51,97 @@ class ProdBaseListView(LoginRequiredMixin, ListView):
         return context
 
 
+class KeysetPaginationMixin:
+    '''キーセット (並べ替えの列の値) でページ分割する ListView の mixin
+    
+    OFFSET を使わず「前のページの最後の行より後」を検索するので、
+    どれだけ後ろのページでも、インデックスを使って同じ速さで表示できる。
+    
+    次のページの先頭を示すカーソルは GET パラメタ after で受け渡す。
+    カーソルは並べ替えの列の値を ',' でつないだ文字列
+    '''
+    page_size = 50
+    
+    def paginate_keyset(self, queryset, ordering):
+        '''queryset を並べ替え、カーソル以降の 1 ページ分を返す
+        
+        Parameters
+        ----------
+        queryset : QuerySet
+        ordering : list of str
+            並べ替えの列。順序が一意に決まるよう、最後は id にする
+        
+        Returns
+        -------
+        page : list
+            1 ページ分のレコード。次のページがあれば
+            self.next_cursor にカーソルをセットする
+        '''
+        model = queryset.model
+        fields = [model._meta.get_field(name.lstrip('-')) for name in ordering]
+        
+        # カーソルがあれば、それより後のレコードに絞り込む
+        values = self.decode_cursor(fields)
+        if values:
+            queryset = queryset.filter(self.after_cursor(ordering, values))
+        
+        # 次のページがあるか分かるよう、1 件多く取得する
+        page = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        self.next_cursor = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            self.next_cursor = ','.join(
+                field.value_to_string(page[-1]) for field in fields)
+        return page
+    
+    def decode_cursor(self, fields):
+        '''GET パラメタのカーソルを列の値に変換する
+        
+        不正なカーソルは無視して先頭のページを表示する
+        '''
+        cursor = self.request.GET.get('after')
+        if not cursor:
+            return None
+        values = cursor.split(',')
+        if len(values) != len(fields):
+            return None
+        try:
+            return [field.to_python(value)
+                for field, value in zip(fields, values)]
+        except ValidationError:
+            return None
+    
+    def after_cursor(self, ordering, values):
+        '''並べ替えの順でカーソルより後になる条件
+        
+        (a, b) > (x, y) を a > x OR (a = x AND b > y) に展開する
+        '''
+        condition = Q()
+        equal = Q()
+        for name, value in zip(ordering, values):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            name = name.lstrip('-')
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+    
+    def next_page_query(self):
+        '''次のページへのリンクの GET パラメタ (絞り込みは維持する)
+        '''
+        if not self.next_cursor:
+            return None
+        params = self.request.GET.copy()
+        params['after'] = self.next_cursor
+        return params.urlencode()
+    
+    def first_page_query(self):
+        '''先頭のページへのリンクの GET パラメタ (絞り込みは維持する)
+        '''
+        params = self.request.GET.copy()
+        params.pop('after', None)
+        return params.urlencode()
+
+
 class ProdBaseCreateView(LoginRequiredMixin, CreateView):
     '''アクセス権を検査する CreateView の Base class
     '''
@@ -84,39 +186,20 @@ class ProdBaseCreateView(LoginRequiredMixin, CreateView):
         return super().form_invalid(form)
 
 
-class ProdBaseUpdateView(LoginRequiredMixin, UpdateView):
+class ProdBaseUpdateView(LoginRequiredMixin, ProdAccessMixin, UpdateView):
     '''アクセス権を検査する UpdateView の Base class
-    '''
-    def get(self, request, *args, **kwargs):
-        '''表示時のリクエストを受けるハンドラ
-        '''
-        # production を view の属性として持っておく
-        # テンプレートで固定要素として表示するため
-        self.production = self.get_object().production
-        
-        # 編集権を検査する
-        test_edit_permission(self, self.production.id)
-        
-        return super().get(request, *args, **kwargs)
     
-    def post(self, request, *args, **kwargs):
-        '''保存時のリクエストを受けるハンドラ
-        '''
-        # production を view の属性として持っておく
-        # フォームに渡してバリデーションで使うため
-        self.production = self.get_object().production
-
-        # 編集権を検査してアクセス中の公演ユーザを取得する
-        prod_user = test_edit_permission(self, self.production.id)
-        
-        return super().post(request, *args, **kwargs)
+    編集権を検査し、production を view の属性として持っておく
+    (テンプレートで固定要素として表示し、フォームのバリデーションで使うため)
+    '''
+    access_permission = 'editor'
     
     def form_valid(self, form):
         '''バリデーションを通った時
         '''
         messages.success(self.request, str(form.instance) + " を更新しました。")
         return super().form_valid(form)
-
+    
     def form_invalid(self, form):
         '''更新に失敗した時
         '''
@@ -124,46 +207,21 @@ class ProdBaseUpdateView(LoginRequiredMixin, UpdateView):
         return super().form_invalid(form)
 
 
-class ProdBaseDetailView(LoginRequiredMixin, DetailView):
+class ProdBaseDetailView(LoginRequiredMixin, ProdAccessMixin, DetailView):
     '''アクセス権を検査する DetailView の Base class
+    
+    アクセス中の ProdUser を view の属性として持っておく
+    (テンプレートで編集ボタンの有無を決めるため)
     '''
-    def get(self, request, *args, **kwargs):
-        '''表示時のリクエストを受けるハンドラ
-        '''
-        # アクセス情報から公演ユーザを取得する
-        prod_id = self.get_object().production.id
-        prod_user = accessing_prod_user(self, prod_id=prod_id)
-        if not prod_user:
-            raise PermissionDenied
-        
-        # アクセス中の ProdUser を view の属性として持っておく
-        # テンプレートで編集ボタンの有無を決めるため
-        self.prod_user = prod_user
-        
-        return super().get(request, *args, **kwargs)
+    access_permission = 'member'
 
 
-class ProdBaseDeleteView(LoginRequiredMixin, DeleteView):
+class ProdBaseDeleteView(LoginRequiredMixin, ProdAccessMixin, DeleteView):
     '''アクセス権を検査する DeleteView の Base class
     '''
+    access_permission = 'editor'
     template_name_suffix = '_delete'
     
-    def get(self, request, *args, **kwargs):
-        '''表示時のリクエストを受けるハンドラ
-        '''
-        # 編集権を検査する
-        test_edit_permission(self, self.get_object().production.id)
-        
-        return super().get(request, *args, **kwargs)
-    
-    def post(self, request, *args, **kwargs):
-        '''保存時のリクエストを受けるハンドラ
-        '''
-        # 編集権を検査する
-        test_edit_permission(self, self.get_object().production.id)
-        
-        return super().post(request, *args, **kwargs)
-    
     def delete(self, request, *args, **kwargs):
         '''削除した時のメッセージ
         '''
@@ -192,18 +250,175 @@ class RhslTop(LoginRequiredMixin, TemplateView):
         return super().get(request, *args, **kwargs)
 
 
-class RhslList(ProdBaseListView):
+class RhslList(ConditionalGetMixin, CachedPageMixin, KeysetPaginationMixin,
+    ProdBaseListView):
     '''Rehearsal のリストビュー
-
-    Template 名: rehearsal_list (default)
+    
+    担当, 進捗, 締切の範囲で絞り込み、締切順にキーセットでページ分割する。
+    編集権のないメンバーには、キャッシュしたページを返す。
+    変わっていなければ 304 を返す
+    
+    Template 名: rehearsal_list
     '''
     model = Rehearsal
+    page_cache_name = 'rhsl_list'
+    # get_queryset() がリストを返すので、テンプレート名を明示する
+    template_name = 'rehearsal/rehearsal_list.html'
     
     def get_queryset(self):
         '''リストに表示するレコードをフィルタする
         '''
         prod_id=self.kwargs['prod_id']
-        return Rehearsal.objects.filter(production__pk=prod_id)
+        # 一覧では抜粋を表示するので、note 全体とその HTML は読まない
+        # 担当の表示名にユーザ名を使うので、一緒に取得する
+        rehearsals = Rehearsal.objects.filter(production__pk=prod_id)\
+            .defer('note', 'note_html').select_related('assignee__user')
+        
+        # 絞り込み・並べ替えのフォームはテンプレートでも表示する
+        self.filter_form = RhslFilterForm(self.request.GET,
+            production=prod_id)
+        rehearsals = self.filter_form.filter(rehearsals)
+        
+        return self.paginate_keyset(rehearsals, self.filter_form.ordering())
+    
+    def page_validator(self):
+        '''公演, メンバー, 稽古の更新日時の最大値と件数から検証子を作る
+        
+        1 回のクエリで集計する (稽古は production, updated_at のインデックス)
+        '''
+        prod_user = accessing_prod_user(self)
+        if not prod_user:
+            return None
+        stamps = Production.objects.filter(id=prod_user.production_id)\
+            .annotate(**production_stamps(Rehearsal.objects.all(),
+                rehearsal_updated=Max('updated_at'),
+                rehearsal_count=Count('id')))\
+            .annotate(**production_stamps(ProdUser.objects.all(),
+                prod_user_updated=Max('updated_at'),
+                prod_user_count=Count('id')))\
+            .values_list('updated_at', 'rehearsal_updated', 'rehearsal_count',
+                'prod_user_updated', 'prod_user_count').first()
+        if stamps is None:
+            return None
+        return self.make_validator(prod_user, stamps)
+    
+    def get_context_data(self, **kwargs):
+        '''テンプレートに渡すパラメタを改変する
+        '''
+        context = super().get_context_data(**kwargs)
+        
+        # 行の HTML は、変わった行だけを描画する
+        editable = self.prod_user.is_owner or self.prod_user.is_editor
+        context['rows'] = render_rows(context['object_list'], editable)
+        
+        return context
+
+
+class RhslExport(LoginRequiredMixin, View):
+    '''公演の稽古を CSV または JSON Lines で書き出すビュー
+    
+    一覧と同じ GET パラメタで絞り込み・並べ替えをする。
+    format=jsonl なら JSON Lines、それ以外は CSV。
+    サーバサイドカーソルで chunk_size 件ずつ読みながら返すので、
+    行数によらずメモリの使用量は一定
+    '''
+    # 1 回に DB から読む行数
+    chunk_size = 2000
+    
+    def get(self, request, *args, **kwargs):
+        '''表示時のリクエストを受けるハンドラ
+        '''
+        # アクセス情報からメンバーを取得しアクセス権を検査する
+        test_permission(accessing_prod_user(self), 'member')
+        
+        prod_id = self.kwargs['prod_id']
+        rehearsals = Rehearsal.objects.filter(production__pk=prod_id)
+        filter_form = RhslFilterForm(request.GET, production=prod_id)
+        rehearsals = filter_form.filter(rehearsals)\
+            .order_by(*filter_form.ordering())
+        rows = rehearsals.values_list(*exporter.LOOKUPS)\
+            .iterator(chunk_size=self.chunk_size)
+        
+        format = request.GET.get('format')
+        if format not in exporter.FORMATS:
+            format = 'csv'
+        response = StreamingHttpResponse(exporter.export_lines(rows, format),
+            content_type=exporter.FORMATS[format])
+        response['Content-Disposition'] =\
+            f'attachment; filename="tasks-{prod_id}.{format}"'
+        return response
+
+
+class RhslAgenda(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    '''ログインユーザの全ての公演の、終わっていない稽古のリスト (My tasks)
+    
+    公演ごとにアクセス権を検査する代わりに、ユーザの ProdUser で
+    絞り込んだ 1 回のクエリで、締切順にキーセットでページ分割する。
+    GET パラメタ assigned=1 なら、自分が担当の稽古だけを表示する
+    
+    Template 名: agenda
+    '''
+    model = Rehearsal
+    template_name = 'rehearsal/agenda.html'
+    
+    def get_queryset(self):
+        '''リストに表示するレコードをフィルタする
+        '''
+        user = self.request.user
+        
+        # 自分がメンバーである公演の稽古
+        # (重複して JOIN しないよう、ProdUser はサブクエリにする)
+        productions = ProdUser.objects.filter(user=user,
+            production__deletion_requested_at__isnull=True)\
+            .values('production_id')
+        rehearsals = Rehearsal.objects.filter(production__in=productions)\
+            .exclude(prog='DONE!!!')
+        
+        self.assigned = self.request.GET.get('assigned') == '1'
+        if self.assigned:
+            rehearsals = rehearsals.filter(assignee__user=user)
+        
+        # 公演名と担当の表示名も、同じクエリで取得する
+        rehearsals = rehearsals.defer('note', 'note_html')\
+            .select_related('production', 'assignee__user')
+        
+        return self.paginate_keyset(rehearsals, ['date', 'id'])
+    
+    def get_context_data(self, **kwargs):
+        '''テンプレートに渡すパラメタを改変する
+        '''
+        context = super().get_context_data(**kwargs)
+        
+        # 締切を過ぎた稽古を強調するため
+        context['today'] = localdate()
+        
+        return context
+
+
+class RhslSearch(LoginRequiredMixin, ListView):
+    '''ログインユーザの全ての公演の稽古を、メモの全文で検索するビュー
+    
+    GET パラメタ q の語を全て含む稽古を、順位の高い順に表示する。
+    prod_id があれば、その公演の中だけを検索する
+    
+    Template 名: search
+    '''
+    model = Rehearsal
+    template_name = 'rehearsal/search.html'
+    # 表示する件数
+    limit = 50
+    
+    def get_queryset(self):
+        '''リストに表示するレコードをフィルタする
+        '''
+        # 自分がメンバーである公演 (キャッシュから取得する)
+        prod_ids = list(memberships(self.request.user))
+        prod_id = self.request.GET.get('prod_id', '')
+        if prod_id.isdigit():
+            prod_ids = [int(prod_id)] if int(prod_id) in prod_ids else []
+        
+        self.query = self.request.GET.get('q', '').strip()
+        return search.search(self.query, prod_ids, limit=self.limit)
 
 
 class RhslCreate(ProdBaseCreateView):
@@ -230,6 +445,56 @@ class RhslCreate(ProdBaseCreateView):
         return url
 
 
+class RhslImport(LoginRequiredMixin, FormView):
+    '''CSV または JSON Lines のファイルから稽古をまとめて追加するビュー
+    
+    取り込み後は、行ごとのエラーを同じテンプレートで表示する
+    '''
+    form_class = RhslUploadForm
+    template_name = 'rehearsal/rehearsal_import.html'
+    # 1 回の INSERT で追加する行数
+    batch_size = 1000
+    
+    def dispatch(self, request, *args, **kwargs):
+        '''リクエストを受けるハンドラ
+        '''
+        # 未ログインなら LoginRequiredMixin に任せる
+        if not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+        
+        # 編集権を検査してアクセス中の公演ユーザを取得する
+        # production はテンプレートで固定要素として表示する
+        self.prod_user = test_edit_permission(self)
+        self.production = self.prod_user.production
+        
+        return super().dispatch(request, *args, **kwargs)
+    
+    def form_valid(self, form):
+        '''バリデーションを通った時
+        '''
+        file = form.cleaned_data['file']
+        format = form.cleaned_data['format'] or guess_format(file.name)
+        result = import_rehearsals(self.production, read_rows(file, format),
+            batch_size=self.batch_size)
+        
+        if result.created:
+            messages.success(self.request,
+                f'{result.created} 件の TASK を追加しました。')
+        if result.error_count:
+            messages.warning(self.request,
+                f'{result.error_count} 行は追加できませんでした。')
+        
+        # 結果を表示し、続けて取り込めるよう空のフォームを出す
+        return self.render_to_response(self.get_context_data(
+            form=self.form_class(), result=result))
+    
+    def form_invalid(self, form):
+        '''取り込みに失敗した時
+        '''
+        messages.warning(self.request, "取り込めませんでした。")
+        return super().form_invalid(form)
+
+
 class RhslUpdate(ProdBaseUpdateView):
     '''Rehearsal の更新ビュー
     '''
@@ -254,10 +519,34 @@ class RhslUpdate(ProdBaseUpdateView):
         return url
 
 
-class RhslDetail(ProdBaseDetailView):
+class RhslDetail(ConditionalGetMixin, CachedPageMixin, ProdBaseDetailView):
     '''Rehearsal の詳細ビュー
+    
+    編集権のないメンバーには、キャッシュしたページを返す。
+    変わっていなければ 304 を返す
     '''
     model = Rehearsal
+    page_cache_name = 'rhsl_detail'
+    
+    def page_validator(self):
+        '''稽古と公演の更新日時から検証子を作る
+        
+        担当の名前が変わると稽古の、担当が外れると公演の更新日時が進む
+        '''
+        stamps = Rehearsal.objects.filter(id=self.kwargs['pk'])\
+            .values_list('production_id', 'version', 'updated_at',
+                'production__updated_at').first()
+        if stamps is None:
+            return None
+        prod_user = accessing_prod_user(self, stamps[0])
+        if not prod_user:
+            return None
+        return self.make_validator(prod_user, stamps)
+    
+    def get_queryset(self):
+        '''担当の表示名にユーザ名を使うので、一緒に取得する
+        '''
+        return super().get_queryset().select_related('assignee__user')
 
 
 class RhslDelete(ProdBaseDeleteView):
@@ -265,6 +554,11 @@ class RhslDelete(ProdBaseDeleteView):
     '''
     model = Rehearsal
     
+    def get_queryset(self):
+        '''担当の表示名にユーザ名を使うので、一緒に取得する
+        '''
+        return super().get_queryset().select_related('assignee__user')
+    
     def get_success_url(self):
         '''削除に成功した時の遷移先を動的に与える
         '''
@@ -277,19 +571,71 @@ class RhslDelete(ProdBaseDeleteView):
    
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+class RhslFeed(View):
+    '''締切の iCalendar フィード
+    
+    カレンダーアプリから取りに来るので、ログインの代わりに URL の
+    トークンでユーザを識別する。prod_id があればその公演だけ。
+    前回から変わっていなければ 304 を返す
+    '''
+    # カレンダーアプリが確認せずに使い回してよい秒数
+    max_age = 60
+    
+    def get(self, request, *args, **kwargs):
+        '''表示時のリクエストを受けるハンドラ
+        '''
+        calendar_token = CalendarToken.objects.select_related('user')\
+            .filter(token=kwargs['token']).first()
+        if calendar_token is None:
+            raise Http404
+        
+        feed = feeds.get_feed(calendar_token.user, kwargs.get('prod_id'),
+            host=request.get_host())
+        if feed is None:
+            raise Http404
+        
+        last_modified = int(feed['last_modified'])
+        response = get_conditional_response(request, etag=feed['etag'],
+            last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(feed['body'],
+                content_type='text/calendar; charset=utf-8')
+        response['ETag'] = feed['etag']
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, max_age=self.max_age)
+        return response
+
+
+class CalendarSettings(LoginRequiredMixin, TemplateView):
+    '''締切のフィードの URL を表示し、トークンを発行・失効させるビュー
+    
+    Template 名: calendar
+    '''
+    template_name = 'rehearsal/calendar.html'
+    
+    def get_context_data(self, **kwargs):
+        '''テンプレートに渡すパラメタを改変する
+        '''
+        context = super().get_context_data(**kwargs)
+        
+        # 公演ごとのフィードの URL も表示するため
+        context['calendar_token'] = CalendarToken.objects.filter(
+            user=self.request.user).first()
+        context['productions'] = Production.objects.filter(
+            produser__user=self.request.user,
+            deletion_requested_at__isnull=True).order_by('id')
+        
+        return context
+    
+    def post(self, request, *args, **kwargs):
+        '''発行・失効のリクエストを受けるハンドラ
+        
+        action=revoke なら失効させ、それ以外なら (作り直して) 発行する
+        '''
+        if request.POST.get('action') == 'revoke':
+            CalendarToken.objects.filter(user=request.user).delete()
+            messages.success(request, "カレンダーの URL を無効にしました。")
+        else:
+            CalendarToken.issue(request.user)
+            messages.success(request, "カレンダーの URL を発行しました。")
+        return redirect('rehearsal:calendar')